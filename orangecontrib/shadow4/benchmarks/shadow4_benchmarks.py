@@ -0,0 +1,203 @@
+import os, sys, json, time, platform, argparse, importlib, multiprocessing
+
+from orangecontrib.shadow4.util.shadow4_objects import ShadowData
+from orangecontrib.shadow4.util.shadow4_batch import ShadowWorkflow, ShadowBatchRunner
+from orangecontrib.shadow4.util.shadow4_profiling import ShadowProfiler, get_memory_usage, format_memory
+
+SOURCES = "orangecontrib.shadow4.widgets.sources."
+OPTICS  = "orangecontrib.shadow4.widgets.optics."
+TOOLS   = "orangecontrib.shadow4.widgets.tools."
+
+# representative pipelines: widgets (qualified name, title, settings) linked in a chain through their Shadow Data channels.
+# Sources get the number of rays of the benchmark.
+PIPELINES = {
+    "geometrical-mirror-screen"    : [(SOURCES + "ow_geometrical.OWGeometrical", "Geometrical Source", {}),
+                                      (OPTICS  + "ow_mirror.OWMirror",             "Mirror",             {}),
+                                      (OPTICS  + "ow_screen_slits.OWScreenSlits",  "Screen",             {})],
+    "undulator-crystal-plotxy"     : [(SOURCES + "ow_undulator.OWUndulator",       "Undulator",          {}),
+                                      (OPTICS  + "ow_crystal.OWCrystal",           "Crystal",            {"photon_energy" : 10500.0}), # undulator photon energy
+                                      (TOOLS   + "ow_plot_xy.PlotXY",              "Plot XY",            {})],
+    "wiggler-transfocator-caustic" : [(SOURCES + "ow_wiggler.OWWiggler",           "Wiggler",            {}),
+                                      (OPTICS  + "ow_transfocator.OWTransfocator", "Transfocator",       {}),
+                                      (TOOLS   + "ow_caustic.OWCaustic",           "Caustic",            {})],
+}
+
+NUMBERS_OF_RAYS = [10000, 100000, 1000000, 10000000]
+
+DEFAULT_TOLERANCE  = 0.10 # relative
+MINIMUM_STAGE_TIME = 0.05 # s: shorter stages are not compared (noise)
+
+class ShadowBenchmark:
+    # runs the pipelines headless (see ShadowBatchRunner), each (pipeline, number of rays) in a new process, so that
+    # the peak resident memory is the one of the benchmark. Reports wall time, throughput (rays/s), peak RSS, the wall
+    # time of the stages and the ray buffer copies of each widget (see ShadowProfiler); results are saved as a JSON
+    # baseline, and compared to a previous baseline to flag regressions.
+
+    def __init__(self, pipelines=None, numbers_of_rays=None, repetitions=1):
+        pipelines = list(PIPELINES.keys()) if pipelines is None else pipelines
+        for pipeline in pipelines:
+            if not pipeline in PIPELINES: raise ValueError("Pipeline " + pipeline + " not found (available: " + ", ".join(PIPELINES.keys()) + ")")
+        if repetitions < 1: raise ValueError("Repetitions must be >= 1")
+
+        self.__pipelines       = pipelines
+        self.__numbers_of_rays = NUMBERS_OF_RAYS if numbers_of_rays is None else numbers_of_rays
+        self.__repetitions     = repetitions
+
+    def run(self, verbose=True):
+        results = []
+        for pipeline in self.__pipelines:
+            for number_of_rays in self.__numbers_of_rays:
+                # best of the repetitions
+                result = None
+                for _ in range(self.__repetitions):
+                    with multiprocessing.get_context("spawn").Pool(processes=1, maxtasksperchild=1) as pool:
+                        current = pool.apply(_run_pipeline, (pipeline, number_of_rays))
+                    if result is None or current["wall"] < result["wall"]: result = current
+
+                results.append(result)
+
+                if verbose: print("%-30s %10d rays: %10.3f s, %12.0f rays/s, peak RSS %s" % (pipeline, number_of_rays, result["wall"], result["throughput"], format_memory(result["peak_rss"])))
+
+        return {"environment" : _get_environment(),
+                "results"     : results}
+
+    @classmethod
+    def write_baseline(cls, baseline, file_name):
+        with open(file_name, "w") as file: json.dump(baseline, file, indent=2)
+
+    @classmethod
+    def read_baseline(cls, file_name):
+        with open(file_name, "r") as file: return json.load(file)
+
+    @classmethod
+    def compare(cls, reference, current, tolerance=DEFAULT_TOLERANCE):
+        # regressions of current with respect to reference, for the benchmarks in both:
+        # [(pipeline, number of rays, quantity, reference value, current value)]
+        references  = {(result["pipeline"], result["number_of_rays"]) : result for result in reference["results"]}
+        regressions = []
+
+        for result in current["results"]:
+            key = (result["pipeline"], result["number_of_rays"])
+            if not key in references: continue
+
+            old = references[key]
+
+            if result["throughput"] < old["throughput"] * (1 - tolerance):
+                regressions.append(key + ("throughput", old["throughput"], result["throughput"]))
+            if not (result["peak_rss"] is None or old["peak_rss"] is None) and result["peak_rss"] > old["peak_rss"] * (1 + tolerance):
+                regressions.append(key + ("peak_rss", old["peak_rss"], result["peak_rss"]))
+
+            for widget, stages in result["stages"].items():
+                for stage, wall in stages.items():
+                    old_wall = old["stages"].get(widget, {}).get(stage, None)
+
+                    if not old_wall is None and max(wall, old_wall) >= MINIMUM_STAGE_TIME and wall > old_wall * (1 + tolerance):
+                        regressions.append(key + (widget + "/" + stage, old_wall, wall))
+
+            for widget, copies in result.get("copies", {}).items():
+                copied     = sum([total for _, total in copies.values()])
+                old_copied = sum([total for _, total in old.get("copies", {}).get(widget, {}).values()])
+
+                if widget in old.get("copies", {}) and copied > old_copied * (1 + tolerance):
+                    regressions.append(key + (widget + "/copied bytes", old_copied, copied))
+
+        return regressions
+
+def build_workflow(pipeline, number_of_rays):
+    workflow = ShadowWorkflow()
+
+    for index, (qualified_name, title, settings) in enumerate(PIPELINES[pipeline]):
+        settings = dict(settings)
+        if qualified_name.startswith(SOURCES): settings["number_of_rays"] = number_of_rays
+
+        workflow.add_node(str(index), title, qualified_name, settings)
+        if index > 0: workflow.add_link(str(index - 1), ShadowBatchRunner.SHADOW_DATA, str(index), _get_input_channel(qualified_name))
+
+    return workflow
+
+def _get_input_channel(qualified_name):
+    # the Shadow Data input of the widget ("Input Beam" for some tools)
+    module_name, class_name = qualified_name.rsplit(".", 1)
+    widget_class = getattr(importlib.import_module(module_name), class_name)
+
+    for input in getattr(widget_class, "inputs", []):
+        if isinstance(input, dict): name, input_type = input.get("name"), input.get("type")
+        else:                       name, input_type = input[0], input[1]
+
+        if input_type is ShadowData: return name
+
+    return ShadowBatchRunner.SHADOW_DATA
+
+def _run_pipeline(pipeline, number_of_rays):
+    # in the benchmark process
+    workflow = build_workflow(pipeline, number_of_rays)
+    runner   = ShadowBatchRunner(workflow)
+
+    ShadowProfiler.clear()
+
+    t0 = time.perf_counter()
+    runner.run(verbose=False)
+    wall = time.perf_counter() - t0
+
+    stages = {}
+    for record in ShadowProfiler.get_records():
+        widget_stages = stages.setdefault(record["widget"], {})
+        widget_stages[record["stage"]] = widget_stages.get(record["stage"], 0.0) + record["wall"]
+
+    return {"pipeline"       : pipeline,
+            "number_of_rays" : number_of_rays,
+            "wall"           : wall,
+            "throughput"     : number_of_rays / wall if wall > 0 else 0.0,
+            "peak_rss"       : get_memory_usage()[1],
+            "stages"         : stages,
+            "copies"         : {widget : ShadowProfiler.get_copies(widget) for widget in ShadowProfiler.get_widgets()}}
+
+def _get_environment():
+    from importlib.metadata import version
+
+    versions = {}
+    for distribution in ["OASYS1-shadow4", "shadow4", "numpy"]:
+        try:
+            versions[distribution] = version(distribution)
+        except Exception:
+            versions[distribution] = None
+
+    return {"date"      : time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python"    : platform.python_version(),
+            "platform"  : platform.platform(),
+            "cpu_count" : os.cpu_count(),
+            "versions"  : versions}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="shadow4-benchmark", description="Runs headless benchmarks of Shadow4 pipelines (throughput, peak memory, time per stage).")
+    parser.add_argument("-p", "--pipeline", action="append", default=None, choices=list(PIPELINES.keys()), help="pipeline to run (default: all). Repeatable")
+    parser.add_argument("-n", "--rays", type=int, nargs="+", default=None, help="numbers of rays (default: " + " ".join([str(n) for n in NUMBERS_OF_RAYS]) + ")")
+    parser.add_argument("-r", "--repetitions", type=int, default=1, help="runs of each benchmark, the fastest is kept (default: 1)")
+    parser.add_argument("-o", "--output", default=None, help="JSON file for the results (baseline)")
+    parser.add_argument("-c", "--compare", default=None, metavar="BASELINE", help="JSON baseline the results are compared to: exits with 1 on regressions")
+    parser.add_argument("-t", "--tolerance", type=float, default=DEFAULT_TOLERANCE, help="relative tolerance of the comparison (default: %g)" % DEFAULT_TOLERANCE)
+
+    arguments = parser.parse_args(argv)
+
+    try:
+        benchmark = ShadowBenchmark(arguments.pipeline, arguments.rays, arguments.repetitions)
+    except ValueError as error:
+        parser.error(str(error))
+
+    results = benchmark.run()
+
+    if not arguments.output is None: ShadowBenchmark.write_baseline(results, arguments.output)
+
+    if not arguments.compare is None:
+        regressions = ShadowBenchmark.compare(ShadowBenchmark.read_baseline(arguments.compare), results, arguments.tolerance)
+
+        for pipeline, number_of_rays, quantity, old, new in regressions:
+            print("REGRESSION %s %d rays, %s: %g -> %g (%+.1f%%)" % (pipeline, number_of_rays, quantity, old, new, 100 * (new - old) / old if old != 0 else 0.0))
+        print("%d regression(s) with respect to %s" % (len(regressions), arguments.compare))
+
+        if len(regressions) > 0: return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,33 @@
+import numpy
+import pytest
+
+from syned.beamline.element_coordinates import ElementCoordinates
+from syned.beamline.shape import Rectangle
+from shadow4.sources.source_geometrical.source_geometrical import SourceGeometrical
+from shadow4.beamline.optical_elements.absorbers.s4_screen import S4Screen, S4ScreenElement
+
+def get_source(nrays=20000, seed=5676561):
+    source = SourceGeometrical(nrays=nrays, seed=seed)
+    source.set_spatial_type_gaussian(1e-5, 3e-5)
+    source.set_angular_distribution_gaussian(1e-5, 2e-5)
+    source.set_energy_distribution_uniform(value_min=999, value_max=1001)
+
+    return source
+
+def get_beam(nrays=20000, seed=5676561, lost_every=3):
+    # beam with lost rays (one every lost_every) and uneven intensities
+    beam = get_source(nrays, seed).get_beam()
+    if lost_every > 0: beam.rays[::lost_every, 9] = -1
+    beam.rays[:, 6:9] *= numpy.random.default_rng(seed).random((beam.rays.shape[0], 1))
+
+    return beam
+
+def get_slit(input_beam=None, p=1.0, q=2.0):
+    # rays are lost, none is created
+    return S4ScreenElement(optical_element=S4Screen(name="slit", boundary_shape=Rectangle(-2e-5, 2e-5, -5e-5, 5e-5), i_stop=0),
+                           coordinates=ElementCoordinates(p=p, q=q, angle_radial=0.0, angle_azimuthal=0.0, angle_radial_out=numpy.pi),
+                           input_beam=input_beam)
+
+@pytest.fixture
+def beam():
+    return get_beam()
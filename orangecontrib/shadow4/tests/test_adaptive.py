@@ -0,0 +1,85 @@
+import numpy, pytest
+
+from orangecontrib.shadow4.util.shadow4_adaptive import ShadowBeamlineReplay, ShadowConvergence, run_until_converged, run_until_good_rays
+from orangecontrib.shadow4.util.shadow4_statistics import ShadowBeamStatistics
+from orangecontrib.shadow4.util.shadow4_beamline import ShadowBeamline
+from orangecontrib.shadow4.util.shadow4_objects import ShadowData
+from orangecontrib.shadow4.tests.conftest import get_source, get_slit
+
+RANGES = {1 : [-1e-4, 1e-4], 3 : [-2e-4, 2e-4]}
+
+def _get_data(nrays=20000):
+    source = get_source(nrays)
+    beam, _ = get_slit(source.get_beam()).trace_beam()
+
+    return ShadowData(beam=beam, beamline=ShadowBeamline(light_source=source, beamline_elements_list=[get_slit()]))
+
+def test_replay_as_s4beam():
+    data   = _get_data()
+    replay = ShadowBeamlineReplay(data.beamline, retrace_distance=0.5, generated_rays=20000)
+    output = replay.trace_increment(5000)
+
+    source   = get_source(5000, seed=5676561 + ShadowBeamlineReplay.SEED_OFFSET)
+    expected = source.get_beam()
+    expected.rays[:, 11] = numpy.arange(20001, 25001) # after the rays of the data
+    expected, _ = get_slit(expected).trace_beam()
+    expected.retrace(0.5)
+
+    assert numpy.allclose(output.rays, expected.rays)
+    assert replay.get_number_of_generated_rays() == 25000
+    assert data.beamline.get_light_source().get_nrays() == 20000 # not modified
+
+def test_run_until_converged():
+    data = _get_data()
+
+    output_data, convergence, stop_reason = run_until_converged(data, data.beam, [1, 3], RANGES, nbins=50, tolerance=0.2, increment=10000, time_budget=60.0)
+
+    assert stop_reason == ShadowConvergence.CONVERGED and convergence.is_converged(0.2)
+    assert output_data.get_number_of_generated_rays() == output_data.beam.get_number_of_rays(nolost=0) == convergence.get_curve()[-1][0]
+    assert numpy.array_equal(output_data.beam.get_blocks()[0], data.beam.rays)
+
+    # accumulated quantities as the ones of all the rays
+    statistics = ShadowBeamStatistics.get(output_data.beam)
+    quantities = convergence.get_quantities()
+    for column in [1, 3]:
+        ticket = statistics.histo1(column, xrange=RANGES[column], nbins=50, nolost=1, ref=23)
+
+        assert numpy.isclose(quantities["fwhm col%02d" % column], ticket["fwhm"])
+        assert numpy.isclose(quantities["sigma col%02d" % column], statistics.get_moments(column, nolost=1, ref=23)[2])
+    assert numpy.isclose(quantities["intensity/ray"], statistics.get_intensity(nolost=1) / output_data.get_number_of_generated_rays())
+
+def test_run_until_converged_within_the_maximum_number_of_rays():
+    data = _get_data()
+
+    output_data, _, stop_reason = run_until_converged(data, data.beam, [1, 3], RANGES, tolerance=1e-9, increment=10000, maximum_number_of_rays=45000)
+
+    assert stop_reason == ShadowConvergence.MAXIMUM_RAYS
+    assert output_data.get_number_of_generated_rays() == 40000
+
+def test_run_until_good_rays():
+    data      = _get_data()
+    good_rays = data.beam.get_number_of_rays(nolost=1)
+    monitor   = []
+
+    output_data, stop_reason = run_until_good_rays(data, data.beam, 3 * good_rays, increment=5000, monitor=monitor.append)
+
+    assert stop_reason == ShadowConvergence.GOOD_RAYS and len(monitor) > 0
+    assert output_data.beam.get_number_of_rays(nolost=2) == 0 and output_data.beam.get_number_of_rays(nolost=1) >= 3 * good_rays
+    assert numpy.array_equal(output_data.beam.get_blocks()[0], data.beam.rays[data.beam.rays[:, 9] > 0])
+
+    # lost rays are dropped, the generated ones are kept: same flux, within the statistical error
+    data.initial_flux        = 1e12
+    output_data.initial_flux = 1e12
+    assert output_data.get_number_of_generated_rays() > output_data.beam.get_number_of_rays(nolost=0)
+    assert numpy.isclose(output_data.get_flux(), data.get_flux(), rtol=0.05)
+
+def test_only_ensembles_are_replayed():
+    data     = _get_data(5000)
+    values   = ShadowData.initialize_as_stack([data.beam, data.beam], "seed", [1, 2], beamline=data.beamline)
+    ensemble = ShadowData.initialize_as_stack([data.beam, data.beam], "seed", [1, 2], beamline=data.beamline, ensemble=True)
+
+    # the beamline of the scanned values is the one of the last value
+    assert not values.is_replayable() and not values.get_stack_item(0).is_replayable()
+    assert ensemble.is_replayable() and ensemble.get_stack_item(0).is_replayable()
+    with pytest.raises(ValueError): run_until_good_rays(values, values.beam, 10000, increment=5000)
+    with pytest.raises(ValueError): run_until_converged(values.get_stack_item(0), values.get_stack_item(0).beam, [1, 3], RANGES)
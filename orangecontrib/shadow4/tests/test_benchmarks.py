@@ -0,0 +1,24 @@
+import os
+import pytest
+
+from orangecontrib.shadow4.benchmarks.shadow4_benchmarks import PIPELINES, ShadowBenchmark, _run_pipeline
+
+@pytest.fixture(autouse=True)
+def offscreen(monkeypatch):
+    if not "QT_QPA_PLATFORM" in os.environ: monkeypatch.setenv("QT_QPA_PLATFORM", "offscreen")
+
+@pytest.mark.parametrize("pipeline", list(PIPELINES.keys()))
+def test_pipeline_runs(pipeline):
+    for module in ["PyQt5", "orangewidget", "oasys"]: pytest.importorskip(module) # the widgets are run headless
+
+    result = _run_pipeline(pipeline, 1000)
+
+    assert result["number_of_rays"] == 1000
+    assert result["wall"] > 0
+    assert len(result["stages"]) > 0
+
+def test_compare_flags_regressions():
+    reference = {"results" : [{"pipeline" : "p", "number_of_rays" : 10, "throughput" : 100.0, "peak_rss" : 100, "stages" : {"w" : {"trace_beam" : 1.0}}}]}
+    current   = {"results" : [{"pipeline" : "p", "number_of_rays" : 10, "throughput" : 50.0, "peak_rss" : 100, "stages" : {"w" : {"trace_beam" : 1.05}}}]}
+
+    assert ShadowBenchmark.compare(reference, current) == [("p", 10, "throughput", 100.0, 50.0)]
@@ -0,0 +1,57 @@
+import numpy
+
+from shadow4.beam.s4_beam import S4Beam
+
+from orangecontrib.shadow4.util.shadow4_blocks import ShadowBlockBeam
+from orangecontrib.shadow4.tests.conftest import get_source, get_slit
+
+def _get_block_beam(beam, block_size=6000):
+    return ShadowBlockBeam(blocks=[beam.rays[start : start + block_size].copy() for start in range(0, beam.rays.shape[0], block_size)], block_size=block_size)
+
+def test_blocks_as_s4beam(beam):
+    blocks = _get_block_beam(beam)
+
+    assert len(blocks.get_blocks()) == 4
+    for nolost in (0, 1, 2): assert blocks.get_number_of_rays(nolost) == beam.get_number_of_rays(nolost)
+
+    assert numpy.array_equal(blocks.rays, beam.rays) # consolidated once: blocks are views from then on
+    assert all([numpy.shares_memory(block, blocks.rays) for block in blocks.get_blocks()])
+
+def test_generation_in_blocks():
+    blocks = ShadowBlockBeam.initialize_from_light_source(get_source(nrays=25000), block_size=10000)
+
+    assert [block.shape[0] for block in blocks.get_blocks()] == [10000, 10000, 5000]
+    assert numpy.array_equal(blocks.rays[:, 11], numpy.arange(1, 25001)) # ray_index across the blocks
+    assert numpy.array_equal(blocks.get_blocks()[0][:, :11], get_source(nrays=10000).get_beam().rays[:, :11]) # seed of the first block
+
+def test_duplicate_and_cleaning(beam):
+    blocks    = _get_block_beam(beam)
+    duplicate = blocks.duplicate()
+
+    assert not any([numpy.shares_memory(block, duplicate_block) for block, duplicate_block in zip(blocks.get_blocks(), duplicate.get_blocks())])
+
+    duplicate.clean_lost_rays()
+    expected = beam.duplicate()
+    expected.clean_lost_rays()
+
+    assert numpy.array_equal(numpy.concatenate(duplicate.get_blocks()), expected.rays)
+    assert duplicate.get_number_of_rays(nolost=0) == expected.get_number_of_rays(nolost=0) == beam.rays.shape[0]
+    assert numpy.array_equal(numpy.concatenate(blocks.get_blocks()), beam.rays)
+
+def test_trace_and_retrace_as_s4beam(beam):
+    expected, expected_footprint = get_slit(beam.duplicate()).trace_beam()
+    expected.retrace(10.0)
+
+    blocks            = _get_block_beam(beam)
+    output, footprint = blocks.trace_beamline_element(get_slit(blocks))
+    output.retrace(10.0)
+
+    assert isinstance(output, ShadowBlockBeam) and len(output.get_blocks()) == 4
+    assert numpy.allclose(numpy.concatenate(output.get_blocks()), expected.rays)
+    assert numpy.allclose(numpy.concatenate(footprint.get_blocks()), expected_footprint.rays)
+
+def test_write_h5_as_s4beam(beam, tmp_path):
+    file_name = str(tmp_path / "beam.h5")
+    _get_block_beam(beam).write_h5(file_name)
+
+    assert numpy.array_equal(S4Beam.load_h5(file_name).rays, beam.rays)
@@ -0,0 +1,64 @@
+import numpy
+
+from orangecontrib.shadow4.util.shadow4_cache import ShadowTraceCache
+from orangecontrib.shadow4.util.shadow4_out_of_core import ShadowMemoryMappedBeam
+from orangecontrib.shadow4.tests.conftest import get_beam, get_slit
+
+# beams of 20000 rays: 2.7 MB each
+
+def test_least_recently_used_entries_are_spilled(tmp_path):
+    cache = ShadowTraceCache(memory_budget=6, spill_directory=str(tmp_path))
+    beams = {key : get_beam(seed=seed) for seed, key in enumerate(["a", "b", "c"])}
+
+    cache.put("a", beams["a"], None, get_slit(beams["a"]))
+    cache.put("b", beams["b"], None, get_slit(beams["b"]))
+    assert cache.get("a")[0] is beams["a"] # "b" is now the least recently used
+    cache.put("c", beams["c"], None, get_slit(beams["c"]))
+
+    assert cache.get_number_of_entries() == (2, 1) and len(list(tmp_path.iterdir())) == 1
+
+    output_beam, footprint, element = cache.get("b") # loaded back, "a" spilled
+    assert numpy.array_equal(output_beam.rays, beams["b"].rays) and footprint is None
+    assert element.get_input_beam() is None
+    assert cache.get_number_of_entries() == (2, 1)
+
+    assert cache.get("d") is None
+    assert (cache.get_hits(), cache.get_misses()) == (2, 1)
+
+    cache.clear()
+    assert cache.get_number_of_entries() == (0, 0) and len(list(tmp_path.iterdir())) == 0
+
+def test_entries_over_the_budgets_are_dropped(tmp_path):
+    cache = ShadowTraceCache(memory_budget=3, spill=False)
+    cache.put("a", get_beam(seed=1), None, get_slit())
+    cache.put("b", get_beam(seed=2), None, get_slit())
+
+    assert cache.get_number_of_entries() == (1, 0) and cache.get("a") is None
+
+    cache = ShadowTraceCache(memory_budget=3, disk_budget=4, spill_directory=str(tmp_path))
+    for seed, key in enumerate(["a", "b", "c"]): cache.put(key, get_beam(seed=seed), None, get_slit())
+
+    assert cache.get_number_of_entries() == (1, 1) and cache.get("a") is None and not cache.get("b") is None
+
+def test_cached_beams_are_frozen():
+    cache = ShadowTraceCache()
+    beam  = get_beam()
+    cache.put("a", beam, None, get_slit(beam))
+
+    assert not beam.rays.flags.writeable
+
+def test_memory_mapped_beams_do_not_count_in_memory(tmp_path):
+    cache = ShadowTraceCache(memory_budget=0, spill_directory=str(tmp_path))
+    cache.put("a", ShadowMemoryMappedBeam.initialize_from_beam(get_beam(), scratch_directory=str(tmp_path)), None, get_slit())
+
+    assert cache.get_memory_size() == 0 and cache.get_number_of_entries() == (1, 0) # not in memory
+
+def test_light_sources_seeded_by_the_clock_are_not_cached():
+    class _Source:
+        def __init__(self, seed): self.seed = seed
+
+    cache = ShadowTraceCache(spill=False)
+    for seed in [0, 5676561]: cache.put(ShadowTraceCache.get_key(None, _Source(seed)), get_beam(nrays=1000), None, None)
+
+    assert ShadowTraceCache.get_key(None, _Source(0)) is None
+    assert cache.get_number_of_entries() == (1, 0) and not cache.get(ShadowTraceCache.get_key(None, _Source(5676561))) is None
@@ -0,0 +1,78 @@
+import tracemalloc
+import numpy
+import pytest
+
+from shadow4.beam.s4_beam import S4Beam
+
+from orangecontrib.shadow4.util.shadow4_engine import ShadowParallelTracer
+from orangecontrib.shadow4.tests.conftest import get_beam, get_slit as get_element
+
+def test_serial_trace_in_blocks_as_single_trace():
+    beam = get_beam(nrays=250000, lost_every=0)
+
+    expected, expected_footprint = get_element(beam).trace_beam()
+
+    element   = get_element(beam)
+    fractions = []
+    output, footprint = ShadowParallelTracer(1).trace_beamline_element(element, monitor=fractions.append)
+
+    assert numpy.array_equal(output.rays, expected.rays)
+    assert numpy.array_equal(footprint.rays, expected_footprint.rays)
+    assert len(fractions) == ShadowParallelTracer.BLOCKS_PER_WORKER # 62500 rays each
+    assert fractions == sorted(fractions) and fractions[-1] == 1.0
+    assert element.get_input_beam() is beam
+
+def test_serial_trace_is_cancelled_between_blocks():
+    beam    = get_beam(nrays=250000, lost_every=0)
+    element = get_element(beam)
+
+    def monitor(fraction):
+        if fraction < 1.0: raise KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt): ShadowParallelTracer(1).trace_beamline_element(element, monitor=monitor)
+
+    assert element.get_input_beam() is beam
+
+def test_empty_beam():
+    beam = S4Beam(N=0)
+    beam.rays = numpy.zeros((0, 18))
+
+    output, _ = ShadowParallelTracer(1).trace_beamline_element(get_element(beam))
+
+    assert output.rays.shape == (0, 18)
+
+def test_serial_trace_in_blocks_makes_no_extra_copy():
+    beam = get_beam(nrays=200000, lost_every=0)
+
+    peaks = []
+    for trace in [lambda: get_element(beam).trace_beam(), lambda: ShadowParallelTracer(1).trace_beamline_element(get_element(beam))]:
+        tracemalloc.start()
+        try:
+            output = trace()
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+        del output
+
+    # temporaries of one block (a quarter of the rays) only: joining the blocks would copy the whole output again
+    assert peaks[1] < peaks[0] + 0.5 * beam.rays.nbytes
+
+def test_single_precision_is_traced_in_double_precision_blocks():
+    beam   = get_beam(nrays=200000, lost_every=0)
+    single = S4Beam(N=0)
+    single.rays = beam.rays.astype(numpy.float32)
+
+    expected, _ = get_element(S4Beam.initialize_from_array(single.rays.astype(numpy.float64))).trace_beam()
+
+    peaks = []
+    for input_beam in [beam, single]:
+        tracemalloc.start()
+        try:
+            output, footprint = ShadowParallelTracer(1).trace_beamline_element(get_element(input_beam))
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+
+    assert output.rays.dtype == footprint.rays.dtype == numpy.float32
+    assert numpy.array_equal(output.rays, expected.rays.astype(numpy.float32))
+    assert peaks[1] < peaks[0] # no double precision copy of the whole beam
@@ -0,0 +1,99 @@
+import os
+import pytest
+
+from shadow4.beamline.s4_beamline import S4Beamline
+
+from orangecontrib.shadow4.util import shadow4_fingerprint
+from orangecontrib.shadow4.util.shadow4_fingerprint import ShadowFingerprint
+from orangecontrib.shadow4.util.shadow4_beamline import ShadowBeamline
+from orangecontrib.shadow4.util.shadow4_objects import ShadowData
+from orangecontrib.shadow4.util.shadow4_blocks import ShadowBlockBeam
+from orangecontrib.shadow4.util.shadow4_out_of_core import ShadowMemoryMappedBeam
+from orangecontrib.shadow4.tests.conftest import get_source, get_slit, get_beam
+
+def test_beamline_fingerprint_is_chained(monkeypatch):
+    beamline = ShadowBeamline(light_source=get_source())
+    beamline.append_beamline_element(get_slit(p=1.0))
+    beamline.append_beamline_element(get_slit(p=2.0))
+
+    expected = ShadowFingerprint.get_beamline_fingerprint(beamline)
+
+    def full_script(self, **kwargs): raise AssertionError("full script generated")
+    monkeypatch.setattr(S4Beamline, "to_python_code", full_script)
+
+    same = ShadowBeamline(light_source=get_source(), beamline_elements_list=[get_slit(p=1.0), get_slit(p=2.0)])
+    assert ShadowFingerprint.get_beamline_fingerprint(same) == expected
+
+    other = beamline.duplicate()
+    other.append_beamline_element(get_slit(p=3.0))
+    longer = beamline.duplicate()
+    longer.append_beamline_element(get_slit(p=3.0))
+
+    assert ShadowFingerprint.get_beamline_fingerprint(other) == ShadowFingerprint.get_beamline_fingerprint(longer) != expected
+    assert ShadowFingerprint.get_beamline_fingerprint(beamline) == expected # ancestor unchanged
+
+    swapped = ShadowBeamline(light_source=get_source(), beamline_elements_list=[get_slit(p=2.0), get_slit(p=1.0)])
+    assert ShadowFingerprint.get_beamline_fingerprint(swapped) != expected
+
+    reseeded = beamline.duplicate()
+    reseeded.set_light_source(get_source(seed=1))
+    assert ShadowFingerprint.get_beamline_fingerprint(reseeded) != expected
+
+def test_beam_fingerprint_is_the_content(beam, tmp_path):
+    expected = ShadowFingerprint.get_beam_fingerprint(beam)
+
+    blocks = ShadowBlockBeam(blocks=[beam.rays[:7000].copy(), beam.rays[7000:].copy()])
+    mapped = ShadowMemoryMappedBeam.initialize_from_beam(beam, memory_budget=1, scratch_directory=str(tmp_path))
+
+    assert ShadowFingerprint.get_beam_fingerprint(blocks) == ShadowFingerprint.get_beam_fingerprint(mapped) == expected # chunking independent
+    assert ShadowFingerprint.get_beam_fingerprint(beam.duplicate()) == expected
+
+    changed = beam.duplicate()
+    changed.rays[12345, 0] += 1e-12
+    assert ShadowFingerprint.get_beam_fingerprint(changed) != expected
+
+    sampled = ShadowFingerprint.get_beam_fingerprint(beam, sample_size=100)
+    assert sampled != expected and ShadowFingerprint.get_beam_fingerprint(blocks, sample_size=100) == sampled
+    assert ShadowFingerprint.get_beam_fingerprint(beam, sample_size=beam.rays.shape[0]) == expected
+
+    single = beam.duplicate()
+    single.rays = single.rays.astype("float32")
+    assert ShadowFingerprint.get_beam_fingerprint(single) != expected
+
+def test_data_fingerprint(beam):
+    data = ShadowData(beam=beam, beamline=ShadowBeamline(light_source=get_source()))
+
+    assert data.get_fingerprint() == data.duplicate().get_fingerprint()
+    assert data.get_fingerprint() != ShadowData(beam=get_beam(seed=1), beamline=data.beamline).get_fingerprint()
+
+def test_settings_fingerprint_follows_files(monkeypatch, tmp_path):
+    class Setting:
+        def __init__(self, default): self.default = default
+
+    monkeypatch.setattr(shadow4_fingerprint, "Setting", Setting)
+
+    file_name = str(tmp_path / "reflectivity.dat")
+    with open(file_name, "w") as file: file.write("1 2 3\n")
+
+    class Widget:
+        file_refl = Setting("")
+        angle     = Setting(1.0)
+        helper    = 3
+
+    widget           = Widget()
+    widget.file_refl = file_name
+    widget.angle     = 2.0
+
+    assert ShadowFingerprint.get_settings(widget) == {"angle" : 2.0, "file_refl" : file_name}
+
+    fingerprint          = ShadowFingerprint.get_settings_fingerprint(widget)
+    excluded_fingerprint = ShadowFingerprint.get_settings_fingerprint(widget, excluded=["file_refl"])
+    assert ShadowFingerprint.get_settings_fingerprint(widget) == fingerprint
+
+    with open(file_name, "w") as file: file.write("1 2 3 4\n") # regenerated, same name
+    assert ShadowFingerprint.get_settings_fingerprint(widget) != fingerprint
+    assert ShadowFingerprint.get_settings_fingerprint(widget, excluded=["file_refl"]) == excluded_fingerprint
+
+    fingerprint = ShadowFingerprint.get_settings_fingerprint(widget)
+    os.utime(file_name, ns=(0, 0))
+    assert ShadowFingerprint.get_settings_fingerprint(widget) != fingerprint
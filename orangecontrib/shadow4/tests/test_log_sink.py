@@ -0,0 +1,51 @@
+import io, sys
+
+import pytest
+
+pytest.importorskip("PyQt5")
+
+from orangecontrib.shadow4.widgets.gui.log_sink import _StdoutDispatcher
+
+def test_original_stdout_is_restored_after_the_last_capture(monkeypatch):
+    original = io.StringIO()
+    monkeypatch.setattr(sys, "stdout", original)
+
+    dispatcher = _StdoutDispatcher()
+    first, second = io.StringIO(), io.StringIO()
+
+    dispatcher.attach(first)
+    dispatcher.attach(second)
+    assert sys.stdout is dispatcher
+
+    print("second", end="")
+    dispatcher.detach(second)
+    print("first", end="")
+    assert sys.stdout is dispatcher
+
+    dispatcher.detach(first)
+    assert sys.stdout is original
+
+    print("original", end="")
+    assert (first.getvalue(), second.getvalue(), original.getvalue()) == ("first", "second", "original")
+
+def test_stream_set_during_captures_is_not_adopted(monkeypatch):
+    original, foreign = io.StringIO(), io.StringIO()
+    monkeypatch.setattr(sys, "stdout", original)
+
+    dispatcher = _StdoutDispatcher()
+    first, second = io.StringIO(), io.StringIO()
+
+    dispatcher.attach(first)
+    sys.stdout = foreign # e.g. a redirect of other code
+    dispatcher.attach(second)
+    dispatcher.detach(second)
+    dispatcher.detach(first)
+
+    assert sys.stdout is original
+
+    # idle: the stream in place at the next capture is the original one
+    sys.stdout = foreign
+    dispatcher.attach(first)
+    dispatcher.detach(first)
+
+    assert sys.stdout is foreign
@@ -0,0 +1,123 @@
+import numpy
+
+from orangecontrib.shadow4.util.shadow4_objects import ShadowData
+from orangecontrib.shadow4.util.shadow4_blocks import ShadowBlockBeam
+from orangecontrib.shadow4.util.shadow4_out_of_core import ShadowMemoryMappedBeam
+from orangecontrib.shadow4.tests.conftest import get_beam
+
+def test_compact_lost_rays(beam):
+    compacted = ShadowData.compact_lost_rays(beam, threshold=0.1)
+
+    assert numpy.array_equal(compacted.rays, beam.rays[beam.rays[:, 9] > 0])
+    assert compacted.get_number_of_rays(nolost=0) == beam.rays.shape[0] # N_cleaned
+    assert ShadowData.compact_lost_rays(beam, threshold=0.5) is beam     # a third of the rays is lost
+
+def test_compact_lost_rays_of_chunked_beams(beam, tmp_path):
+    good_rays = beam.rays[beam.rays[:, 9] > 0]
+
+    blocks    = ShadowBlockBeam(blocks=[beam.rays[start : start + 6000].copy() for start in range(0, beam.rays.shape[0], 6000)])
+    compacted = ShadowData.compact_lost_rays(blocks)
+
+    assert isinstance(compacted, ShadowBlockBeam)
+    assert numpy.array_equal(numpy.concatenate(list(compacted.iterate_chunks())), good_rays)
+
+    mapped    = ShadowMemoryMappedBeam.initialize_from_beam(beam, memory_budget=1, scratch_directory=str(tmp_path))
+    compacted = ShadowData.compact_lost_rays(mapped)
+
+    assert isinstance(compacted, ShadowMemoryMappedBeam) # not pulled into memory
+    assert compacted.get_file_name() != mapped.get_file_name() and compacted.get_scratch_directory() == str(tmp_path)
+    assert numpy.array_equal(numpy.asarray(compacted.rays), good_rays)
+    assert compacted.get_number_of_rays(nolost=0) == beam.rays.shape[0]
+
+def test_flux_of_compacted_data(beam):
+    data = ShadowData(beam=beam)
+    data.initial_flux = 1e12
+
+    compacted = ShadowData(beam=ShadowData.compact_lost_rays(beam))
+    compacted.initial_flux             = data.initial_flux
+    compacted.number_of_generated_rays = data.get_number_of_generated_rays()
+
+    assert numpy.isclose(compacted.get_flux(), data.get_flux())
+    assert compacted.get_number_of_rays(nolost=2) == data.get_number_of_rays(nolost=2)
+
+def test_duplicate_is_copy_on_write(beam):
+    data      = ShadowData(beam=beam)
+    duplicate = data.duplicate()
+    expected  = beam.rays.copy()
+
+    assert numpy.shares_memory(duplicate.beam.rays, beam.rays)
+    assert not beam.rays.flags.writeable and not duplicate.beam.rays.flags.writeable # frozen for the producer too
+
+    data.mutable_beam().rays[:, 0] = 0.0
+    duplicate.mutable_beam().rays[:, 1] = 0.0
+
+    assert numpy.array_equal(duplicate.beam.rays[:, 0], expected[:, 0])
+    assert numpy.array_equal(data.beam.rays[:, 1], expected[:, 1])
+    assert not numpy.shares_memory(data.beam.rays, duplicate.beam.rays)
+
+def test_mutable_beam_of_blocks(beam):
+    data      = ShadowData(beam=ShadowBlockBeam(blocks=[beam.rays[:5000].copy(), beam.rays[5000:].copy()]))
+    duplicate = data.duplicate()
+    blocks    = duplicate.beam.get_blocks()
+
+    data.mutable_beam().get_blocks()[0][:, 0] = 0.0
+
+    assert numpy.array_equal(duplicate.beam.get_blocks()[0], blocks[0])
+    assert numpy.array_equal(duplicate.beam.get_blocks()[0][:, 0], beam.rays[:5000, 0])
+
+def test_merge_beams_as_concatenation():
+    beams = [get_beam(nrays=nrays, seed=seed) for nrays, seed in [(1000, 1), (2000, 2), (1500, 3)]]
+    data  = [ShadowData(beam=beam) for beam in beams]
+    for input_data, flux in zip(data, [1e10, 2e10, 3e10]): input_data.initial_flux = flux
+
+    expected        = numpy.concatenate([beam.rays for beam in beams])
+    expected[:, 11] = numpy.arange(1, expected.shape[0] + 1) # ray_index
+    merged          = ShadowData.merge_beams(*data, None, merge_history=0) # unconnected inputs are skipped
+
+    assert numpy.array_equal(merged.beam.rays, expected)
+    assert merged.initial_flux == 6e10
+    assert ShadowData.merge_beams(*data, which_flux=2, merge_history=0).initial_flux == 2e10
+
+    weighted = ShadowData.merge_beams(*data, weights=[1.0, 0.5, 2.0], merge_history=0)
+    for start, stop, weight in [(0, 1000, 1.0), (1000, 3000, 0.5), (3000, 4500, 2.0)]:
+        assert numpy.allclose(weighted.beam.get_column(23)[start : stop], weight * merged.beam.get_column(23)[start : stop])
+
+    blocks = ShadowData.merge_beams(ShadowData(beam=ShadowBlockBeam(blocks=[beams[0].rays.copy()])), *data[1:], merge_history=0)
+    assert isinstance(blocks.beam, ShadowBlockBeam)
+    assert numpy.array_equal(numpy.concatenate(list(blocks.beam.iterate_chunks())), expected)
+
+def test_flux_of_merged_compacted_data():
+    # as the Beam Cleaner outputs
+    beams     = [get_beam(nrays=nrays, seed=seed) for nrays, seed in [(3000, 1), (2000, 2)]]
+    data      = [ShadowData(beam=beam) for beam in beams]
+    compacted = [ShadowData(beam=ShadowData.compact_lost_rays(beam)) for beam in beams]
+    for input_data, compacted_data in zip(data, compacted):
+        input_data.initial_flux                 = 1e12
+        compacted_data.initial_flux             = 1e12
+        compacted_data.number_of_generated_rays = input_data.get_number_of_generated_rays()
+
+    expected = ShadowData.merge_beams(*data, merge_history=0)
+    merged   = ShadowData.merge_beams(*compacted, merge_history=0)
+
+    assert merged.get_number_of_generated_rays() == 5000
+    assert numpy.isclose(merged.get_flux(), expected.get_flux())
+    assert merged.get_number_of_rays(2) == expected.get_number_of_rays(2) > 0
+
+def test_flux_of_compacted_stack_items():
+    beams     = [get_beam(nrays=nrays, seed=seed) for nrays, seed in [(3000, 1), (2000, 2)]]
+    expected  = ShadowData.initialize_as_stack(beams, "seed", [1, 2])
+    compacted = ShadowData.initialize_as_stack([ShadowData.compact_lost_rays(beam) for beam in beams], "seed", [1, 2], generated_rays=[3000, 2000])
+    for stack in [expected, compacted]: stack.initial_flux = 1e12
+
+    assert compacted.get_number_of_generated_rays() == 5000
+    assert numpy.isclose(compacted.get_flux(), expected.get_flux())
+
+    for index in range(2):
+        item, expected_item = compacted.get_stack_item(index), expected.get_stack_item(index)
+
+        assert item.get_number_of_generated_rays() == expected_item.get_number_of_rays(0)
+        assert numpy.isclose(item.get_flux(), expected_item.get_flux())
+        assert item.get_number_of_rays(2) == expected_item.get_number_of_rays(2)
+
+    traced = compacted.duplicate() # downstream elements keep the scanning data
+    assert traced.get_stack_item(1).get_number_of_generated_rays() == 2000
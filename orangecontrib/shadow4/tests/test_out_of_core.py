@@ -0,0 +1,54 @@
+import os, numpy
+
+from shadow4.beam.s4_beam import S4Beam
+
+from orangecontrib.shadow4.util.shadow4_out_of_core import ShadowMemoryMappedBeam
+from orangecontrib.shadow4.tests.conftest import get_slit
+
+def _get_mapped_beam(beam, tmp_path):
+    # 1 MB budget: 910 rays per chunk
+    return ShadowMemoryMappedBeam.initialize_from_beam(beam, memory_budget=1, scratch_directory=str(tmp_path))
+
+def test_chunks_as_s4beam(beam, tmp_path):
+    mapped = _get_mapped_beam(beam, tmp_path)
+
+    assert isinstance(mapped.rays, numpy.memmap) and mapped.get_file_name().startswith(str(tmp_path))
+    assert len(list(mapped.iterate_chunks())) == int(numpy.ceil(beam.rays.shape[0] / mapped.get_chunk_size())) > 1
+    assert numpy.array_equal(numpy.concatenate(list(mapped.iterate_chunks())), beam.rays)
+
+    for nolost in (0, 1, 2): assert mapped.get_number_of_rays(nolost) == beam.get_number_of_rays(nolost)
+
+def test_duplicate_is_a_new_file(beam, tmp_path):
+    mapped    = _get_mapped_beam(beam, tmp_path)
+    duplicate = mapped.duplicate()
+
+    assert isinstance(duplicate, ShadowMemoryMappedBeam) and duplicate.get_file_name() != mapped.get_file_name()
+    assert numpy.array_equal(numpy.asarray(duplicate.rays), beam.rays)
+
+    duplicate.rays[:, 0] = 0.0
+    assert numpy.array_equal(numpy.asarray(mapped.rays), beam.rays)
+
+def test_trace_and_retrace_as_s4beam(beam, tmp_path):
+    expected, expected_footprint = get_slit(beam.duplicate()).trace_beam()
+    expected.retrace(10.0)
+
+    mapped            = _get_mapped_beam(beam, tmp_path)
+    output, footprint = mapped.trace_beamline_element(get_slit(mapped))
+    output.retrace(10.0)
+
+    assert isinstance(output, ShadowMemoryMappedBeam) and isinstance(footprint, ShadowMemoryMappedBeam)
+    assert numpy.allclose(numpy.asarray(output.rays), expected.rays)
+    assert numpy.allclose(numpy.asarray(footprint.rays), expected_footprint.rays)
+
+def test_write_h5_as_s4beam(beam, tmp_path):
+    file_name = str(tmp_path / "beam.h5")
+    _get_mapped_beam(beam, tmp_path).write_h5(file_name)
+
+    assert numpy.array_equal(S4Beam.load_h5(file_name).rays, beam.rays)
+
+def test_files_are_removed_with_the_beam(beam, tmp_path):
+    mapped    = _get_mapped_beam(beam, tmp_path)
+    file_name = mapped.get_file_name()
+
+    del mapped
+    assert not os.path.exists(file_name)
@@ -0,0 +1,20 @@
+from orangecontrib.shadow4.util import shadow4_profiling
+from orangecontrib.shadow4.util.shadow4_profiling import ShadowProfiler
+
+def test_peak_increase_of_nested_stages_is_not_double_counted(monkeypatch):
+    # VmHWM [MB]: 100 at the start of the run, 150 after the nested trace, 170 after the run
+    peaks = iter([peak * 2**20 for peak in [100, 100, 150, 170]])
+    monkeypatch.setattr(shadow4_profiling, "get_memory_usage", lambda: (0, next(peaks)))
+
+    ShadowProfiler.clear("Widget")
+    ShadowProfiler.start_run("Widget")
+    with ShadowProfiler.stage("run", "Widget"):
+        with ShadowProfiler.stage("trace"): pass
+
+    records = {record["stage"] : record for record in ShadowProfiler.get_records("Widget", last_run=True)}
+    assert (records["trace"]["depth"], records["trace"]["peak_increase"]) == (1, 50 * 2**20)
+    assert (records["run"]["depth"], records["run"]["peak_increase"])     == (0, 70 * 2**20)
+
+    assert "(peak increase 70.0 MB)" in ShadowProfiler.get_run_summary("Widget") # not 120 MB
+
+    ShadowProfiler.clear("Widget")
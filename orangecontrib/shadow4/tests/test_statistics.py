@@ -0,0 +1,113 @@
+import numpy
+
+from orangecontrib.shadow4.util.shadow4_statistics import ShadowBeamStatistics
+from orangecontrib.shadow4.util.shadow4_objects import ShadowData
+from orangecontrib.shadow4.util.shadow4_blocks import ShadowBlockBeam
+
+def test_duplicate_keeps_its_statistics_after_mutation(beam):
+    data = ShadowData(beam=beam)
+    data.get_statistics().get_number_of_rays(nolost=1) # attached before the duplicate: shared
+
+    duplicate = data.duplicate()
+    expected  = duplicate.beam.rays[:, 0].copy()
+
+    data.mutable_beam().rays[:, 0] = 1.0
+
+    statistics = duplicate.get_statistics()
+    ticket     = statistics.histo1(1, nbins=50, nolost=0, ref=0)
+
+    assert numpy.allclose(ticket["xrange"], [expected.min(), expected.max()])
+    assert numpy.allclose(statistics.get_column(1), expected)
+    assert numpy.allclose(statistics.get_column(20), duplicate.beam.get_column(20))
+    assert statistics.get_number_of_rays(nolost=1) == duplicate.beam.get_number_of_rays(nolost=1)
+    assert data.get_statistics().histo1(1, nbins=50, nolost=0, ref=0)["xrange"] == [1.0, 1.0]
+
+def test_statistics_are_memoised_per_buffer(beam):
+    statistics = ShadowBeamStatistics.get(beam)
+
+    assert ShadowBeamStatistics.get(beam) is statistics and not beam.rays.flags.writeable
+
+    ticket = statistics.histo1(1, nbins=50, nolost=1, ref=23)
+    ticket["histogram"][:] = 0.0 # callers get copies of the memoised tickets
+    assert numpy.allclose(statistics.histo1(1, nbins=50, nolost=1, ref=23)["histogram"], beam.histo1(1, nbins=50, nolost=1, ref=23)["histogram"])
+
+    duplicate = ShadowData(beam=beam).duplicate()
+    assert duplicate.get_statistics() is statistics # same frozen buffer
+
+    beam.rays = beam.rays.copy() # new buffer
+    assert not ShadowBeamStatistics.get(beam) is statistics and duplicate.get_statistics() is statistics
+
+    beam.clean_lost_rays() # N_cleaned
+    assert ShadowBeamStatistics.get(beam).get_number_of_rays(nolost=2) == 0
+
+    cleaned = ShadowBeamStatistics.get(beam)
+    ShadowBeamStatistics.invalidate(beam)
+    assert not ShadowBeamStatistics.get(beam) is cleaned
+
+def test_reductions_as_s4beam(beam):
+    statistics = ShadowBeamStatistics.get(beam)
+
+    for nolost in (0, 1, 2):
+        assert statistics.get_number_of_rays(nolost) == int(numpy.count_nonzero(_selection(beam, nolost)))
+        assert numpy.allclose(statistics.get_column(26, nolost), beam.get_column(26, nolost=nolost))
+        assert numpy.isclose(statistics.get_intensity(nolost), beam.intensity(nolost=nolost))
+
+    total, average, sigma = statistics.get_moments(1, nolost=1, ref=23)
+    values, weights       = beam.get_column(1, nolost=1), beam.get_column(23, nolost=1)
+
+    assert numpy.isclose(total, weights.sum())
+    assert numpy.isclose(average, numpy.average(values, weights=weights))
+    assert numpy.isclose(sigma, numpy.sqrt(numpy.average((values - average)**2, weights=weights)))
+
+def test_chunked_reductions_as_in_memory(beam):
+    blocks     = ShadowBlockBeam(blocks=[beam.rays[start : start + 7000].copy() for start in range(0, beam.rays.shape[0], 7000)], block_size=7000)
+    statistics = ShadowBeamStatistics.get(blocks)
+    expected   = ShadowBeamStatistics(beam)
+
+    assert len(list(statistics.iterate_chunks())) == 3
+    assert statistics.get_number_of_rays(1) == expected.get_number_of_rays(1)
+    assert statistics.get_column_range(3, 1) == expected.get_column_range(3, 1)
+    assert numpy.allclose(statistics.get_moments(4, 1, 23), expected.get_moments(4, 1, 23))
+    assert statistics.get_digest() == expected.get_digest()
+
+HISTOGRAMS = [("histo2", 1, 3, 100, 100, None, None, 1, 23),
+              ("histo2", 4, 6, 100, 100, None, None, 1, 23),
+              ("histo1", 26, None, 100, 1, 23),
+              ("histo1", 1, [-5e-5, 5e-5], 50, 0, 0),
+              ("histo2", 1, 3, 20, 30, [-1e-5, 1e-5], None, 2, 0)]
+
+def test_batched_histograms_as_s4beam(beam):
+    blocks   = ShadowBlockBeam(blocks=[beam.rays[start : start + 7000].copy() for start in range(0, beam.rays.shape[0], 7000)], block_size=7000)
+    expected = [_s4beam_ticket(beam, request) for request in HISTOGRAMS]
+
+    for tested_beam in [beam, blocks]:
+        statistics = ShadowBeamStatistics(tested_beam)
+
+        for ticket, expected_ticket in zip(statistics.compute_histograms(HISTOGRAMS), expected): _assert_same_ticket(ticket, expected_ticket)
+        _assert_same_ticket(statistics.histo2(4, 6, nbins=100, nolost=1, ref=23), expected[1]) # memoised
+
+def test_batched_histograms_of_empty_selection(beam):
+    beam.rays[:, 9] = -1
+    requests = [("histo1", 1, None, 10, 1, 23), ("histo2", 1, 3, 10, 10, None, None, 1, 23)]
+
+    for ticket, request in zip(ShadowBeamStatistics(beam).compute_histograms(requests), requests): _assert_same_ticket(ticket, _s4beam_ticket(beam, request))
+
+def _s4beam_ticket(beam, request):
+    if request[0] == "histo1":
+        _, col, xrange, nbins, nolost, ref = request
+        return beam.histo1(col, xrange=xrange, nbins=nbins, nolost=nolost, ref=ref)
+    else:
+        _, col_h, col_v, nbins_h, nbins_v, xrange, yrange, nolost, ref = request
+        return beam.histo2(col_h, col_v, nbins_h=nbins_h, nbins_v=nbins_v, xrange=xrange, yrange=yrange, nolost=nolost, ref=ref)
+
+def _assert_same_ticket(ticket, expected):
+    assert set(ticket.keys()) == set(expected.keys())
+
+    for key, value in expected.items():
+        if value is None or isinstance(value, str): assert ticket[key] == value, key
+        else:                                       assert numpy.allclose(numpy.asarray(ticket[key], dtype=float), numpy.asarray(value, dtype=float), rtol=1e-10, equal_nan=True), key
+
+def _selection(beam, nolost):
+    if nolost == 0:   return numpy.ones(beam.rays.shape[0], dtype=bool)
+    elif nolost == 1: return beam.rays[:, 9] > 0
+    else:             return beam.rays[:, 9] < 0
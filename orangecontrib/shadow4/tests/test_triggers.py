@@ -0,0 +1,40 @@
+import pytest
+
+pytest.importorskip("oasys")
+
+from orangecontrib.shadow4.util.shadow4_util import TriggerToolsDecorator
+from orangecontrib.shadow4.util.shadow4_objects import ShadowData
+from orangecontrib.shadow4.tests.conftest import get_beam
+
+class _Widget(TriggerToolsDecorator):
+    # one Shadow Data per run, sent before returning
+    def __init__(self):
+        self.seed = 0
+        self.sent = []
+
+    def run_shadow4(self):
+        self.send("Shadow Data", ShadowData(beam=get_beam(nrays=1000 + self.seed, seed=self.seed)))
+        self.send("Trigger", None)
+
+    def send(self, signal_name, value):
+        self.sent.append((signal_name, value))
+
+def test_runs_per_value_are_sent_as_one_stack():
+    widget = _Widget()
+    widget.run_shadow4_for_values("seed", [1, 2, 3], "Seed")
+
+    assert [signal_name for signal_name, _ in widget.sent] == ["Shadow Data", "Trigger"]
+
+    output_data = widget.sent[0][1]
+    assert output_data.scanning_data.scanned_variable_value == [1, 2, 3]
+    for index, seed in enumerate([1, 2, 3]):
+        assert output_data.get_stack_item(index).beam.N == 1000 + seed
+
+    # settings restored, the beamline is the one of the last value
+    assert widget.seed == 0
+    assert not output_data.is_replayable()
+
+def test_widgets_without_runs_reject_batched_triggers():
+    class _Tool(TriggerToolsDecorator): pass
+
+    with pytest.raises(ValueError, match="does not support batched triggers"): _Tool().run_shadow4_for_values("seed", [1, 2])
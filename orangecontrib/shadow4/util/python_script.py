@@ -17,6 +17,9 @@ class PythonScript(QWidget):
     def __init__(self):
         super().__init__()
 
+        self.__code_provider = None # code generated on request (see set_code_provider)
+        self.__code_key      = None
+
         layout = QVBoxLayout()
 
         self.code_area = oasysgui.textArea(readOnly=False)
@@ -35,7 +38,12 @@ class PythonScript(QWidget):
         self.setLayout(layout)
 
 
+    def showEvent(self, event):
+        self.__generate_code()
+        super().showEvent(event)
+
     def execute_script(self):
+        self.__generate_code()
         self._script = str(self.code_area.toPlainText())
         self.console.write("\nRunning script:\n")
         self.console.push("exec(_script)")
@@ -46,6 +54,7 @@ class PythonScript(QWidget):
 
         if not file_name is None:
             if not file_name.strip() == "":
+                self.__generate_code()
                 if os.path.splitext(file_name)[1].lower() != ".py":
                     file_name += ".py"
                 file = open(file_name, "w")
@@ -61,6 +70,9 @@ class PythonScript(QWidget):
         self.code_area.setText("")
 
     def set_code(self,text):
+        self.__code_provider = None
+        self.__code_key      = None
+
         self.clear()
 
         try:
@@ -72,9 +84,32 @@ class PythonScript(QWidget):
         code_old = self.get_code()
         self.set_code(code_old + "\n" + text)
 
+    def set_code_provider(self, code_provider, key=None):
+        # code_provider() returns the code: it is called when the script is shown, run, saved or read, not before.
+        # With a key (e.g. a fingerprint of the beamline), the code already generated for the same key is kept
+        if not key is None and key == self.__code_key: return
+
+        self.__code_provider = code_provider
+        self.__code_key      = key
+
+        if self.isVisible(): self.__generate_code()
+
     def get_code(self):
+        self.__generate_code()
         return self.code_area.toPlainText()
 
+    def __generate_code(self):
+        if not self.__code_provider is None:
+            code_provider, code_key = self.__code_provider, self.__code_key
+
+            try:
+                code = code_provider()
+            except Exception as e:
+                code = "Problem in generating python script:\n" + str(type(e)) + ": " + str(e)
+
+            self.set_code(code)
+            self.__code_key = code_key
+
 
 def interleave(seq1, seq2):
     """
@@ -0,0 +1,224 @@
+import copy, time, numpy
+
+from orangecontrib.shadow4.util.shadow4_objects import ShadowData
+from orangecontrib.shadow4.util.shadow4_statistics import ShadowBeamStatistics
+from orangecontrib.shadow4.util.shadow4_blocks import ShadowBlockBeam
+from orangecontrib.shadow4.util.shadow4_engine import ShadowParallelTracer
+
+class ShadowBeamlineReplay:
+    # more rays of the beamline of a ShadowData (see ShadowData.beamline): the light source is generated again with other
+    # seeds (seed + SEED_OFFSET, seed + SEED_OFFSET + 1, ...: far from the seeds of the chunks and of the ensembles),
+    # each increment is traced by copies of the elements of the beamline, and retraced if requested (e.g. Plot XY).
+    # Light source and elements of the data are not modified; ray indices follow the generated_rays already in the data.
+
+    SEED_OFFSET = 500009
+
+    def __init__(self, beamline, retrace_distance=None, number_of_workers=1, generated_rays=0):
+        if beamline is None or beamline.get_light_source() is None: raise ValueError("Data without beamline: rays cannot be generated again")
+
+        self.__light_source     = copy.copy(beamline.get_light_source())
+        self.__elements         = beamline.get_beamline_elements()
+        self.__retrace_distance = retrace_distance
+        self.__tracer           = None if number_of_workers == 1 else ShadowParallelTracer(number_of_workers)
+        self.__seed             = self.__light_source.get_seed()
+        self.__increments       = 0
+        self.__generated_rays   = generated_rays
+
+    def get_number_of_generated_rays(self):
+        return self.__generated_rays
+
+    def trace_increment(self, number_of_rays):
+        # the beam of number_of_rays new rays at the end of the beamline
+        self.__light_source.set_nrays(number_of_rays)
+        self.__light_source.set_seed(0 if self.__seed == 0 else self.__seed + ShadowBeamlineReplay.SEED_OFFSET + self.__increments)
+
+        beam = self.__light_source.get_beam()
+        beam.rays[:, 11] = numpy.arange(self.__generated_rays + 1, self.__generated_rays + number_of_rays + 1, 1) # ray_index, after the previous increments
+
+        self.__increments     += 1
+        self.__generated_rays += number_of_rays
+
+        for element in self.__elements:
+            element = copy.copy(element)
+            element.set_input_beam(beam)
+
+            if self.__tracer is None: beam, _ = element.trace_beam()
+            else:                     beam, _ = self.__tracer.trace_beamline_element(element, input_beam=beam)
+
+        if not self.__retrace_distance is None: beam.retrace(self.__retrace_distance)
+
+        return beam
+
+class ShadowConvergence:
+    # FWHM and sigma of columns and intensity per generated ray, as rays are added: histograms (on fixed ranges) and
+    # moments are accumulated increment by increment, each addition is a point of the convergence curve with the
+    # largest relative change of the quantities with respect to the previous point. Converged: the last
+    # CONSECUTIVE_POINTS changes are below the tolerance (FWHMs change by whole bins: a single small change can be chance)
+
+    CONSECUTIVE_POINTS = 2
+
+    CONVERGED    = "converged"
+    GOOD_RAYS    = "good rays collected"
+    TIME_BUDGET  = "time budget reached"
+    MAXIMUM_RAYS = "maximum number of rays reached"
+
+    def __init__(self, columns, ranges, nbins=100, nolost=1):
+        self.__columns = list(dict.fromkeys(columns))
+        self.__ranges  = ranges
+        self.__nbins   = nbins
+        self.__nolost  = nolost
+
+        self.__histograms     = {column : numpy.zeros(nbins) for column in self.__columns}
+        self.__sums           = {column : numpy.zeros(3) for column in self.__columns} # weights, weighted values, weighted squares
+        self.__intensity      = 0.0
+        self.__generated_rays = 0
+        self.__curve          = [] # (generated rays, change, {quantity: value})
+
+    def add(self, beam, number_of_generated_rays):
+        statistics = ShadowBeamStatistics.get(beam)
+
+        for column in self.__columns:
+            ticket = statistics.histo1(column, xrange=self.__ranges[column], nbins=self.__nbins, nolost=self.__nolost, ref=23)
+            if ticket["histogram"].size > 0: self.__histograms[column] += ticket["histogram"]
+
+            total, average, sigma = statistics.get_moments(column, nolost=self.__nolost, ref=23)
+            if total > 0: self.__sums[column] += [total, total * average, total * (sigma**2 + average**2)]
+
+        self.__intensity      += statistics.get_intensity(nolost=self.__nolost)
+        self.__generated_rays += number_of_generated_rays
+
+        quantities = self.get_quantities()
+        change     = numpy.inf if len(self.__curve) == 0 else _get_relative_change(self.__curve[-1][2], quantities)
+
+        self.__curve.append((self.__generated_rays, change, quantities))
+
+        return change
+
+    def get_quantities(self):
+        quantities = {"intensity/ray" : self.__intensity / self.__generated_rays if self.__generated_rays > 0 else numpy.nan}
+
+        for column in self.__columns:
+            total, first, second = self.__sums[column]
+            bins                 = numpy.linspace(self.__ranges[column][0], self.__ranges[column][1], self.__nbins + 1)
+
+            fwhm = ShadowBeamStatistics.get_fwhm(self.__histograms[column], 0.5 * (bins[:-1] + bins[1:])) if self.__histograms[column].sum() > 0 else None
+
+            quantities["fwhm col%02d" % column]  = numpy.nan if fwhm is None else fwhm
+            quantities["sigma col%02d" % column] = numpy.sqrt(max(second / total - (first / total)**2, 0.0)) if total > 0 else numpy.nan
+
+        return quantities
+
+    def get_change(self):
+        return numpy.inf if len(self.__curve) == 0 else self.__curve[-1][1]
+
+    def is_converged(self, tolerance):
+        changes = [change for _, change, _ in self.__curve[-ShadowConvergence.CONSECUTIVE_POINTS:]]
+
+        return len(changes) == ShadowConvergence.CONSECUTIVE_POINTS and max(changes) < tolerance
+
+    def get_curve(self):
+        return list(self.__curve)
+
+    def get_report(self, stop_reason=""):
+        if len(self.__curve) == 0: return "No rays"
+
+        names = list(self.__curve[-1][2].keys())
+
+        text  = "Convergence: %d rays (%s)\n" % (self.__generated_rays, stop_reason) if stop_reason else "Convergence: %d rays\n" % self.__generated_rays
+        text += "%12s %12s" % ("rays", "rel. change") + "".join([" %16s" % name for name in names]) + "\n"
+        for generated_rays, change, quantities in self.__curve:
+            text += "%12d %12.3g" % (generated_rays, change) + "".join([" %16.9g" % quantities[name] for name in names]) + "\n"
+
+        return text
+
+def run_until_converged(data, beam, columns, ranges, nbins=100, nolost=1, tolerance=0.01, increment=100000, time_budget=60.0,
+                        maximum_number_of_rays=10000000, retrace_distance=None, number_of_workers=1, monitor=None):
+    # rays are added to beam (the data beam, retraced or not) until the quantities change less than tolerance, within
+    # the time budget [s] and the maximum number of rays. Returns (ShadowData with all the rays, convergence, stop reason);
+    # monitor(fraction) is called after each increment
+    if tolerance <= 0: raise ValueError("Tolerance must be > 0")
+    if increment < 1: raise ValueError("Rays per increment must be >= 1")
+
+    replay      = _get_replay(data, retrace_distance, number_of_workers)
+    convergence = ShadowConvergence(columns, ranges, nbins, nolost)
+    statistics  = ShadowBeamStatistics.get(beam)
+    dtype       = statistics.get_dtype()
+    blocks      = [chunk for chunk in statistics.iterate_chunks()]
+    start       = time.perf_counter()
+
+    convergence.add(beam, data.get_number_of_generated_rays())
+
+    while True:
+        if convergence.is_converged(tolerance):                                   stop_reason = ShadowConvergence.CONVERGED
+        elif time.perf_counter() - start >= time_budget:                          stop_reason = ShadowConvergence.TIME_BUDGET
+        elif convergence.get_curve()[-1][0] + increment > maximum_number_of_rays: stop_reason = ShadowConvergence.MAXIMUM_RAYS
+        else:                                                                     stop_reason = None
+
+        if not stop_reason is None: break
+
+        increment_beam = replay.trace_increment(increment)
+        blocks.append(increment_beam.rays.astype(dtype, copy=False))
+
+        convergence.add(increment_beam, increment)
+
+        if not monitor is None: monitor(min(1.0, max((time.perf_counter() - start) / time_budget, convergence.get_curve()[-1][0] / maximum_number_of_rays)))
+
+    output_data = ShadowData(beam=ShadowBlockBeam(blocks=blocks), beamline=data.beamline)
+    output_data.initial_flux             = data.initial_flux
+    output_data.number_of_generated_rays = replay.get_number_of_generated_rays()
+
+    return output_data, convergence, stop_reason
+
+def run_until_good_rays(data, beam, number_of_good_rays, increment=100000, time_budget=60.0, maximum_number_of_rays=10000000,
+                        retrace_distance=None, number_of_workers=1, monitor=None):
+    # good rays (flag > 0) of beam (the data beam, retraced or not) and of new increments, until number_of_good_rays are
+    # collected, within the time budget [s] and the maximum number of generated rays. Lost rays are dropped, the
+    # generated rays are kept for the flux (see ShadowData.get_flux); increments are sized on the transmission so far
+    # (from increment to 10 * increment rays). Returns (ShadowData with the good rays, stop reason); monitor(fraction) is called
+    # after each increment
+    if number_of_good_rays < 1: raise ValueError("Number of good rays must be >= 1")
+    if increment < 1: raise ValueError("Rays per increment must be >= 1")
+
+    replay     = _get_replay(data, retrace_distance, number_of_workers)
+    statistics = ShadowBeamStatistics.get(beam)
+    dtype      = statistics.get_dtype()
+    blocks     = [chunk[chunk[:, 9] > 0] for chunk in statistics.iterate_chunks()]
+    good_rays  = sum([block.shape[0] for block in blocks])
+    start      = time.perf_counter()
+
+    while True:
+        generated_rays = replay.get_number_of_generated_rays()
+
+        if good_rays >= number_of_good_rays:                      stop_reason = ShadowConvergence.GOOD_RAYS
+        elif time.perf_counter() - start >= time_budget:          stop_reason = ShadowConvergence.TIME_BUDGET
+        elif generated_rays + increment > maximum_number_of_rays: stop_reason = ShadowConvergence.MAXIMUM_RAYS
+        else:                                                     stop_reason = None
+
+        if not stop_reason is None: break
+
+        if good_rays == 0: number_of_rays = increment
+        else:              number_of_rays = int(1.1 * (number_of_good_rays - good_rays) * generated_rays / good_rays) + 1 # 10% margin
+        number_of_rays = min(max(number_of_rays, increment), 10 * increment, maximum_number_of_rays - generated_rays)
+
+        rays = replay.trace_increment(number_of_rays).rays
+
+        blocks.append(rays[rays[:, 9] > 0].astype(dtype, copy=False))
+        good_rays += blocks[-1].shape[0]
+
+        if not monitor is None: monitor(min(1.0, max((time.perf_counter() - start) / time_budget, good_rays / number_of_good_rays)))
+
+    output_data = ShadowData(beam=ShadowBlockBeam(blocks=blocks), beamline=data.beamline)
+    output_data.initial_flux             = data.initial_flux
+    output_data.number_of_generated_rays = replay.get_number_of_generated_rays()
+
+    return output_data, stop_reason
+
+def _get_replay(data, retrace_distance, number_of_workers):
+    if not data.is_replayable(): raise ValueError("Data of scanned values: their beamline is the one of the last value, rays cannot be generated again")
+
+    return ShadowBeamlineReplay(data.beamline, retrace_distance, number_of_workers, data.get_number_of_generated_rays())
+
+def _get_relative_change(old, new):
+    changes = [numpy.abs(new[name] - value) / numpy.abs(value) for name, value in old.items() if numpy.isfinite(value) and value != 0 and numpy.isfinite(new[name])]
+
+    return max(changes) if len(changes) > 0 else numpy.inf
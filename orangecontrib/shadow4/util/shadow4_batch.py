@@ -0,0 +1,344 @@
+
+import os, sys, ast, base64, pickle, argparse, importlib, re, time, numpy, h5py
+from collections import deque
+from xml.etree import ElementTree
+
+from orangecontrib.shadow4.util.shadow4_objects import ShadowData
+from orangecontrib.shadow4.util.shadow4_beamline import ShadowBeamline
+from orangecontrib.shadow4.util.shadow4_cache import ShadowTraceCache
+from orangecontrib.shadow4.util.shadow4_profiling import ShadowProfiler
+
+class ShadowWorkflow:
+    # a saved OASYS scheme (.ows): nodes (widget class, title, stored settings) and the enabled links between them.
+    # Settings saved in "pickle" format are unpickled: schemes are trusted input, as in OASYS.
+
+    def __init__(self, file_name=None):
+        # without file, the scheme is built with add_node() and add_link() (e.g. benchmarks)
+        self.__nodes    = {} # id -> (title, qualified name)
+        self.__settings = {} # id -> stored settings
+        self.__links    = [] # (source id, source channel, sink id, sink channel)
+
+        if file_name is None: return
+        if not os.path.exists(file_name): raise Exception("File " + file_name + " not existing")
+
+        root = ElementTree.parse(file_name).getroot()
+
+        for node in root.iter("node"):
+            self.__nodes[node.get("id")] = (node.get("title"), node.get("qualified_name"))
+            self.__settings[node.get("id")] = {}
+
+        for link in root.iter("link"):
+            if link.get("enabled", "true") == "true":
+                self.__links.append((link.get("source_node_id"), link.get("source_channel"), link.get("sink_node_id"), link.get("sink_channel")))
+
+        for properties in root.iter("properties"):
+            if properties.get("node_id") in self.__settings:
+                self.__settings[properties.get("node_id")] = _load_properties(properties.get("format"), properties.text)
+
+    def add_node(self, node, title, qualified_name, settings={}):
+        if node in self.__nodes: raise ValueError("Node " + node + " already existing")
+
+        self.__nodes[node]    = (title, qualified_name)
+        self.__settings[node] = dict(settings)
+
+    def add_link(self, source, source_channel, sink, sink_channel):
+        for node in [source, sink]:
+            if not node in self.__nodes: raise ValueError("Node " + node + " not found")
+
+        self.__links.append((source, source_channel, sink, sink_channel))
+
+    def get_nodes(self):
+        return list(self.__nodes.keys())
+
+    def get_title(self, node):
+        return self.__nodes[node][0]
+
+    def get_qualified_name(self, node):
+        return self.__nodes[node][1]
+
+    def get_settings(self, node):
+        return self.__settings[node]
+
+    def get_group_name(self, node):
+        # HDF5 group of the node results
+        return "%s_%s" % (node, re.sub(r"\W+", "_", self.get_title(node)))
+
+    def get_links(self):
+        return self.__links
+
+    def get_node(self, node):
+        # by id or by (unique) title
+        if node in self.__nodes: return node
+
+        nodes = [id for id, (title, _) in self.__nodes.items() if title == node]
+
+        if len(nodes) == 0:  raise ValueError("Node " + node + " not found")
+        elif len(nodes) > 1: raise ValueError("Title " + node + " is not unique: use the node id (" + ", ".join(nodes) + ")")
+        else: return nodes[0]
+
+    def set_setting(self, node, name, value):
+        node = self.get_node(node)
+        if not name in self.__settings[node]: raise ValueError("Setting " + name + " not found in node " + self.get_title(node))
+
+        self.__settings[node][name] = value
+
+    def get_topological_order(self):
+        # Kahn's algorithm, ties broken by the order of the nodes in the scheme
+        incoming = {node : 0 for node in self.__nodes}
+        for _, _, sink, _ in self.__links: incoming[sink] += 1
+
+        ready = deque([node for node in self.__nodes if incoming[node] == 0])
+        order = []
+
+        while len(ready) > 0:
+            node = ready.popleft()
+            order.append(node)
+
+            for source, _, sink, _ in self.__links:
+                if source == node:
+                    incoming[sink] -= 1
+                    if incoming[sink] == 0: ready.append(sink)
+
+        if len(order) < len(self.__nodes): raise Exception("The scheme contains cycles: it cannot be run in batch")
+
+        return order
+
+class ShadowBatchRunner:
+    # runs a scheme without windows: light sources and beamline elements are built by the widgets (get_lightsource(),
+    # get_optical_element_instance(), get_coordinates_instance(), ...) and traced synchronously, the other widgets
+    # (e.g. plots) receive their inputs through their input handlers.
+    # Widgets are Qt objects: they are instantiated (never shown) with the "offscreen" platform, once, and reused by
+    # the following runs. With a trace cache, sources and elements whose input and settings did not change are not traced again.
+
+    SHADOW_DATA = "Shadow Data"
+
+    def __init__(self, workflow, trace_cache=None):
+        self.__workflow    = workflow
+        self.__trace_cache = trace_cache
+        self.__widgets     = {}
+
+    def run(self, overrides={}, verbose=True):
+        # overrides: {node: {setting: value}}, set on the widgets as the triggers do.
+        # Returns {node: (outputs, plotted ticket)}, outputs being {channel: value}
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+        from PyQt5.QtWidgets import QApplication
+        application = QApplication.instance() or QApplication([])
+
+        inputs  = {node : [] for node in self.__workflow.get_nodes()} # id -> [(sink channel, data)]
+        results = {}
+
+        for node in self.__workflow.get_topological_order():
+            t0 = time.time()
+
+            widget = self.__get_widget(node)
+            for name, value in overrides.get(node, {}).items(): setattr(widget, name, value)
+
+            with ShadowProfiler.stage("run", self.__workflow.get_title(node)): outputs = self.__run_node(node, widget, inputs[node])
+            application.processEvents()
+
+            results[node] = (outputs, getattr(widget, "plotted_ticket", None))
+
+            for source, source_channel, sink, sink_channel in self.__workflow.get_links():
+                if source == node and source_channel in outputs: inputs[sink].append((sink_channel, outputs[source_channel]))
+
+            if verbose: print("%s: %s (%.2f s)" % (self.__workflow.get_title(node), ", ".join(sorted(outputs.keys())) if len(outputs) > 0 else "no output", time.time() - t0))
+
+        return results
+
+    def write_results(self, results, file_name):
+        # beams, footprints and plotted tickets, one group per node
+        if os.path.exists(file_name): os.remove(file_name)
+
+        for node, (outputs, ticket) in results.items():
+            group_name = self.__workflow.get_group_name(node)
+
+            data = outputs.get(ShadowBatchRunner.SHADOW_DATA, None)
+            if isinstance(data, ShadowData) and not data.beam is None:
+                data.beam.write_h5(file_name, overwrite=False, simulation_name=group_name, beam_name="beam")
+                if data.has_footprint(): data.footprint.write_h5(file_name, overwrite=False, simulation_name=group_name, beam_name="footprint")
+
+            if not ticket is None:
+                with h5py.File(file_name, "a") as file: write_ticket(file.require_group(group_name).create_group("ticket"), ticket)
+
+    def __run_node(self, node, widget, inputs):
+        outputs = {}
+
+        widget.send = lambda channel, value, *args, **kwargs: outputs.__setitem__(channel, value)
+        widget.prompt_exception = _raise
+
+        shadow_data = [data for channel, data in inputs if isinstance(data, ShadowData)]
+
+        if hasattr(widget, "get_lightsource") and hasattr(widget, "_generate_beam"):
+            cache_key = self.__get_cache_key(None, widget)
+            cached    = None if cache_key is None else self.__trace_cache.get(cache_key)
+
+            if cached is None:
+                with widget._profile("element instantiation"): light_source = widget.get_lightsource()
+                output_beam  = widget._apply_ray_precision(widget._generate_beam(light_source))
+
+                if not cache_key is None: self.__trace_cache.put(cache_key, output_beam, None, light_source)
+            else:
+                output_beam, _, light_source = cached
+
+            outputs[ShadowBatchRunner.SHADOW_DATA] = ShadowData(beam=output_beam,
+                                                                number_of_rays=getattr(widget, "number_of_rays", 0),
+                                                                beamline=ShadowBeamline(light_source=light_source))
+        elif hasattr(widget, "get_beamline_element") and hasattr(widget, "trace_beamline_element"):
+            if len(shadow_data) == 0: raise Exception("No input beam for " + self.__workflow.get_title(node))
+
+            input_data = shadow_data[-1]
+            beamline   = input_data.beamline.duplicate()
+            cache_key  = self.__get_cache_key(input_data, widget)
+            cached     = None if cache_key is None else self.__trace_cache.get(cache_key)
+
+            widget.input_data = input_data # as set_shadow_data: element instances may read it
+
+            if cached is None:
+                element = widget.get_beamline_element(input_data)
+                output_beam, footprint = widget.trace_beamline_element(element, input_data)
+            else:
+                output_beam, footprint, element = cached
+                element.set_input_beam(input_data.beam)
+
+            beamline.append_beamline_element(element)
+
+            with widget._profile("post-trace"): widget._post_trace_operations(output_beam, footprint, element, beamline)
+
+            # keyed after _post_trace_operations, as in the widget
+            if cached is None and not cache_key is None: self.__trace_cache.put(self.__get_cache_key(input_data, widget), output_beam, footprint, element)
+
+            output_data = ShadowData(beam=output_beam, beamline=beamline, footprint=footprint)
+            output_data.number_of_generated_rays = input_data.get_number_of_generated_rays() # lost rays may be dropped
+
+            outputs[ShadowBatchRunner.SHADOW_DATA] = output_data
+        else:
+            if hasattr(widget, "clear_results"): widget.clear_results(interactive=False) # results are not accumulated across runs
+
+            for channel, data in inputs:
+                handler = _get_input_handler(widget, channel)
+                if not handler is None: getattr(widget, handler)(data)
+
+        return outputs
+
+    def __get_cache_key(self, input_data, widget):
+        if self.__trace_cache is None: return None
+        else: return ShadowTraceCache.get_key(input_data, widget, getattr(widget, "NOT_TRACED_SETTINGS", []))
+
+    def __get_widget(self, node):
+        if not node in self.__widgets: self.__widgets[node] = self.__create_widget(node)
+
+        return self.__widgets[node]
+
+    def __create_widget(self, node):
+        module_name, class_name = self.__workflow.get_qualified_name(node).rsplit(".", 1)
+        widget_class = getattr(importlib.import_module(module_name), class_name)
+
+        widget = widget_class.__new__(widget_class, None,
+                                      captionTitle=self.__workflow.get_title(node),
+                                      signal_manager=None,
+                                      stored_settings=self.__workflow.get_settings(node))
+        widget.__init__()
+
+        return widget
+
+def _load_properties(format, text):
+    if text is None or text.strip() == "": return {}
+    elif format == "pickle":  return pickle.loads(base64.decodebytes(text.encode("ascii")))
+    elif format == "literal": return ast.literal_eval(text)
+    else: raise ValueError("Properties format " + str(format) + " not supported")
+
+def _parse_value(text):
+    try:    return ast.literal_eval(text)
+    except: return text # strings can be given without quotes
+
+def _parse_values(text):
+    match = re.match(r"^([^:]+):([^:]+):(\d+)$", text)
+
+    if match is None:
+        values = _parse_value(text)
+        return list(values) if isinstance(values, (list, tuple)) else [values]
+    else:
+        return numpy.linspace(float(match.group(1)), float(match.group(2)), int(match.group(3))).tolist()
+
+def _get_input_handler(widget, channel):
+    for input in getattr(widget, "inputs", []):
+        if isinstance(input, dict): name, handler = input.get("name"), input.get("handler")
+        else:                       name, handler = input[0], input[2]
+
+        if name == channel: return handler
+
+    return None
+
+def _raise(exception):
+    raise exception
+
+def write_ticket(group, ticket):
+    # plotted ticket in a HDF5 group: scalars and strings as attributes, arrays as datasets
+    for key, value in ticket.items():
+        if value is None: continue
+        elif isinstance(value, (str, bool, int, float, numpy.number)): group.attrs[key] = value
+        else:
+            try:    group.create_dataset(key, data=numpy.asarray(value))
+            except: pass # not numeric
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="shadow4-batch", description="Runs a saved OASYS scheme (.ows) with the Shadow4 widgets, without GUI.")
+    parser.add_argument("scheme", help="OASYS scheme (.ows)")
+    parser.add_argument("-o", "--output", default=None, help="HDF5 file for beams, footprints and plot tickets (default: <scheme>.h5)")
+    parser.add_argument("-s", "--set", action="append", default=[], metavar="NODE:SETTING=VALUE",
+                        help="overrides a setting; NODE is a node title or id, VALUE a Python literal or a string. Repeatable")
+    parser.add_argument("--scan", action="append", default=[], metavar="NODE:SETTING=VALUES",
+                        help="scans a setting; VALUES is a Python list or START:STOP:NUMBER (evenly spaced). Repeatable: axes are combined in a Cartesian product")
+    parser.add_argument("--zip", action="store_true", help="scan axes are zipped instead of combined in a Cartesian product")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="worker processes evaluating the scan points (default: 1)")
+    parser.add_argument("-p", "--profile", default=None, metavar="FILE", help="writes the stages of the widget runs as a Chrome trace (JSON), without scan")
+    parser.add_argument("-l", "--list", action="store_true", help="lists the nodes and their settings, in execution order, and exits")
+
+    arguments = parser.parse_args(argv)
+
+    workflow = ShadowWorkflow(arguments.scheme)
+
+    for override in arguments.set:
+        match = re.match(r"^(.+):(\w+)=(.*)$", override)
+        if match is None: parser.error("override " + override + " is not NODE:SETTING=VALUE")
+
+        try:    workflow.set_setting(match.group(1), match.group(2), _parse_value(match.group(3)))
+        except ValueError as error: parser.error(str(error))
+
+    if arguments.list:
+        for node in workflow.get_topological_order():
+            print("%s: %s (%s)" % (node, workflow.get_title(node), workflow.get_qualified_name(node)))
+            for name, value in sorted(workflow.get_settings(node).items()):
+                if not name.startswith("_"): print("    %s = %r" % (name, value))
+        return 0
+
+    if len(arguments.scan) == 0:
+        runner = ShadowBatchRunner(workflow)
+        runner.write_results(runner.run(), arguments.output or os.path.splitext(arguments.scheme)[0] + ".h5")
+
+        if not arguments.profile is None:
+            ShadowProfiler.write_chrome_trace(arguments.profile)
+            print(ShadowProfiler.get_workflow_report())
+    else:
+        from orangecontrib.shadow4.util.shadow4_scan import ShadowScan, ShadowScanAxis, ShadowScanEngine
+
+        axes = []
+        for axis in arguments.scan:
+            match = re.match(r"^(.+):(\w+)=(.*)$", axis)
+            if match is None: parser.error("scan " + axis + " is not NODE:SETTING=VALUES")
+
+            axes.append(ShadowScanAxis(match.group(1), match.group(2), _parse_values(match.group(3))))
+
+        try:
+            engine = ShadowScanEngine(workflow, ShadowScan(axes, ShadowScan.ZIPPED if arguments.zip else ShadowScan.CARTESIAN), arguments.workers)
+        except ValueError as error:
+            parser.error(str(error))
+
+        engine.run(arguments.output or os.path.splitext(arguments.scheme)[0] + "_scan.h5",
+                   monitor=lambda fraction: print("scan: %.1f%%" % (100 * fraction)))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+
+from shadow4.beamline.s4_beamline import S4Beamline
+from orangecontrib.shadow4.util.shadow4_fingerprint import get_digest
+
+class ShadowBeamline(S4Beamline):
+    # persistent S4Beamline: each node holds its last element and the node of its ancestor, so duplicate() and
+    # append_beamline_element() are O(1) and the upstream elements are shared, never copied.
+    # The elements list (_beamline_elements_list, get_beamline_elements()) is built on demand, for scripts and info.
+    # Fingerprints are chained node by node: an appended element digests its own code only.
+
+    def __init__(self, light_source=None, beamline_elements_list=None):
+        self.__parent       = None
+        self.__element      = None
+        self.__size         = 0
+        self.__python_code  = {} # arguments -> code, see to_python_code
+        self.__fingerprints = {} # "light source", "elements" -> digest, see get_fingerprint
+
+        super().__init__(light_source=light_source, beamline_elements_list=beamline_elements_list)
+
+    @classmethod
+    def initialize_from_beamline(cls, beamline):
+        if beamline is None: return None
+        elif isinstance(beamline, ShadowBeamline): return beamline.duplicate()
+        else: return ShadowBeamline(light_source=beamline.get_light_source(), beamline_elements_list=beamline.get_beamline_elements())
+
+    @property
+    def _beamline_elements_list(self):
+        beamline_elements_list = []
+        node = self
+        while not node is None and node.__size > 0:
+            beamline_elements_list.append(node.__element)
+            node = node.__parent
+        beamline_elements_list.reverse()
+
+        return beamline_elements_list
+
+    @_beamline_elements_list.setter
+    def _beamline_elements_list(self, beamline_elements_list):
+        self.__parent       = None
+        self.__element      = None
+        self.__size         = 0
+        self.__python_code  = {}
+        self.__fingerprints = {}
+
+        for beamline_element in beamline_elements_list: self.append_beamline_element(beamline_element)
+
+    def duplicate(self):
+        beamline = ShadowBeamline(light_source=self._light_source)
+        beamline.__parent       = self.__parent
+        beamline.__element      = self.__element
+        beamline.__size         = self.__size
+        beamline.__python_code  = dict(self.__python_code) # same contents, same code
+        beamline.__fingerprints = dict(self.__fingerprints)
+
+        return beamline
+
+    def append_beamline_element(self, beamline_element):
+        if self.__size > 0: self.__parent = self.duplicate() # the current node becomes the (never modified) ancestor
+        self.__element     = beamline_element
+        self.__size       += 1
+        self.__python_code = {}
+        self.__fingerprints.pop("elements", None)
+
+    def get_beamline_elements_number(self):
+        return self.__size
+
+    def get_beamline_element_at(self, index):
+        if index < 0: index += self.__size
+        if index < 0 or index >= self.__size: raise IndexError("Index " + str(index) + " out of bounds")
+
+        node = self
+        for _ in range(self.__size - 1 - index): node = node.__parent
+
+        return node.__element
+
+    def set_light_source(self, light_source):
+        super().set_light_source(light_source)
+        self.__python_code = {}
+        self.__fingerprints.pop("light source", None)
+
+    def to_python_code(self, **kwargs):
+        # memoised (e.g. scripts, fingerprints): appending an element resets it
+        key = repr(sorted(kwargs.items()))
+        if not key in self.__python_code: self.__python_code[key] = super().to_python_code(**kwargs)
+
+        return self.__python_code[key]
+
+    def get_fingerprint(self):
+        # digest of the light source and of the elements (their scripts), chained: the digest of the upstream elements
+        # is memoised in the ancestor node, so an appended element describes itself only
+        if not "light source" in self.__fingerprints: self.__fingerprints["light source"] = get_digest(_get_description(self._light_source))
+
+        return get_digest(self.__fingerprints["light source"], self.__get_elements_fingerprint())
+
+    def __get_elements_fingerprint(self):
+        if not "elements" in self.__fingerprints:
+            if self.__size == 0: self.__fingerprints["elements"] = get_digest("no elements")
+            else:
+                upstream = get_digest("no elements") if self.__parent is None else self.__parent.__get_elements_fingerprint()
+                self.__fingerprints["elements"] = get_digest(upstream, _get_description(self.__element))
+
+        return self.__fingerprints["elements"]
+
+def _get_description(item):
+    try:    return item.to_python_code()
+    except:
+        try:    return item.info()
+        except: return repr(item)
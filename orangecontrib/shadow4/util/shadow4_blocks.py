@@ -0,0 +1,222 @@
+
+import os, time, numpy, h5py
+
+from shadow4.beam.s4_beam import S4Beam
+from orangecontrib.shadow4.util.shadow4_profiling import ShadowProfiler
+
+class ShadowChunkedBeam(S4Beam):
+    # S4Beam whose rays are processed in chunks: subclasses provide iterate_chunks().
+    # Chunk-aware code (statistics, tracing, retrace, file writing) never needs all the rays as one array.
+    # Generation and tracing accept a monitor(fraction) callable, called after each chunk: raising from it aborts.
+    # Tracing accepts a ShadowParallelTracer, to trace the chunks in a process pool.
+
+    def iterate_chunks(self):
+        raise NotImplementedError()
+
+    def get_dtype(self):
+        for chunk in self.iterate_chunks(): return chunk.dtype
+
+        return numpy.dtype(numpy.float64)
+
+    def get_number_of_rays(self, nolost=0):
+        # as S4Beam.get_number_of_rays (good rays have flag >= 0)
+        if nolost == 0:
+            return self._N_cleaned if self.is_cleaned() else sum([chunk.shape[0] for chunk in self.iterate_chunks()])
+        elif nolost == 1:
+            return sum([int(numpy.count_nonzero(chunk[:, 9] >= 0)) for chunk in self.iterate_chunks()])
+        elif nolost == 2:
+            return sum([int(numpy.count_nonzero(chunk[:, 9] < 0)) for chunk in self.iterate_chunks()])
+        else:
+            return sum([chunk.shape[0] for chunk in self.iterate_chunks()])
+
+    def trace_beamline_element(self, beamline_element, monitor=None, tracer=None):
+        raise NotImplementedError()
+
+    def _trace_chunks(self, beamline_element, monitor=None, tracer=None):
+        # rays are traced independently: the element traces one chunk at a time, in double precision
+        size = sum([chunk.shape[0] for chunk in self.iterate_chunks()])
+        done = 0
+
+        try:
+            if not tracer is None:
+                yield from tracer.trace_chunks(beamline_element, self.iterate_chunks(), size, monitor)
+                return
+
+            for chunk in self.iterate_chunks():
+                chunk_beam = S4Beam(N=0)
+                chunk_beam.rays = numpy.asarray(chunk, dtype=numpy.float64) # the element traces a duplicate
+
+                beamline_element.set_input_beam(chunk_beam)
+                output_beam, footprint = beamline_element.trace_beam()
+
+                yield output_beam.rays, (None if footprint is None else footprint.rays)
+
+                done += chunk.shape[0]
+                if not monitor is None: monitor(done / size)
+        finally:
+            beamline_element.set_input_beam(self)
+
+    def retrace(self, dist, resetY=False):
+        for chunk in self.iterate_chunks():
+            chunk_beam = S4Beam(N=0)
+            chunk_beam.rays = chunk # a view: retrace works in place
+            chunk_beam.retrace(dist, resetY=resetY)
+
+    def write_h5(self, filename, overwrite=True, simulation_name="run001", beam_name="begin"):
+        # same layout as S4Beam.write_h5, written chunk by chunk
+        if overwrite:
+            try:    os.remove(filename)
+            except: pass
+            f = h5py.File(filename, 'w')
+        else:
+            f = h5py.File(filename, 'a')
+
+        f.attrs['default'] = 'entry'
+        f.attrs['file_name'] = filename
+        f.attrs['file_time'] = time.time()
+        f.attrs['creator'] = "shadow4"
+        f.attrs['HDF5_Version'] = h5py.version.hdf5_version
+        f.attrs['h5py_version'] = h5py.version.version
+
+        try:    f1 = f[simulation_name]
+        except: f1 = f.create_group(simulation_name)
+
+        f1.attrs['NX_class'] = 'NXentry'
+        f1.attrs['default'] = "begin"
+
+        f2 = f1.create_group(beam_name)
+        f2.attrs['NX_class'] = 'NXdata'
+        f2.attrs['signal'] = b'col03 z'
+        f2.attrs['axes'] = b'col01 x'
+
+        column_names = self.column_short_names_with_column_number()
+        sizes        = [chunk.shape[0] for chunk in self.iterate_chunks()]
+        datasets     = []
+
+        for i in range(18):
+            dataset = f2.create_dataset(column_names[i], shape=(sum(sizes),), dtype=self.get_dtype(), chunks=(max([1] + sizes),))
+            dataset.attrs['long_name'] = "column %s" % (i + 1)
+            datasets.append(dataset)
+
+        start = 0
+        for chunk in self.iterate_chunks():
+            for i in range(18): datasets[i][start : start + chunk.shape[0]] = chunk[:, i]
+            start += chunk.shape[0]
+
+        f.close()
+        print("File written/updated: %s" % filename)
+
+class ShadowBlockBeam(ShadowChunkedBeam):
+    # S4Beam held in memory as a list of ray blocks (N_i x 18 arrays).
+    # Appending, cleaning and copy-on-write work block by block; code that is not block-aware reads "rays": the blocks
+    # are then consolidated once into one array, and from then on the blocks are views of it (block_size rays each).
+
+    DEFAULT_BLOCK_SIZE = 100000
+
+    def __init__(self, blocks=None, block_size=DEFAULT_BLOCK_SIZE, N_cleaned=None):
+        self.__block_size = block_size
+        self.__blocks     = []
+        self.__rays       = None
+
+        super().__init__(N=0, N_cleaned=N_cleaned)
+
+        if not blocks is None: self.set_blocks(blocks)
+
+    @classmethod
+    def initialize_from_light_source(cls, light_source, dtype=numpy.float64, block_size=DEFAULT_BLOCK_SIZE, monitor=None):
+        return ShadowBlockBeam(blocks=[rays.astype(dtype, copy=False) for _, rays in generate_ray_chunks(light_source, block_size, monitor)],
+                               block_size=block_size)
+
+    @classmethod
+    def initialize_from_beam(cls, input_beam, dtype=numpy.float64, block_size=DEFAULT_BLOCK_SIZE):
+        ShadowProfiler.count_copy("blocks from beam", input_beam.rays.shape[0] * 18 * numpy.dtype(dtype).itemsize)
+
+        return ShadowBlockBeam(blocks=[input_beam.rays.astype(dtype)], block_size=block_size, N_cleaned=input_beam._N_cleaned)
+
+    @property
+    def rays(self):
+        if self.__rays is None:
+            if len(self.__blocks) == 0:   self.__rays = numpy.zeros((0, 18))
+            elif len(self.__blocks) == 1: self.__rays = self.__blocks[0]
+            else:
+                self.__rays = numpy.concatenate(self.__blocks)
+                ShadowProfiler.count_copy("block join", self.__rays.nbytes)
+            self.__blocks = None
+
+        return self.__rays
+
+    @rays.setter
+    def rays(self, rays):
+        self.__rays   = rays
+        self.__blocks = None
+
+    def get_block_size(self):
+        return self.__block_size
+
+    def get_blocks(self):
+        if self.__rays is None: return list(self.__blocks)
+        else:                   return [self.__rays[start : start + self.__block_size] for start in range(0, self.__rays.shape[0], self.__block_size)]
+
+    def set_blocks(self, blocks):
+        blocks = [block for block in blocks if block.shape[0] > 0]
+
+        if len(blocks) == 1: self.rays = blocks[0]
+        else:
+            self.__blocks = blocks
+            self.__rays   = None
+
+    def get_ray_buffers(self):
+        # the arrays actually holding the rays (the consolidated array, or the blocks)
+        return self.get_blocks() if self.__rays is None else [self.__rays]
+
+    def append_blocks(self, blocks):
+        self.set_blocks(self.get_blocks() + list(blocks))
+
+    def iterate_chunks(self):
+        return iter(self.get_blocks())
+
+    def duplicate(self):
+        ShadowProfiler.count_copy("duplicate", sum([buffer.nbytes for buffer in self.get_ray_buffers()]))
+
+        return ShadowBlockBeam(blocks=[buffer.copy() for buffer in self.get_ray_buffers()], block_size=self.__block_size, N_cleaned=self._N_cleaned)
+
+    def clean_lost_rays(self):
+        self._N_cleaned = self.get_number_of_rays(nolost=0)
+        self.set_blocks([block[block[:, 9] > 0.0] for block in self.get_blocks()])
+
+        ShadowProfiler.count_copy("lost rays compaction", sum([block.nbytes for block in self.get_blocks()]))
+
+    def trace_beamline_element(self, beamline_element, monitor=None, tracer=None):
+        dtype = self.get_dtype()
+
+        output_blocks, footprint_blocks = [], []
+        for output_rays, footprint_rays in self._trace_chunks(beamline_element, monitor, tracer):
+            output_blocks.append(output_rays.astype(dtype, copy=False))
+            footprint_blocks.append(None if footprint_rays is None else footprint_rays.astype(dtype, copy=False))
+
+        output_beam = ShadowBlockBeam(blocks=output_blocks, block_size=self.__block_size, N_cleaned=self._N_cleaned)
+        footprint   = None if any([block is None for block in footprint_blocks]) else ShadowBlockBeam(blocks=footprint_blocks, block_size=self.__block_size, N_cleaned=self._N_cleaned)
+
+        return output_beam, footprint
+
+def generate_ray_chunks(light_source, chunk_size, monitor=None):
+    # yields (start, rays) with the rays generated chunk by chunk, with seeds seed, seed+1, ... (0 stays 0, i.e. clock)
+    nrays = light_source.get_nrays()
+    seed  = light_source.get_seed()
+
+    try:
+        for index, start in enumerate(range(0, nrays, chunk_size)):
+            size = min(chunk_size, nrays - start)
+
+            light_source.set_nrays(size)
+            light_source.set_seed(0 if seed == 0 else seed + index)
+
+            rays = light_source.get_beam().rays
+            rays[:, 11] = numpy.arange(start + 1, start + size + 1, 1) # ray_index
+
+            yield start, rays
+
+            if not monitor is None: monitor((start + size) / nrays)
+    finally:
+        light_source.set_nrays(nrays)
+        light_source.set_seed(seed)
@@ -0,0 +1,167 @@
+
+import os, copy, pickle, tempfile, weakref, numpy
+from collections import OrderedDict
+
+from orangecontrib.shadow4.util.shadow4_statistics import ShadowBeamStatistics
+from orangecontrib.shadow4.util.shadow4_fingerprint import ShadowFingerprint
+
+class ShadowTraceCache:
+    # LRU cache of traced elements: (input fingerprint, element parameters) -> (output beam, footprint, traced element).
+    # Entries exceeding the memory budget are spilled to pickle files (within the disk budget) or dropped, the oldest first.
+    # Cached beams are frozen (see ShadowBeamStatistics): they can be sent downstream again, writers copy them.
+    # Cached elements do not hold their input beam: it is set back on a hit.
+
+    DEFAULT_MEMORY_BUDGET = 512  # MB
+    DEFAULT_DISK_BUDGET   = 4096 # MB
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, spill=True, disk_budget=DEFAULT_DISK_BUDGET, spill_directory=None):
+        self.__entries = OrderedDict() # key -> ((output beam, footprint, element), size)
+        self.__spilled = OrderedDict() # key -> (file name, size)
+        self.__memory_size = 0
+        self.__disk_size   = 0
+        self.__hits        = 0
+        self.__misses      = 0
+
+        self.set_configuration(memory_budget, spill, disk_budget, spill_directory)
+
+        weakref.finalize(self, _remove_spilled_files, self.__spilled)
+
+    @classmethod
+    def get_key(cls, input_data, widget, excluded_settings=[]):
+        # None (not cached) for light sources seeded by the clock: their rays change at each run
+        if getattr(widget, "seed", None) == 0: return None
+
+        return (ShadowFingerprint.get_data_fingerprint(input_data), ShadowFingerprint.get_settings_fingerprint(widget, excluded_settings))
+
+    def set_configuration(self, memory_budget=DEFAULT_MEMORY_BUDGET, spill=True, disk_budget=DEFAULT_DISK_BUDGET, spill_directory=None):
+        if not spill_directory: spill_directory = None
+        elif not os.path.exists(spill_directory): raise Exception("Spill directory " + spill_directory + " not existing")
+
+        self.__memory_budget   = memory_budget
+        self.__spill           = spill
+        self.__disk_budget     = disk_budget
+        self.__spill_directory = spill_directory
+
+        self.__shrink()
+
+    def get(self, key):
+        if key in self.__entries:
+            self.__entries.move_to_end(key)
+            entry, _ = self.__entries[key]
+        elif key in self.__spilled:
+            file_name, size = self.__spilled.pop(key)
+            self.__disk_size -= size
+
+            try:
+                with open(file_name, "rb") as file: entry = pickle.load(file)
+            except:
+                entry = None
+            _remove_file(file_name)
+
+            if not entry is None: self.__store(key, entry)
+        else:
+            entry = None
+
+        if entry is None:
+            self.__misses += 1
+            return None
+        else:
+            self.__hits += 1
+            output_beam, footprint, element = entry
+            return output_beam, footprint, copy.copy(element)
+
+    def put(self, key, output_beam, footprint, element):
+        if key is None: return # see get_key
+
+        ShadowBeamStatistics.get(output_beam) # freezes the rays
+
+        element = copy.copy(element) # light sources are cached as elements, with their beam
+        if hasattr(element, "set_input_beam"): element.set_input_beam(None)
+
+        self.__remove(key)
+        self.__store(key, (output_beam, footprint, element))
+
+    def clear(self):
+        for key in list(self.__entries.keys()) + list(self.__spilled.keys()): self.__remove(key)
+
+    def get_hits(self):
+        return self.__hits
+
+    def get_misses(self):
+        return self.__misses
+
+    def get_number_of_entries(self):
+        return len(self.__entries), len(self.__spilled)
+
+    def get_memory_size(self):
+        return self.__memory_size / 2**20 # MB
+
+    def get_disk_size(self):
+        return self.__disk_size / 2**20 # MB
+
+    def get_status(self):
+        in_memory, on_disk = self.get_number_of_entries()
+
+        return "hits: %d, misses: %d, entries: %d in memory (%.1f MB), %d on disk (%.1f MB)" % \
+               (self.__hits, self.__misses, in_memory, self.get_memory_size(), on_disk, self.get_disk_size())
+
+    def __store(self, key, entry):
+        output_beam, footprint, _ = entry
+        size = _get_memory_size(output_beam) + (0 if footprint is None else footprint.get_memory_size())
+
+        self.__entries[key] = (entry, size)
+        self.__memory_size += size
+
+        self.__shrink()
+
+    def __remove(self, key):
+        if key in self.__entries:
+            _, size = self.__entries.pop(key)
+            self.__memory_size -= size
+        elif key in self.__spilled:
+            file_name, size = self.__spilled.pop(key)
+            self.__disk_size -= size
+            _remove_file(file_name)
+
+    def __shrink(self):
+        while self.__memory_size > self.__memory_budget * 2**20 and len(self.__entries) > 0:
+            key, (entry, size) = self.__entries.popitem(last=False)
+            self.__memory_size -= size
+
+            if self.__spill and size <= self.__disk_budget * 2**20: self.__spill_entry(key, entry)
+
+        while self.__disk_size > self.__disk_budget * 2**20 and len(self.__spilled) > 0:
+            _, (file_name, size) = self.__spilled.popitem(last=False)
+            self.__disk_size -= size
+            _remove_file(file_name)
+
+    def __spill_entry(self, key, entry):
+        output_beam, footprint, element = entry
+
+        if hasattr(output_beam, "get_memory_budget"): return # out-of-core beams are already on disk: dropped
+
+        output_beam = copy.copy(output_beam)
+        ShadowBeamStatistics.invalidate(output_beam) # statistics are not written
+
+        file_descriptor, file_name = tempfile.mkstemp(prefix="shadow4_trace_cache_", suffix=".pkl", dir=self.__spill_directory)
+        try:
+            with os.fdopen(file_descriptor, "wb") as file: pickle.dump((output_beam, footprint, element), file, protocol=pickle.HIGHEST_PROTOCOL)
+        except: # e.g. elements that cannot be pickled: dropped
+            _remove_file(file_name)
+            return
+
+        size = os.path.getsize(file_name)
+
+        self.__spilled[key] = (file_name, size)
+        self.__disk_size   += size
+
+def _get_memory_size(beam):
+    # memory-mapped rays are not in memory
+    return sum([chunk.nbytes for chunk in ShadowBeamStatistics.get(beam).iterate_chunks() if not isinstance(chunk, numpy.memmap)])
+
+def _remove_file(file_name):
+    try:    os.remove(file_name)
+    except: pass
+
+def _remove_spilled_files(spilled):
+    for file_name, _ in spilled.values(): _remove_file(file_name)
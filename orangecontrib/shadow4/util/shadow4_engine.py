@@ -0,0 +1,177 @@
+
+import os, copy, pickle, itertools, numpy
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from shadow4.beam.s4_beam import S4Beam
+from orangecontrib.shadow4.util.shadow4_profiling import ShadowProfiler
+
+_EXECUTORS = {} # number of workers -> process pool, shared by all the tracers
+
+class ShadowParallelTracer:
+    # traces a beamline element over blocks of rays in a process pool: rays are independent, so the blocks are traced
+    # by copies of the (pickled) element and the outputs/footprints are written, in the original order, to arrays
+    # allocated once (in the dtype of the input rays) as each block is done.
+    # The calling process traces the first block itself: the element gets the state a serial trace would give it.
+    # Processes are spawned (not forked: the GUI process runs Qt threads) once, and reused.
+    # With one worker the blocks are traced serially: the monitor still reports the progress (and can cancel) per block.
+
+    DEFAULT_NUMBER_OF_WORKERS = os.cpu_count() or 1
+    BLOCKS_PER_WORKER         = 4     # for load balancing and progress
+    MINIMUM_BLOCK_SIZE        = 10000  # rays
+    MAXIMUM_BLOCK_SIZE        = 100000 # rays: for progress and cancellation
+
+    def __init__(self, number_of_workers=DEFAULT_NUMBER_OF_WORKERS):
+        if number_of_workers < 1: raise ValueError("Number of workers must be >= 1")
+
+        self.__number_of_workers = number_of_workers
+
+    def get_number_of_workers(self):
+        return self.__number_of_workers
+
+    def trace_beamline_element(self, beamline_element, input_beam=None, monitor=None):
+        if input_beam is None: input_beam = beamline_element.get_input_beam()
+        if hasattr(input_beam, "iterate_chunks"): return input_beam.trace_beamline_element(beamline_element, monitor, self)
+
+        rays       = input_beam.rays
+        block_size = min(ShadowParallelTracer.MAXIMUM_BLOCK_SIZE,
+                         max(ShadowParallelTracer.MINIMUM_BLOCK_SIZE, -(-rays.shape[0] // (self.__number_of_workers * ShadowParallelTracer.BLOCKS_PER_WORKER))))
+
+        size           = rays.shape[0]
+        output_rays    = numpy.zeros((0, 18), dtype=rays.dtype) if size == 0 else None
+        footprint_rays = output_rays
+        start          = 0
+        try:
+            for output_block, footprint_block in self.trace_chunks(beamline_element, [rays[start : start + block_size] for start in range(0, size, block_size)], size, monitor):
+                if output_rays is None:
+                    output_rays    = numpy.empty((size, 18), dtype=rays.dtype)
+                    footprint_rays = None if footprint_block is None else numpy.empty((size, 18), dtype=rays.dtype)
+
+                if start + output_block.shape[0] > size: raise Exception("Tracing in blocks needs elements preserving the number of rays")
+
+                output_rays[start : start + output_block.shape[0]] = output_block
+                if not footprint_rays is None: footprint_rays[start : start + footprint_block.shape[0]] = footprint_block
+
+                start += output_block.shape[0]
+        finally:
+            beamline_element.set_input_beam(input_beam)
+
+        if start != size: raise Exception("Tracing in blocks needs elements preserving the number of rays")
+
+        return _get_beam(output_rays, input_beam._N_cleaned), (None if footprint_rays is None else _get_beam(footprint_rays, input_beam._N_cleaned))
+
+    def trace_chunks(self, beamline_element, chunks, size, monitor=None):
+        # yields (output rays, footprint rays) for each chunk, in order; monitor(fraction) is called after each chunk.
+        # The element input beam is left to the caller
+        chunks = iter(chunks)
+        first  = next(chunks, None)
+        if first is None: return
+
+        element_data = None if self.__number_of_workers == 1 else _pickle_element(beamline_element)
+        executor     = None if element_data is None else _get_executor(self.__number_of_workers)
+
+        if executor is None: # serial
+            chunks  = itertools.chain([first], chunks)
+            futures = deque()
+        else:
+            futures = deque([executor.submit(_trace_block, element_data, chunk) for chunk in itertools.islice(chunks, 2 * self.__number_of_workers)])
+
+        done = 0
+        try:
+            if not executor is None:
+                yield _trace_rays(beamline_element, first)
+
+                done += first.shape[0]
+                if not monitor is None: monitor(done / size)
+
+            while True:
+                if executor is None:
+                    chunk = next(chunks, None)
+                    if chunk is None: break
+
+                    result = _trace_rays(beamline_element, chunk)
+                else:
+                    if len(futures) == 0: break
+
+                    result = futures.popleft().result()
+                    chunk  = next(chunks, None)
+                    if not chunk is None: futures.append(executor.submit(_trace_block, element_data, chunk))
+
+                yield result
+
+                done += result[0].shape[0]
+                if not monitor is None: monitor(done / size)
+        finally:
+            for future in futures: future.cancel()
+
+    def generate_beams(self, light_sources, monitor=None):
+        # beams of independent light sources (e.g. the values of a batched trigger), one per process.
+        # monitor(fraction) is called after each beam
+        executor = None if self.__number_of_workers == 1 or len(light_sources) == 1 or not _is_picklable(light_sources) else _get_executor(self.__number_of_workers)
+        futures  = [] if executor is None else [executor.submit(_generate_beam, light_source) for light_source in light_sources[1:]]
+
+        beams = []
+        try:
+            for index, light_source in enumerate(light_sources):
+                beams.append(light_source.get_beam() if index == 0 or executor is None else futures[index - 1].result())
+
+                if not monitor is None: monitor((index + 1) / len(light_sources))
+        finally:
+            for future in futures: future.cancel()
+
+        return beams
+
+def _get_executor(number_of_workers):
+    if not number_of_workers in _EXECUTORS:
+        _EXECUTORS[number_of_workers] = ProcessPoolExecutor(max_workers=number_of_workers - 1, # the calling process works too
+                                                            mp_context=multiprocessing.get_context("spawn"))
+    return _EXECUTORS[number_of_workers]
+
+def _pickle_element(beamline_element):
+    element = copy.copy(beamline_element)
+    element.set_input_beam(None)
+
+    try:
+        return pickle.dumps(element, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as exception:
+        print("Element cannot be sent to other processes (" + str(exception) + "): traced serially")
+        return None
+
+def _is_picklable(objects):
+    try:
+        pickle.dumps(objects, protocol=pickle.HIGHEST_PROTOCOL)
+        return True
+    except Exception as exception:
+        print("Objects cannot be sent to other processes (" + str(exception) + "): processed serially")
+        return False
+
+def _generate_beam(light_source):
+    return light_source.get_beam()
+
+def _get_beam(rays, N_cleaned):
+    beam = S4Beam(N=0)
+    beam.rays       = rays
+    beam._N_cleaned = N_cleaned
+
+    return beam
+
+def _trace_rays(beamline_element, rays):
+    beam = S4Beam(N=0)
+    beam.rays = numpy.asarray(rays, dtype=numpy.float64) # the element traces a duplicate
+
+    beamline_element.set_input_beam(beam)
+    output_beam, footprint = beamline_element.trace_beam()
+
+    ShadowProfiler.count_copy("trace duplicate", beam.rays.nbytes) # in this process only
+
+    return output_beam.rays, (None if footprint is None else footprint.rays)
+
+_worker_element = (None, None) # (pickled element, element): unpickled once per element in each worker process
+
+def _trace_block(element_data, rays):
+    global _worker_element
+
+    if _worker_element[0] != element_data: _worker_element = (element_data, pickle.loads(element_data))
+
+    return _trace_rays(_worker_element[1], rays)
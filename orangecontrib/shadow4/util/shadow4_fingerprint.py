@@ -0,0 +1,72 @@
+
+import os, hashlib
+
+try:
+    from orangewidget.settings import Setting
+except:
+    Setting = None
+
+from orangecontrib.shadow4.util.shadow4_statistics import ShadowBeamStatistics
+
+class ShadowFingerprint:
+    # stable digests of beams, beamlines, ShadowData and widget settings: equal digests mean equal contents.
+    # Beam digests are memoised with the statistics of the (frozen) ray buffers, so they are computed once per buffer.
+    # Beamline digests are chained node by node (see ShadowBeamline); settings digests include the files they name.
+
+    @classmethod
+    def get_beam_fingerprint(cls, beam, sample_size=None):
+        if beam is None or not hasattr(beam, "rays"): return get_digest("no beam")
+        else: return ShadowBeamStatistics.get(beam).get_digest(sample_size)
+
+    @classmethod
+    def get_beamline_fingerprint(cls, beamline):
+        # the beamline is described by its script (light source with nrays/seed, elements with their parameters)
+        if beamline is None: return get_digest("no beamline")
+        elif hasattr(beamline, "get_fingerprint"): return beamline.get_fingerprint() # chained, see ShadowBeamline
+
+        try:    description = beamline.to_python_code()
+        except: description = beamline.info()
+
+        return get_digest(description)
+
+    @classmethod
+    def get_data_fingerprint(cls, shadow_data, sample_size=None):
+        if shadow_data is None: return get_digest("no data")
+
+        return get_digest(cls.get_beam_fingerprint(shadow_data.beam, sample_size),
+                          cls.get_beamline_fingerprint(shadow_data.beamline),
+                          repr(shadow_data.initial_flux))
+
+    @classmethod
+    def get_settings(cls, widget, excluded=[]):
+        # values of the Setting attributes declared by the widget class and its ancestors
+        names = set()
+        for widget_class in type(widget).__mro__:
+            for name, value in vars(widget_class).items():
+                if not Setting is None and isinstance(value, Setting) and not name in excluded: names.add(name)
+
+        return {name : getattr(widget, name) for name in sorted(names)}
+
+    @classmethod
+    def get_settings_fingerprint(cls, widget, excluded=[]):
+        settings = sorted(cls.get_settings(widget, excluded).items())
+
+        return get_digest(type(widget).__module__ + "." + type(widget).__name__, repr(settings), cls.get_files_fingerprint([value for _, value in settings]))
+
+    @classmethod
+    def get_files_fingerprint(cls, values):
+        # files named by the values (e.g. prerefl, multilayer, mesh, crystal files): a file rewritten under the same
+        # name changes its modification time or size
+        files = []
+        for value in values:
+            if isinstance(value, str) and value.strip() != "" and os.path.isfile(value):
+                stat = os.stat(value)
+                files.append((os.path.abspath(value), stat.st_mtime_ns, stat.st_size))
+
+        return repr(files)
+
+def get_digest(*texts):
+    digest = hashlib.blake2b(digest_size=16)
+    for text in texts: digest.update(text.encode() + b"\0")
+
+    return digest.hexdigest()
@@ -0,0 +1,73 @@
+
+import weakref, numpy
+
+from shadow4.beam.s4_beam import S4Beam
+
+from orangecontrib.shadow4.util.shadow4_statistics import ShadowBeamStatistics
+
+class ShadowFootprint:
+    # lazy footprint: only the columns footprint plots use (X, Y, flag, intensity) are kept, and the S4Beam to plot
+    # is built on request, living as long as the caller holds it.
+    # Out-of-core footprints stay on disk until the first request.
+
+    COLUMNS = [1, 2, 10, 23]
+
+    def __init__(self, footprint, dtype=None):
+        self.__rays   = None
+        self.__source = None
+        self.__dtype  = dtype
+        self.__beam   = None
+
+        if hasattr(footprint, "get_memory_budget"): self.__source = footprint
+        else:                                       self.__rays   = _compact_rays(footprint, dtype)
+
+    @classmethod
+    def initialize_from_beam(cls, footprint, dtype=None):
+        if footprint is None or isinstance(footprint, ShadowFootprint): return footprint
+        else: return ShadowFootprint(footprint, dtype)
+
+    @classmethod
+    def has_column(cls, column):
+        return column in ShadowFootprint.COLUMNS
+
+    def get_rays(self):
+        # N x 4 array: X, Y, flag, intensity
+        if self.__rays is None:
+            self.__rays   = _compact_rays(self.__source, self.__dtype)
+            self.__source = None
+
+        return self.__rays
+
+    def get_memory_size(self):
+        return 0 if self.__rays is None else self.__rays.nbytes
+
+    def __getstate__(self): # for pickling: the built beam is not kept
+        state = self.__dict__.copy()
+        state["_ShadowFootprint__beam"] = None
+
+        return state
+
+    def get_beam(self):
+        beam = None if self.__beam is None else self.__beam()
+
+        if beam is None:
+            rays = self.get_rays()
+
+            beam = S4Beam(N=0)
+            beam.rays = numpy.zeros((rays.shape[0], 18), dtype=rays.dtype)
+            beam.rays[:, 0] = rays[:, 0]
+            beam.rays[:, 1] = rays[:, 1]
+            beam.rays[:, 9] = rays[:, 2]
+            beam.rays[:, 6] = numpy.sqrt(rays[:, 3]) # intensity = |Es|^2
+
+            self.__beam = weakref.ref(beam)
+
+        return beam
+
+def _compact_rays(footprint, dtype=None):
+    statistics = ShadowBeamStatistics.get(footprint) # chunk-aware
+    rays       = numpy.empty((statistics.get_number_of_rays(nolost=0), len(ShadowFootprint.COLUMNS)), dtype=statistics.get_dtype() if dtype is None else dtype)
+
+    for index, column in enumerate(ShadowFootprint.COLUMNS): rays[:, index] = statistics.get_column(column, nolost=0)
+
+    return rays
@@ -1,8 +1,33 @@
 
 import os, copy, numpy
 from shadow4.beam.s4_beam import S4Beam
+from shadow4.sources.s4_light_source_from_beamlines import S4LightSourceFromBeamlines
+
+from orangecontrib.shadow4.util.shadow4_statistics import ShadowBeamStatistics
+from orangecontrib.shadow4.util.shadow4_blocks import ShadowBlockBeam
+from orangecontrib.shadow4.util.shadow4_out_of_core import ShadowMemoryMappedBeam
+from orangecontrib.shadow4.util.shadow4_beamline import ShadowBeamline
+from orangecontrib.shadow4.util.shadow4_footprint import ShadowFootprint
+from orangecontrib.shadow4.util.shadow4_fingerprint import ShadowFingerprint
+from orangecontrib.shadow4.util.shadow4_profiling import ShadowProfiler
+
+_ELECTRIC_FIELD_COLUMNS = [6, 7, 8, 15, 16, 17]
+
+def _shared_rays(rays):
+    # the buffer is shared from now on, so it is frozen for every holder (the producer too, see ShadowData)
+    rays.flags.writeable = False
+    return rays.view()
+
+def _copied(rays, kind):
+    ShadowProfiler.count_copy(kind, rays.nbytes)
+    return rays.copy()
 
 class ShadowData:
+    # Rays are shared copy-on-write: duplicate() (and get_stack_item()) hand out views of the same buffer, which is frozen
+    # (writeable=False) for every holder, the producer included, as are the buffers with statistics attached (see
+    # ShadowBeamStatistics). A ShadowData that was sent or plotted is read-only: code writing rays in place gets them
+    # from mutable_beam(), which copies frozen buffers once; tracing and retracing work on new or duplicated beams.
+
     class ScanningData(object):
         def __init__(self,
                      scanned_variable_name,
@@ -38,6 +63,14 @@ class ShadowData:
         def get_additional_parameter(self, name):
             return self.__additional_parameters[name]
 
+    DOUBLE_PRECISION = numpy.float64
+    SINGLE_PRECISION = numpy.float32
+
+    STACKED_RAYS   = "stacked_rays"   # ScanningData parameter of stacks: number of rays of each scanned value
+    GENERATED_RAYS = "generated_rays" # ScanningData parameter of stacks: rays generated for each scanned value (lost rays dropped, see get_flux)
+    ENSEMBLE       = "ensemble"       # ScanningData parameter of stacks of independent seeds (see get_ensemble_statistics)
+    LAST_BEAMLINE  = "last_beamline"  # ScanningData parameter of stacks of scanned values (and their items): the beamline is the one of the last value
+
     def __init__(self, beam=None, footprint=None, number_of_rays=0, beamline=None):
         if (beam is None):
             if number_of_rays > 0: self.__beam = S4Beam(number_of_rays)
@@ -45,10 +78,11 @@ class ShadowData:
             self.__footprint = None
         else:
             self.__beam      = beam
-            self.__footprint = footprint
+            self.__footprint = ShadowFootprint.initialize_from_beam(footprint)
 
         self.__scanning_data = None
         self.__initial_flux  = None
+        self.__generated     = None # rays generated by the source, if lost rays were dropped (see get_flux)
         self.__beamline      = beamline  # added by srio
 
     @property
@@ -61,11 +95,15 @@ class ShadowData:
 
     @property
     def footprint(self):
-        return self.__footprint
+        # built on request from the lazy footprint (X, Y, flag and intensity only)
+        return None if self.__footprint is None else self.__footprint.get_beam()
 
     @footprint.setter
     def footprint(self, footprint):
-        self._footprint = footprint
+        self.__footprint = ShadowFootprint.initialize_from_beam(footprint)
+
+    def has_footprint(self):
+        return not self.__footprint is None and self.__footprint.get_rays().shape[0] > 0
 
     @property
     def beamline(self):
@@ -83,6 +121,17 @@ class ShadowData:
     def initial_flux(self, initial_flux):
         self.__initial_flux = initial_flux
 
+    @property
+    def number_of_generated_rays(self):
+        return self.__generated
+
+    @number_of_generated_rays.setter
+    def number_of_generated_rays(self, number_of_generated_rays):
+        self.__generated = number_of_generated_rays
+
+    def get_number_of_generated_rays(self):
+        return self.get_number_of_rays(0) if self.__generated is None else self.__generated
+
     @property
     def scanning_data(self):
         return self.__scanning_data
@@ -93,17 +142,24 @@ class ShadowData:
 
     def get_flux(self, nolost=1):
         if not self.__beam is None and not self.__initial_flux is None:
-            return (self.__beam.intensity(nolost) / self.get_number_of_rays(0)) * self.get_initial_flux()
+            return (self.get_statistics().get_intensity(nolost) / self.get_number_of_generated_rays()) * self.__initial_flux
         else:
             return None
 
     def get_number_of_rays(self, nolost=0):
-        if not hasattr(self.__beam, "rays"): return 0
-        if nolost == 0:   return self.__beam.rays.shape[0]
-        elif nolost == 1: return self.__beam.rays[numpy.where(self.__beam.rays[:, 9] > 0)].shape[0]
-        elif nolost == 2: return self.__beam.rays[numpy.where(self.__beam.rays[:, 9] < 0)].shape[0]
+        # nolost=0: stored rays; nolost=2 counts the lost rays dropped upstream too (see compact_lost_rays)
+        if self.__beam is None: return 0
+        if nolost in (0, 1): return self.get_statistics().get_number_of_rays(nolost)
+        elif nolost == 2:    return self.get_statistics().get_number_of_rays(nolost) + self.get_number_of_generated_rays() - self.get_number_of_rays(0)
         else: raise ValueError("nolost flag value not valid")
 
+    def get_statistics(self):
+        return ShadowBeamStatistics.get(self.__beam)
+
+    def get_fingerprint(self, sample_size=None):
+        # equal fingerprints: same rays (or same sampled rays, with sample_size), beamline and flux
+        return ShadowFingerprint.get_data_fingerprint(self, sample_size)
+
     def load_from_file(self, file_name):
         if not self.__beam is None:
             if os.path.exists(file_name): self.__beam.load_h5(file_name)
@@ -113,65 +169,272 @@ class ShadowData:
         if not self.__beam is None:
             self.__beam.write_h5(file_name)
 
+    def is_single_precision(self):
+        return not self.__beam is None and self.get_statistics().get_dtype() == ShadowData.SINGLE_PRECISION
+
+    def is_stack(self):
+        return not self.__scanning_data is None and self.__scanning_data.has_additional_parameter(ShadowData.STACKED_RAYS)
+
+    def get_stack_size(self):
+        return len(self.__scanning_data.get_additional_parameter(ShadowData.STACKED_RAYS)) if self.is_stack() else 1
+
+    def is_ensemble(self):
+        return self.is_stack() and self.__scanning_data.has_additional_parameter(ShadowData.ENSEMBLE)
+
+    def is_replayable(self):
+        # the beamline generates these rays again (see ShadowBeamlineReplay): not for scanned values, traced with other settings
+        return self.__scanning_data is None or not self.__scanning_data.has_additional_parameter(ShadowData.LAST_BEAMLINE)
+
+    def get_stack_item(self, index):
+        # ShadowData of one scanned value of a stack: its rays, with the beamline of the stack
+        if not self.is_stack(): raise ValueError("Data is not a stack")
+
+        sizes = self.__scanning_data.get_additional_parameter(ShadowData.STACKED_RAYS)
+        start = int(numpy.sum(sizes[:index]))
+
+        beam = S4Beam(N=0)
+        beam.rays = _shared_rays(self.__beam.rays[start : start + sizes[index]])
+
+        item = ShadowData(beam=beam, beamline=self.__beamline)
+        item.initial_flux  = self.__initial_flux
+        if self.__scanning_data.has_additional_parameter(ShadowData.GENERATED_RAYS):
+            item.number_of_generated_rays = self.__scanning_data.get_additional_parameter(ShadowData.GENERATED_RAYS)[index]
+        item.scanning_data = ShadowData.ScanningData(self.__scanning_data.scanned_variable_name,
+                                                     self.__scanning_data.scanned_variable_value[index],
+                                                     self.__scanning_data.scanned_variable_display_name,
+                                                     self.__scanning_data.scanned_variable_um,
+                                                     additional_parameters={} if self.is_replayable() else {ShadowData.LAST_BEAMLINE : True})
+        return item
+
+    def mutable_beam(self):
+        # copy-on-write: rays shared with other ShadowData are read-only, the first writer gets its own copy
+        if self.__beam is None: pass
+        elif hasattr(self.__beam, "set_blocks"): # only the shared blocks are copied
+            self.__beam.set_blocks([buffer if buffer.flags.writeable else _copied(buffer, "copy-on-write") for buffer in self.__beam.get_ray_buffers()])
+        elif not self.__beam.rays.flags.writeable:
+            if hasattr(self.__beam, "iterate_chunks"): self.__beam = self.__beam.duplicate() # copied out-of-core
+            else:                                      self.__beam.rays = _copied(self.__beam.rays, "copy-on-write")
+
+        return self.__beam
+
     def duplicate(self, copy_rays=True):
-        beam = S4Beam()
         if copy_rays:
-            beam.rays = copy.deepcopy(self.beam.rays)
-            beam._N_cleaned = self.beam._N_cleaned
+            beam = copy.copy(self.beam) # keeps the beam class (e.g. memory-mapped, blocks)
+            if hasattr(beam, "set_blocks"): beam.set_blocks([_shared_rays(buffer) for buffer in self.beam.get_ray_buffers()])
+            else:                           beam.rays = _shared_rays(self.beam.rays)
+            ShadowBeamStatistics.share(self.beam, beam)
+        else:
+            beam = S4Beam(N=0)
 
-        new_shadow_beam = ShadowData(beam=beam)
+        new_shadow_beam = ShadowData(beam=beam, footprint=self.__footprint if copy_rays else None) # the lazy footprint is shared
         new_shadow_beam.scanning_data = self.__scanning_data
         new_shadow_beam.initial_flux  = self.__initial_flux
-        new_shadow_beam.beamline = self.__beamline.duplicate()
+        new_shadow_beam.number_of_generated_rays = self.__generated
+        new_shadow_beam.beamline = ShadowBeamline.initialize_from_beamline(self.__beamline) # O(1): elements are shared
 
         return new_shadow_beam
 
     @classmethod
-    def merge_beams(cls, beam_1, beam_2, which_flux=3, merge_history=1):
-        if beam_1 and beam_2:
-            rays_1 = None
-            rays_2 = None
-
-            if len(getattr(beam_1.beam, "rays", numpy.zeros(0))) > 0: rays_1 = copy.deepcopy(beam_1.beam.rays)
-            if len(getattr(beam_2.beam, "rays", numpy.zeros(0))) > 0: rays_2 = copy.deepcopy(beam_2.beam.rays)
-
-            merged_beam = beam_1.duplicate(copy_rays=False, history=True)
-
-            merged_beam.oe_number = beam_1.oe_number
-            merged_beam.beam.rays = numpy.append(rays_1, rays_2, axis=0)
-
-            merged_beam.beam.rays[:, 11] = numpy.arange(1, len(merged_beam.beam.rays) + 1, 1) # ray_index
-
-            if which_flux ==1 :
-                if not beam_1.initial_flux is None:
-                    merged_beam.initial_flux = beam_1.initial_flux
-            elif which_flux == 2:
-                if not beam_2.initial_flux is None:
-                    merged_beam.initial_flux = beam_2.initial_flux
-            else:
-                if not beam_1.initial_flux is None and not beam_2.initial_flux is None:
-                    merged_beam.initial_flux = beam_1.initial_flux + beam_2.initial_flux
-
-            if merge_history > 0:
-                if beam_1.history and beam_2.history:
-                    if len(beam_1.history) == len(beam_2.history):
-                        for index in range(1, beam_1.oe_number + 1):
-                            history_element_1 =  beam_1.get_oe_history(index)
-                            history_element_2 =  beam_2.get_oe_history(index)
-
-                            merged_history_element = merged_beam.get_oe_history(index)
-                            merged_history_element.input_data = ShadowData.merge_beams(history_element_1.input_data, history_element_2.input_data, which_flux, merge_history=(merge_history != 1))
-                    else:
-                        raise ValueError("Histories must have the same path to be merged")
-                else:
-                    raise ValueError("Both beams must have a history to be merged")
-
-            return merged_beam
+    def compact_lost_rays(cls, beam, threshold=0.0):
+        # a beam without the lost rays of beam, if their fraction exceeds threshold (beam itself otherwise). beam is not
+        # modified; the data of the compacted beam must keep the generated rays (number_of_generated_rays) for the flux.
+        # Chunked beams are compacted chunk by chunk: memory-mapped beams to a new file (the rays stay out of core),
+        # blocks to blocks in memory
+        if beam is None: return beam
+
+        statistics = ShadowBeamStatistics.get(beam)
+        size       = statistics.get_number_of_rays(0)
+        if size == 0 or statistics.get_number_of_rays(2) <= threshold * size: return beam
+
+        N_cleaned = beam._N_cleaned if beam.is_cleaned() else size
+
+        if isinstance(beam, ShadowMemoryMappedBeam):
+            new_beam = ShadowMemoryMappedBeam.create_like(beam, N=statistics.get_number_of_rays(1))
+            new_beam._N_cleaned = N_cleaned
+
+            start = 0
+            for chunk in beam.iterate_chunks():
+                good_rays = chunk[chunk[:, 9] > 0]
+                new_beam.rays[start : start + good_rays.shape[0]] = good_rays
+                start += good_rays.shape[0]
+
+            if new_beam.rays.shape[0] > 0: new_beam.rays.flush()
+            ShadowProfiler.count_copy("lost rays compaction (out-of-core)", new_beam.rays.nbytes)
+        elif hasattr(beam, "iterate_chunks"):
+            new_beam = ShadowBlockBeam(blocks=[chunk[chunk[:, 9] > 0] for chunk in beam.iterate_chunks()],
+                                       block_size=beam.get_block_size() if hasattr(beam, "get_block_size") else ShadowBlockBeam.DEFAULT_BLOCK_SIZE,
+                                       N_cleaned=N_cleaned)
+            ShadowProfiler.count_copy("lost rays compaction", sum([block.nbytes for block in new_beam.get_ray_buffers()]))
+        else:
+            new_beam = S4Beam(N=0)
+            new_beam.rays       = beam.rays[beam.rays[:, 9] > 0]
+            new_beam._N_cleaned = N_cleaned
+            ShadowProfiler.count_copy("lost rays compaction", new_beam.rays.nbytes)
+
+        return new_beam
+
+    @classmethod
+    def beam_with_precision(cls, beam, precision=DOUBLE_PRECISION):
+        # float32 is a storage format: tracing kernels work on a float64 copy
+        if beam is None or not hasattr(beam, "rays") or beam.rays.dtype == precision: return beam
+        if hasattr(beam, "iterate_chunks"): return beam # chunked beams: converted chunk by chunk when traced
+
+        new_beam = S4Beam(N=0)
+        new_beam.rays = beam.rays.astype(precision)
+        new_beam._N_cleaned = beam._N_cleaned
+
+        ShadowProfiler.count_copy("precision conversion", new_beam.rays.nbytes)
+
+        return new_beam
+
+    @classmethod
+    def merge_beams(cls, *input_data, weights=None, which_flux=0, merge_history=1, light_source=None):
+        input_data = [data for data in input_data if not data is None]
+
+        if len(input_data) == 0: raise Exception("At least one input beam should be provided for merging")
+        if weights is None: weights = [1.0] * len(input_data)
+        elif len(weights) != len(input_data): raise ValueError("Weights must be as many as the input beams")
+
+        for index, weight in enumerate(weights):
+            if weight < 0: raise ValueError("Weight #%d must be >= 0" % (index + 1))
+
+        sizes = [data.get_number_of_rays(nolost=0) for data in input_data] # stored rays
+        dtype = numpy.result_type(*[data.get_statistics().get_dtype() for data in input_data])
+
+        if any([hasattr(data.beam, "set_blocks") for data in input_data]): # blocks are appended, never concatenated
+            blocks = []
+            start  = 0
+            for data, weight in zip(input_data, weights):
+                for chunk in data.get_statistics().iterate_chunks():
+                    block = chunk.astype(dtype) # copy
+                    if weight != 1.0: block[:, _ELECTRIC_FIELD_COLUMNS] *= numpy.sqrt(weight) # weights are intensities!
+                    block[:, 11] = numpy.arange(start + 1, start + block.shape[0] + 1, 1) # ray_index
+                    blocks.append(block)
+                    start += block.shape[0]
+
+            merged_beam = ShadowBlockBeam(blocks=blocks, block_size=max([data.beam.get_block_size() for data in input_data if hasattr(data.beam, "set_blocks")]))
+        else:
+            rays = numpy.empty((sum(sizes), 18), dtype=dtype)
+
+            start = 0
+            for data, size, weight in zip(input_data, sizes, weights):
+                block = rays[start : start + size]
+                block[:] = data.beam.rays
+                if weight != 1.0: block[:, _ELECTRIC_FIELD_COLUMNS] *= numpy.sqrt(weight) # weights are intensities!
+                start += size
+
+            rays[:, 11] = numpy.arange(1, rays.shape[0] + 1, 1) # ray_index
+
+            merged_beam = S4Beam(N=0)
+            merged_beam.rays = rays
+
+        ShadowProfiler.count_copy("merge", sum([buffer.nbytes for buffer in merged_beam.get_ray_buffers()]) if hasattr(merged_beam, "get_ray_buffers") else merged_beam.rays.nbytes)
+        if any([data.beam.is_cleaned() for data in input_data]):
+            merged_beam._N_cleaned = sum([data.beam.get_number_of_rays(nolost=0) if data.beam.is_cleaned() else size
+                                          for data, size in zip(input_data, sizes)])
+
+        if merge_history > 0:
+            if light_source is None:
+                light_source = S4LightSourceFromBeamlines(name="Merged beamlines")
+                for index, (data, weight) in enumerate(zip(input_data, weights)):
+                    light_source.append_beamline(data.beamline, id="beamline channel %d" % (index + 1), weight=weight)
+
+            beamline = ShadowBeamline(light_source=light_source)
         else:
-            raise Exception("Both input beams should provided for merging")
+            beamline = input_data[0].beamline
+
+        merged_data = ShadowData(beam=merged_beam, beamline=beamline)
+        merged_data.number_of_generated_rays = sum([data.get_number_of_generated_rays() for data in input_data]) # lost rays may be dropped
+
+        initial_fluxes = [data.initial_flux for data in input_data]
+        if 1 <= which_flux <= len(input_data):
+            merged_data.initial_flux = initial_fluxes[which_flux - 1]
+        elif not None in initial_fluxes:
+            merged_data.initial_flux = sum(initial_fluxes)
+
+        return merged_data
+
+    def get_ensemble_statistics(self, columns=[1, 3, 4, 6], nolost=1, nbins=100, ranges={}):
+        # per seed of an ensemble: intensity (and flux), centroid and FWHM of the columns, as
+        # {quantity: (mean, standard error of the mean, values of the seeds)}. The merged beam accumulates all the seeds:
+        # the spread of the seeds is the statistical error of a single seed run, the standard error the one of the ensemble.
+        # FWHMs of all the seeds are computed on the same bins (the range of the merged beam, or ranges[column])
+        if not self.is_stack(): raise ValueError("Data is not an ensemble")
+
+        items      = [self.get_stack_item(index) for index in range(self.get_stack_size())]
+        statistics = self.get_statistics()
+        values     = {"intensity" : [item.get_statistics().get_intensity(nolost=nolost) for item in items]}
+
+        if not self.__initial_flux is None: values["flux"] = [item.get_flux(nolost=nolost) for item in items]
+
+        for column in columns:
+            xrange = ranges.get(column, None)
+            if xrange is None: xrange = statistics.get_column_range(column, nolost=nolost)
+
+            values["centroid col%02d" % column] = [item.get_statistics().get_moments(column, nolost=nolost, ref=23)[1] for item in items]
+            values["fwhm col%02d" % column]     = [item.get_statistics().histo1(column, xrange=xrange, nbins=nbins, nolost=nolost, ref=23)["fwhm"] for item in items]
+
+        ensemble_statistics = {}
+        for name, seed_values in values.items():
+            seed_values = numpy.array([numpy.nan if value is None else value for value in seed_values], dtype=float)
+            valid       = seed_values[numpy.isfinite(seed_values)]
+
+            mean  = valid.mean() if valid.size > 0 else numpy.nan
+            error = valid.std(ddof=1) / numpy.sqrt(valid.size) if valid.size > 1 else numpy.nan
+
+            ensemble_statistics[name] = (mean, error, seed_values)
+
+        return ensemble_statistics
+
+    def get_ensemble_report(self, columns=[1, 3, 4, 6], nolost=1, nbins=100, ranges={}):
+        ensemble_statistics = self.get_ensemble_statistics(columns, nolost, nbins, ranges)
+
+        text  = "Ensemble of %d seeds (%s)\n" % (self.get_stack_size(), ", ".join([str(value) for value in self.__scanning_data.scanned_variable_value]))
+        text += "%-16s %16s %16s %16s\n" % ("quantity", "mean", "std. error", "seed s.d.")
+
+        for name, (mean, error, seed_values) in ensemble_statistics.items():
+            text += "%-16s %16.9g %16.9g %16.9g\n" % (name, mean, error, error * numpy.sqrt(numpy.count_nonzero(numpy.isfinite(seed_values))))
+
+        return text
+
+    @classmethod
+    def initialize_as_stack(cls, beams, variable_name, variable_values, variable_display_name="", variable_um="", footprints=None, beamline=None, ensemble=False,
+                            generated_rays=None):
+        # the beams of the values of a scanned variable, one after the other as blocks of one beam: downstream elements
+        # trace all of them in one pass, ray counts are kept (see get_stack_item).
+        # generated_rays: rays generated for each value, if lost rays were dropped (the stored rays otherwise).
+        # An ensemble is a stack of the same source with independent seeds. The beamline is the one of the last value: only
+        # ensembles can be replayed (see is_replayable)
+        if len(beams) != len(variable_values): raise ValueError("Beams must be as many as the scanned values")
+        if not generated_rays is None and len(generated_rays) != len(beams): raise ValueError("Generated rays must be as many as the beams")
+
+        def stack(beams):
+            statistics = [ShadowBeamStatistics.get(beam) for beam in beams]
+            dtype      = numpy.result_type(*[beam_statistics.get_dtype() for beam_statistics in statistics])
+            blocks     = [chunk.astype(dtype, copy=False) for beam_statistics in statistics for chunk in beam_statistics.iterate_chunks()]
+
+            return ShadowBlockBeam(blocks=blocks, block_size=max([ShadowBlockBeam.DEFAULT_BLOCK_SIZE] + [block.shape[0] for block in blocks]))
+
+        if not footprints is None and any([footprint is None for footprint in footprints]): footprints = None
+
+        data = ShadowData(beam=stack(beams),
+                          footprint=None if footprints is None else stack([footprint.get_beam() if isinstance(footprint, ShadowFootprint) else footprint for footprint in footprints]),
+                          beamline=beamline)
+        additional_parameters = {ShadowData.STACKED_RAYS : [sum([chunk.shape[0] for chunk in ShadowBeamStatistics.get(beam).iterate_chunks()]) for beam in beams]} # stored rays
+        if ensemble: additional_parameters[ShadowData.ENSEMBLE]      = True
+        else:        additional_parameters[ShadowData.LAST_BEAMLINE] = True
+        if not generated_rays is None:
+            additional_parameters[ShadowData.GENERATED_RAYS] = list(generated_rays)
+            data.number_of_generated_rays = sum(generated_rays)
+
+        data.scanning_data = ShadowData.ScanningData(variable_name, list(variable_values), variable_display_name, variable_um,
+                                                     additional_parameters=additional_parameters)
+        return data
 
     @classmethod
     def initialize_from_beam(cls, input_beam):
+        ShadowProfiler.count_copy("duplicate", input_beam.rays.nbytes)
+
         return input_beam.duplicate()
 
 
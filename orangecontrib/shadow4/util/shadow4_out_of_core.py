@@ -0,0 +1,114 @@
+
+import os, tempfile, weakref, numpy
+
+from orangecontrib.shadow4.util.shadow4_blocks import ShadowChunkedBeam, generate_ray_chunks
+from orangecontrib.shadow4.util.shadow4_profiling import ShadowProfiler
+
+class ShadowMemoryMappedBeam(ShadowChunkedBeam):
+    # S4Beam whose rays live in a .npy file of a scratch directory, mapped in memory.
+    # Chunks are sized from the memory budget, so chunk-aware code keeps the resident memory within it;
+    # code that is not chunk-aware still works, paging the whole file in.
+
+    DEFAULT_MEMORY_BUDGET = 1024 # MB
+    COPIES_PER_CHUNK      = 8    # ray arrays alive at the same time while tracing a chunk (input, duplicate, output, footprint, temporaries)
+
+    def __init__(self, N=0, dtype=numpy.float64, memory_budget=DEFAULT_MEMORY_BUDGET, scratch_directory=None, N_cleaned=None):
+        super().__init__(N=0, N_cleaned=N_cleaned)
+
+        if not scratch_directory: scratch_directory = None
+        elif not os.path.exists(scratch_directory): raise Exception("Scratch directory " + scratch_directory + " not existing")
+
+        file_descriptor, file_name = tempfile.mkstemp(prefix="shadow4_beam_", suffix=".npy", dir=scratch_directory)
+        os.close(file_descriptor)
+
+        if N > 0:
+            self.rays = numpy.lib.format.open_memmap(file_name, mode="w+", dtype=dtype, shape=(N, 18))
+            weakref.finalize(self.rays, _remove_file, file_name) # the file goes away with the last view on the rays
+        else: # a file cannot be mapped with zero length
+            self.rays = numpy.zeros((0, 18), dtype=dtype)
+            _remove_file(file_name)
+
+        self.__file_name         = file_name
+        self.__memory_budget     = memory_budget
+        self.__scratch_directory = scratch_directory
+
+    @classmethod
+    def create_like(cls, beam, N=None, dtype=None):
+        return ShadowMemoryMappedBeam(N=beam.rays.shape[0] if N is None else N,
+                                      dtype=beam.rays.dtype if dtype is None else dtype,
+                                      memory_budget=beam.get_memory_budget(),
+                                      scratch_directory=beam.get_scratch_directory(),
+                                      N_cleaned=beam._N_cleaned)
+
+    @classmethod
+    def initialize_from_light_source(cls, light_source, dtype=numpy.float64, memory_budget=DEFAULT_MEMORY_BUDGET, scratch_directory=None, monitor=None):
+        beam = ShadowMemoryMappedBeam(N=light_source.get_nrays(), dtype=dtype, memory_budget=memory_budget, scratch_directory=scratch_directory)
+
+        for start, rays in generate_ray_chunks(light_source, beam.get_chunk_size(), monitor): beam.rays[start : start + rays.shape[0]] = rays
+
+        if beam.rays.shape[0] > 0: beam.rays.flush()
+
+        return beam
+
+    @classmethod
+    def initialize_from_beam(cls, input_beam, dtype=numpy.float64, memory_budget=DEFAULT_MEMORY_BUDGET, scratch_directory=None):
+        beam = ShadowMemoryMappedBeam(N=input_beam.rays.shape[0], dtype=dtype, memory_budget=memory_budget,
+                                      scratch_directory=scratch_directory, N_cleaned=input_beam._N_cleaned)
+        beam.rays[:] = input_beam.rays
+
+        return beam
+
+    def get_file_name(self):
+        return self.__file_name
+
+    def get_memory_budget(self):
+        return self.__memory_budget
+
+    def get_scratch_directory(self):
+        return self.__scratch_directory
+
+    def get_chunk_size(self):
+        return max(1, int(self.__memory_budget * 2**20 / (ShadowMemoryMappedBeam.COPIES_PER_CHUNK * 18 * self.rays.dtype.itemsize)))
+
+    def iterate_chunks(self):
+        chunk_size = self.get_chunk_size()
+
+        for start in range(0, self.rays.shape[0], chunk_size): yield self.rays[start : start + chunk_size]
+
+    def duplicate(self):
+        beam = ShadowMemoryMappedBeam.create_like(self)
+        for start, chunk in zip(range(0, self.rays.shape[0], self.get_chunk_size()), self.iterate_chunks()):
+            beam.rays[start : start + chunk.shape[0]] = chunk
+
+        ShadowProfiler.count_copy("duplicate (out-of-core)", beam.rays.nbytes)
+
+        return beam
+
+    def trace_beamline_element(self, beamline_element, monitor=None, tracer=None):
+        # the results are written to new memory-mapped beams
+        output_beam = None
+        footprint   = None
+        start       = 0
+
+        for output_rays, footprint_rays in self._trace_chunks(beamline_element, monitor, tracer):
+            size = output_rays.shape[0]
+
+            if output_beam is None:
+                output_beam = ShadowMemoryMappedBeam.create_like(self)
+                if not footprint_rays is None: footprint = ShadowMemoryMappedBeam.create_like(self)
+
+            if start + size > output_beam.rays.shape[0]: raise Exception("Out-of-core tracing needs elements preserving the number of rays")
+
+            output_beam.rays[start : start + size] = output_rays
+            if not footprint is None: footprint.rays[start : start + size] = footprint_rays
+
+            start += size
+
+        if output_beam is None: output_beam = ShadowMemoryMappedBeam.create_like(self)
+        if start != output_beam.rays.shape[0]: raise Exception("Out-of-core tracing needs elements preserving the number of rays")
+
+        return output_beam, footprint
+
+def _remove_file(file_name):
+    try:    os.remove(file_name)
+    except: pass
@@ -0,0 +1,269 @@
+import os, sys, json, time, itertools, threading
+from collections import deque
+from contextlib import contextmanager
+
+class ShadowProfiler:
+    # wall and CPU (thread) times of the stages of the widget runs (input duplicate, element instantiation, trace,
+    # post-trace, script generation, histogramming, rendering, send...), recorded for all the widgets of the process.
+    # Stages nest: a stage opened without widget (e.g. histogramming in ShadowPlot) is recorded for the widget of the
+    # enclosing stage of the same thread, and it is not recorded out of a widget stage. The self time of a stage
+    # excludes its nested stages.
+    # Memory: each stage records the resident memory at its end and how much it raised the peak of the process; copies
+    # of ray buffers (count_copy) are counted for the widget of the enclosing stage. The peak increase of a stage
+    # includes the one of its nested stages: the peak increase of a run sums the outermost stages of the widget only.
+    # Records are kept in memory (the last MAXIMUM_RECORDS) and exported as a Chrome trace (chrome://tracing, Perfetto).
+
+    MAXIMUM_RECORDS = 100000
+    OTHER           = "(other)" # copies out of the widget stages
+
+    __records    = deque(maxlen=MAXIMUM_RECORDS) # (sequence, widget, stage, thread, thread name, start, wall, self wall, cpu, rss, peak increase, depth)
+    __copies     = deque(maxlen=MAXIMUM_RECORDS) # (sequence, widget, kind, bytes)
+    __run_starts = {} # widget -> sequence of its last run start
+    __sequence   = itertools.count()
+    __lock       = threading.Lock()
+    __stacks     = threading.local() # open stages of the thread
+    __origin     = time.perf_counter()
+    __enabled    = True
+
+    @classmethod
+    def set_enabled(cls, enabled=True):
+        cls.__enabled = enabled
+
+    @classmethod
+    def is_enabled(cls):
+        return cls.__enabled
+
+    @classmethod
+    @contextmanager
+    def stage(cls, stage, widget=None):
+        stack = cls.__get_stack()
+        if widget is None and len(stack) > 0: widget = stack[-1]["widget"]
+
+        if not cls.__enabled or widget is None:
+            yield
+        else:
+            depth = len([enclosing for enclosing in stack if enclosing["widget"] == widget]) # enclosing stages of the widget
+            frame = {"widget" : widget, "children_wall" : 0.0}
+            stack.append(frame)
+
+            _, start_peak = get_memory_usage()
+            start         = time.perf_counter()
+            start_cpu     = time.thread_time()
+            try:
+                yield
+            finally:
+                wall = time.perf_counter() - start
+                cpu  = time.thread_time() - start_cpu
+
+                rss, peak = get_memory_usage()
+
+                stack.pop()
+                if len(stack) > 0: stack[-1]["children_wall"] += wall
+
+                thread = threading.current_thread()
+                with cls.__lock: cls.__records.append((next(cls.__sequence), widget, stage, thread.ident, thread.name, start - cls.__origin, wall, wall - frame["children_wall"], cpu,
+                                                       rss, None if start_peak is None or peak is None else peak - start_peak, depth))
+
+    @classmethod
+    def profiled(cls, stage, function, widget=None):
+        # function with its calls recorded as stage (e.g. callbacks run later)
+        def profiled_function(*args, **kwargs):
+            with cls.stage(stage, widget): return function(*args, **kwargs)
+
+        return profiled_function
+
+    @classmethod
+    def count_copy(cls, kind, number_of_bytes, widget=None):
+        # a ray buffer was copied (kind: e.g. "duplicate", "nolost selection", "precision conversion", "merge")
+        if not cls.__enabled: return
+
+        if widget is None:
+            stack  = cls.__get_stack()
+            widget = stack[-1]["widget"] if len(stack) > 0 else ShadowProfiler.OTHER
+
+        with cls.__lock: cls.__copies.append((next(cls.__sequence), widget, kind, int(number_of_bytes)))
+
+    @classmethod
+    def start_run(cls, widget):
+        # the following records are the last run of the widget (see get_run_summary)
+        with cls.__lock: cls.__run_starts[widget] = next(cls.__sequence)
+
+    @classmethod
+    def clear(cls, widget=None):
+        with cls.__lock:
+            if widget is None:
+                cls.__records.clear()
+                cls.__copies.clear()
+                cls.__run_starts.clear()
+            else:
+                for records in [cls.__records, cls.__copies]:
+                    kept = [record for record in records if record[1] != widget]
+                    records.clear()
+                    records.extend(kept)
+                cls.__run_starts.pop(widget, None)
+
+    @classmethod
+    def get_records(cls, widget=None, last_run=False):
+        # [{widget, stage, thread, start, wall, self_wall, cpu, rss, peak_increase, depth}], times in seconds from the
+        # start of the session, memory in bytes (None if not available), depth: number of enclosing stages of the widget
+        with cls.__lock: records, first = list(cls.__records), cls.__get_run_start(widget, last_run)
+
+        return [{"widget"        : record[1],
+                 "stage"         : record[2],
+                 "thread"        : record[4],
+                 "start"         : record[5],
+                 "wall"          : record[6],
+                 "self_wall"     : record[7],
+                 "cpu"           : record[8],
+                 "rss"           : record[9],
+                 "peak_increase" : record[10],
+                 "depth"         : record[11]} for record in records if (widget is None or record[1] == widget) and record[0] >= first]
+
+    @classmethod
+    def get_copies(cls, widget=None, last_run=False):
+        # {kind: (count, bytes)}
+        with cls.__lock: copies, first = list(cls.__copies), cls.__get_run_start(widget, last_run)
+
+        summary = {}
+        for sequence, copy_widget, kind, number_of_bytes in copies:
+            if (widget is None or copy_widget == widget) and sequence >= first:
+                count, total = summary.get(kind, (0, 0))
+                summary[kind] = (count + 1, total + number_of_bytes)
+
+        return summary
+
+    @classmethod
+    def get_widgets(cls):
+        with cls.__lock: widgets = [record[1] for record in cls.__records] + [copy[1] for copy in cls.__copies]
+
+        return list(dict.fromkeys(widgets)) # in order of appearance
+
+    @classmethod
+    def get_table(cls, widget):
+        # per stage, in order of first completion: [stage, calls, wall, self wall, cpu, last wall] (seconds)
+        table = {}
+        for record in cls.get_records(widget):
+            row = table.setdefault(record["stage"], [record["stage"], 0, 0.0, 0.0, 0.0, 0.0])
+            row[1] += 1
+            row[2] += record["wall"]
+            row[3] += record["self_wall"]
+            row[4] += record["cpu"]
+            row[5]  = record["wall"]
+
+        return list(table.values())
+
+    @classmethod
+    def get_table_text(cls, widget):
+        table = cls.get_table(widget)
+        if len(table) == 0: return "No stages recorded"
+
+        text = "%-24s %8s %12s %12s %12s %12s\n" % ("Stage", "Calls", "Wall [s]", "Self [s]", "CPU [s]", "Last [s]")
+        for row in table: text += "%-24s %8d %12.4f %12.4f %12.4f %12.4f\n" % tuple(row)
+
+        return text + "\n" + cls.get_run_summary(widget)
+
+    @classmethod
+    def get_run_summary(cls, widget):
+        # memory of the last run of the widget: peak resident memory, its increase, copies of ray buffers
+        records = cls.get_records(widget, last_run=True)
+        copies  = cls.get_copies(widget, last_run=True)
+
+        peak_increase = _get_peak_increase(records)
+        rss           = [record["rss"] for record in records if not record["rss"] is None]
+
+        text = "Memory of the last run: resident %s (peak increase %s), ray buffer copies: %d (%s)" % (format_memory(max(rss) if len(rss) > 0 else None),
+                                                                                                     format_memory(peak_increase),
+                                                                                                     sum([count for count, _ in copies.values()]),
+                                                                                                     format_memory(sum([total for _, total in copies.values()])))
+        for kind, (count, total) in sorted(copies.items(), key=lambda item: -item[1][1]):
+            text += "\n    %-24s %6d copies %12s" % (kind, count, format_memory(total))
+
+        return text
+
+    @classmethod
+    def get_workflow_report(cls):
+        # last run of every widget, the ones raising the memory peak most first
+        rows = []
+        for widget in cls.get_widgets():
+            records = cls.get_records(widget, last_run=True)
+            copies  = cls.get_copies(widget, last_run=True)
+
+            rows.append((widget,
+                         sum([record["self_wall"] for record in records]),
+                         _get_peak_increase(records),
+                         sum([count for count, _ in copies.values()]),
+                         sum([total for _, total in copies.values()])))
+
+        if len(rows) == 0: return "No widget runs recorded"
+
+        text = "%-30s %12s %16s %8s %14s\n" % ("Widget", "Wall [s]", "Peak increase", "Copies", "Copied")
+        for widget, wall, peak_increase, count, total in sorted(rows, key=lambda row: (-row[2], -row[4])):
+            text += "%-30s %12.4f %16s %8d %14s\n" % (widget[:30], wall, format_memory(peak_increase), count, format_memory(total))
+
+        _, peak = get_memory_usage()
+
+        return text + "\nPeak resident memory of the process: " + format_memory(peak)
+
+    @classmethod
+    def write_chrome_trace(cls, file_name, widget=None):
+        # complete events ("X"), one track per thread; the widget is the category
+        process_id   = os.getpid()
+        events       = []
+        thread_names = {}
+
+        with cls.__lock: records = list(cls.__records)
+
+        for _, widget_name, stage, thread, thread_name, start, wall, self_wall, cpu, rss, peak_increase, _ in records:
+            if not widget is None and widget_name != widget: continue
+
+            thread_names[thread] = thread_name
+            events.append({"name" : stage,
+                           "cat"  : widget_name,
+                           "ph"   : "X",
+                           "ts"   : start * 1e6,
+                           "dur"  : wall * 1e6,
+                           "pid"  : process_id,
+                           "tid"  : thread,
+                           "args" : {"widget" : widget_name, "cpu_ms" : cpu * 1e3, "self_ms" : self_wall * 1e3, "rss" : rss, "peak_increase" : peak_increase}})
+
+        for thread, thread_name in thread_names.items():
+            events.append({"name" : "thread_name", "ph" : "M", "pid" : process_id, "tid" : thread, "args" : {"name" : thread_name}})
+
+        with open(file_name, "w") as file: json.dump({"traceEvents" : events, "displayTimeUnit" : "ms"}, file)
+
+    @classmethod
+    def __get_run_start(cls, widget, last_run):
+        return cls.__run_starts.get(widget, 0) if last_run and not widget is None else 0
+
+    @classmethod
+    def __get_stack(cls):
+        if not hasattr(cls.__stacks, "stack"): cls.__stacks.stack = []
+
+        return cls.__stacks.stack
+
+def _get_peak_increase(records):
+    # nested stages are in the peak increase of the enclosing one
+    return sum([record["peak_increase"] for record in records if record["depth"] == 0 and not record["peak_increase"] is None])
+
+def get_memory_usage():
+    # (resident, peak resident) memory of the process in bytes, None if not available
+    try:
+        with open("/proc/self/status", "r") as file: # Linux
+            values = {}
+            for line in file:
+                if line.startswith("VmRSS:") or line.startswith("VmHWM:"): values[line[:5]] = int(line.split()[1]) * 1024
+
+            return values.get("VmRSS", None), values.get("VmHWM", None)
+    except Exception:
+        pass
+
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return None, peak if sys.platform == "darwin" else peak * 1024 # kB elsewhere
+    except Exception:
+        return None, None
+
+def format_memory(size):
+    return "n.a." if size is None else "%.1f MB" % (size / 2**20)
@@ -0,0 +1,169 @@
+
+import itertools, multiprocessing, numpy, h5py
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from orangecontrib.shadow4.util.shadow4_objects import ShadowData
+from orangecontrib.shadow4.util.shadow4_cache import ShadowTraceCache
+from orangecontrib.shadow4.util.shadow4_batch import ShadowBatchRunner, write_ticket
+
+class ShadowScanAxis:
+    # values of a widget setting: node is a node id or title of the scheme
+    def __init__(self, node, setting, values):
+        if len(values) == 0: raise ValueError("No values for " + setting)
+
+        self.node    = node
+        self.setting = setting
+        self.values  = list(values)
+
+class ShadowScan:
+    # points of a scan: Cartesian product of the axes or, zipped, their values taken together (axes of equal length)
+
+    CARTESIAN = 0
+    ZIPPED    = 1
+
+    def __init__(self, axes, product=CARTESIAN):
+        if len(axes) == 0: raise ValueError("No scan axes")
+        if product == ShadowScan.ZIPPED and len(set([len(axis.values) for axis in axes])) > 1: raise ValueError("Zipped axes must have the same number of values")
+
+        self.__axes    = axes
+        self.__product = product
+
+    def get_axes(self):
+        return self.__axes
+
+    def get_product(self):
+        return self.__product
+
+    def get_points(self):
+        if self.__product == ShadowScan.CARTESIAN: return list(itertools.product(*[axis.values for axis in self.__axes]))
+        else:                                      return list(zip(*[axis.values for axis in self.__axes]))
+
+    def get_overrides(self, workflow, point):
+        # {node id: {setting: value}}
+        overrides = {}
+        for axis, value in zip(self.__axes, point): overrides.setdefault(workflow.get_node(axis.node), {})[axis.setting] = value
+
+        return overrides
+
+class ShadowScanEngine:
+    # evaluates the points of a scan on a scheme, without the canvas: each worker process runs the scheme with a batch
+    # runner (see shadow4_batch) and its own trace cache, so only the elements downstream of the scanned settings are
+    # traced again. Points are distributed to the workers in order; results (statistics of the beams, plotted tickets)
+    # are written to the scan file as they arrive.
+
+    STATISTICS_COLUMNS = [1, 3, 4, 6] # X, Z, X', Z'
+
+    def __init__(self, workflow, scan, number_of_workers=1, memory_budget=ShadowTraceCache.DEFAULT_MEMORY_BUDGET):
+        if number_of_workers < 1: raise ValueError("Number of workers must be >= 1")
+
+        for axis in scan.get_axes():
+            node = workflow.get_node(axis.node)
+            if not axis.setting in workflow.get_settings(node): raise ValueError("Setting " + axis.setting + " not found in node " + workflow.get_title(node))
+
+        self.__workflow          = workflow
+        self.__scan              = scan
+        self.__number_of_workers = number_of_workers
+        self.__memory_budget     = memory_budget
+
+    def run(self, file_name, monitor=None):
+        # monitor(fraction) is called after each point
+        points           = self.__scan.get_points()
+        number_of_points = len(points)
+
+        with h5py.File(file_name, "w") as file:
+            self.__write_axes(file, points)
+
+            if self.__number_of_workers == 1:
+                _initialize_worker(self.__workflow, self.__memory_budget)
+                for index, point in enumerate(points):
+                    self.__write_point(file, index, _evaluate_point(self.__scan.get_overrides(self.__workflow, point)), number_of_points, monitor)
+            else:
+                with ProcessPoolExecutor(max_workers=self.__number_of_workers,
+                                         mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=_initialize_worker,
+                                         initargs=(self.__workflow, self.__memory_budget)) as executor:
+                    points  = iter(enumerate(points))
+                    pending = {} # future -> point index
+
+                    try:
+                        while True:
+                            for index, point in itertools.islice(points, 2 * self.__number_of_workers - len(pending)):
+                                pending[executor.submit(_evaluate_point, self.__scan.get_overrides(self.__workflow, point))] = index
+                            if len(pending) == 0: break
+
+                            completed, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+                            for future in completed: self.__write_point(file, pending.pop(future), future.result(), number_of_points, monitor)
+                    finally:
+                        for future in pending: future.cancel()
+
+    def __write_axes(self, file, points):
+        file.attrs["product"] = "cartesian" if self.__scan.get_product() == ShadowScan.CARTESIAN else "zipped"
+        file.attrs["number_of_points"] = len(points)
+
+        axes = file.create_group("axes")
+        for index, axis in enumerate(self.__scan.get_axes()):
+            node = self.__workflow.get_node(axis.node)
+            data = numpy.array([point[index] for point in points])
+
+            try:    dataset = axes.create_dataset("axis_%d" % index, data=data)
+            except: dataset = axes.create_dataset("axis_%d" % index, data=numpy.array([str(value) for value in data.tolist()], dtype=h5py.string_dtype()))
+            dataset.attrs["node"]    = node
+            dataset.attrs["title"]   = self.__workflow.get_title(node)
+            dataset.attrs["setting"] = axis.setting
+
+        file.create_dataset("completed", data=numpy.zeros(len(points), dtype=bool))
+
+    def __write_point(self, file, index, results, number_of_points, monitor):
+        point = file.create_group("points/point_%06d" % index)
+
+        for node, (statistics, ticket) in results.items():
+            group_name = self.__workflow.get_group_name(node)
+            group      = point.create_group(group_name)
+
+            for name, value in statistics.items():
+                group.attrs[name] = value
+
+                # one array per statistic and node, over the points
+                summary = file.require_group("summary/" + group_name)
+                if not name in summary: summary.create_dataset(name, data=numpy.full(number_of_points, numpy.nan))
+                summary[name][index] = value
+
+            if not ticket is None: write_ticket(group.create_group("ticket"), ticket)
+
+        file["completed"][index] = True
+        file.flush()
+
+        if not monitor is None: monitor(numpy.count_nonzero(file["completed"][()]) / number_of_points)
+
+_worker_runner = None # batch runner of the worker process, reused by all its points
+
+def _initialize_worker(workflow, memory_budget):
+    global _worker_runner
+
+    _worker_runner = ShadowBatchRunner(workflow, ShadowTraceCache(memory_budget=memory_budget, spill=False))
+
+def _evaluate_point(overrides):
+    # beams stay in the worker: only their statistics and the plotted tickets are returned
+    results = {}
+    for node, (outputs, ticket) in _worker_runner.run(overrides, verbose=False).items():
+        data = outputs.get(ShadowBatchRunner.SHADOW_DATA, None)
+
+        results[node] = (_get_statistics(data) if isinstance(data, ShadowData) else {}, ticket)
+
+    return results
+
+def _get_statistics(shadow_data):
+    if shadow_data.beam is None: return {}
+
+    statistics = shadow_data.get_statistics()
+    values     = {"number_of_rays"      : statistics.get_number_of_rays(nolost=0),
+                  "number_of_good_rays" : statistics.get_number_of_rays(nolost=1),
+                  "intensity"           : statistics.get_intensity(nolost=1)}
+
+    for column in ShadowScanEngine.STATISTICS_COLUMNS:
+        _, average, sigma = statistics.get_moments(column, nolost=1, ref=23)
+
+        values["col%02d_average" % column] = average
+        values["col%02d_sigma" % column]   = sigma
+
+    return values
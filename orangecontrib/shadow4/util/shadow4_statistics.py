@@ -0,0 +1,556 @@
+
+import copy, hashlib, numpy
+
+from shadow4.beam.s4_beam import S4Beam
+from orangecontrib.shadow4.util.shadow4_profiling import ShadowProfiler
+
+class ShadowBeamStatistics:
+    # reductions of one ray buffer, memoised and attached to the S4Beam as "_shadow_statistics".
+    # The buffer is frozen (writeable=False) when the statistics are attached: a mutation needs a new buffer
+    # (ShadowData.mutable_beam(), clean_lost_rays(), retrace() on a duplicate, ...), which invalidates the cache.
+    # Beams exposing iterate_chunks() (memory-mapped and block beams) are reduced one chunk at a time.
+    # Reductions read the frozen buffers only, never the beam: statistics shared with a duplicate (see share) stay
+    # those of its rays after the original beam gets new ones.
+
+    def __init__(self, beam):
+        self.__buffers    = _ray_buffers(beam)
+        self.__rays       = self.__buffers[0] if len(self.__buffers) == 1 else None
+        self.__size       = sum([buffer.shape[0] for buffer in self.__buffers])
+        self.__N_cleaned  = beam._N_cleaned
+        self.__chunked    = hasattr(beam, "iterate_chunks")
+        self.__chunk_size = _chunk_size(beam)
+        self.__masks      = {}
+        self.__counts     = {}
+        self.__ranges     = {}
+        self.__moments    = {}
+        self.__histo1     = {}
+        self.__histo2     = {}
+        self.__digests    = {}
+
+        for buffer in self.__buffers: buffer.flags.writeable = False
+
+    @classmethod
+    def get(cls, beam):
+        statistics = getattr(beam, "_shadow_statistics", None)
+
+        if statistics is None or not statistics.is_valid(beam):
+            statistics = ShadowBeamStatistics(beam)
+            beam._shadow_statistics = statistics
+
+        return statistics
+
+    @classmethod
+    def share(cls, beam, new_beam):
+        # new_beam views the same frozen buffer (ShadowData.duplicate): it can reuse everything already computed
+        statistics = getattr(beam, "_shadow_statistics", None)
+        if not statistics is None and statistics.is_valid(new_beam): new_beam._shadow_statistics = statistics
+
+    @classmethod
+    def invalidate(cls, beam):
+        if hasattr(beam, "_shadow_statistics"): beam._shadow_statistics = None
+
+    def is_valid(self, beam):
+        buffers = _ray_buffers(beam)
+
+        if beam._N_cleaned != self.__N_cleaned or len(buffers) != len(self.__buffers): return False
+        else:
+            return all([buffer is old_buffer or (not buffer.flags.writeable and buffer.__array_interface__ == old_buffer.__array_interface__)
+                        for buffer, old_buffer in zip(buffers, self.__buffers)])
+
+    def get_dtype(self):
+        return numpy.result_type(*self.__buffers) if len(self.__buffers) > 0 else numpy.dtype(numpy.float64)
+
+    def iterate_chunks(self):
+        if self.__chunked: return _iterate_buffer_chunks(self.__buffers, self.__chunk_size) # as beam.iterate_chunks()
+        else:              return iter([self.__rays])
+
+    def get_mask(self, nolost=1):
+        if nolost == 0: return None
+        elif not nolost in (1, 2): raise ValueError("nolost flag value not valid")
+
+        if self.__chunked: return numpy.concatenate([_selection(chunk, nolost) for chunk in self.iterate_chunks()])
+
+        if not nolost in self.__masks: self.__masks[nolost] = _selection(self.__rays, nolost)
+
+        return self.__masks[nolost]
+
+    def get_number_of_rays(self, nolost=0):
+        if nolost == 0: return self.__size
+
+        if not nolost in self.__counts:
+            if self.__chunked: self.__counts[nolost] = sum([int(numpy.count_nonzero(_selection(chunk, nolost))) for chunk in self.iterate_chunks()])
+            else:              self.__counts[nolost] = int(numpy.count_nonzero(self.get_mask(nolost)))
+
+        return self.__counts[nolost]
+
+    def get_column(self, column, nolost=0):
+        # not memoised: only reductions are kept, never ray-sized arrays
+        if self.__chunked:
+            values = numpy.concatenate([_column(chunk, column)[_selection(chunk, nolost)] for chunk in self.iterate_chunks()])
+            ShadowProfiler.count_copy("column of chunks", values.nbytes)
+
+            return values
+        elif 1 <= column <= 18:
+            values = self.__rays[:, column - 1]
+            if nolost == 0: return values
+
+            values = values[self.get_mask(nolost)]
+            ShadowProfiler.count_copy("nolost selection", values.nbytes)
+
+            return values
+        else:
+            values = _column(self.__rays, column)
+            return values if nolost == 0 else values[self.get_mask(nolost)]
+
+    def get_column_range(self, column, nolost=0):
+        key = (column, nolost)
+
+        if not key in self.__ranges:
+            if self.__chunked:
+                minima, maxima = [], []
+                for values, _ in self.__iterate_weighted_column(column, nolost, 0):
+                    if values.size > 0:
+                        minima.append(values.min())
+                        maxima.append(values.max())
+
+                self.__ranges[key] = (numpy.min(minima), numpy.max(maxima))
+            else:
+                values = self.get_column(column, nolost)
+                self.__ranges[key] = (values.min(), values.max())
+
+        return self.__ranges[key]
+
+    def get_moments(self, column, nolost=1, ref=23):
+        # returns (sum of weights, weighted average, weighted standard deviation)
+        key = (column, nolost, ref)
+
+        if not key in self.__moments:
+            if self.__chunked:
+                total, first = 0.0, 0.0
+                for values, weights in self.__iterate_weighted_column(column, nolost, ref):
+                    total += weights.sum()
+                    first += (values * weights).sum()
+
+                if total == 0:
+                    self.__moments[key] = (total, numpy.nan, numpy.nan)
+                else:
+                    average  = first / total
+                    variance = sum([(weights * (values - average)**2).sum() for values, weights in self.__iterate_weighted_column(column, nolost, ref)]) / total
+
+                    self.__moments[key] = (total, average, numpy.sqrt(variance))
+            else:
+                values = self.get_column(column, nolost)
+
+                if values.size == 0:
+                    self.__moments[key] = (0.0, numpy.nan, numpy.nan)
+                else:
+                    weights = None if ref == 0 else self.get_column(ref, nolost)
+                    total   = values.size if weights is None else weights.sum()
+
+                    if total == 0:
+                        self.__moments[key] = (total, numpy.nan, numpy.nan)
+                    else:
+                        average  = numpy.average(values, weights=weights)
+                        variance = numpy.average((values - average)**2, weights=weights)
+
+                        self.__moments[key] = (total, average, numpy.sqrt(variance))
+
+        return self.__moments[key]
+
+    def get_intensity(self, nolost=0, column=23):
+        key = (column, nolost, "intensity")
+
+        if not key in self.__moments:
+            if self.__chunked: self.__moments[key] = sum([values.sum() for values, _ in self.__iterate_weighted_column(column, nolost, 0)])
+            else:              self.__moments[key] = self.get_column(column, nolost).sum()
+
+        return self.__moments[key]
+
+    def get_digest(self, sample_size=None):
+        # hash of the ray buffers (shape, dtype, cleaning and the rays), chunking independent.
+        # With sample_size, only that many rays (evenly spaced) are hashed
+        if not sample_size is None and sample_size >= self.__size: sample_size = None
+
+        if not sample_size in self.__digests:
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(("%d,%s,%s,%s" % (self.__size, self.get_dtype().str, self.__N_cleaned, sample_size)).encode())
+
+            if sample_size is None:
+                for chunk in self.iterate_chunks(): digest.update(numpy.ascontiguousarray(chunk).data)
+            else:
+                indexes = numpy.linspace(0, self.__size - 1, max(1, sample_size)).astype(numpy.int64)
+                start   = 0
+                for chunk in self.iterate_chunks():
+                    selection = indexes[(indexes >= start) & (indexes < start + chunk.shape[0])] - start
+                    digest.update(numpy.ascontiguousarray(chunk[selection]).data)
+                    start += chunk.shape[0]
+
+            self.__digests[sample_size] = digest.hexdigest()
+
+        return self.__digests[sample_size]
+
+    def histo1(self, col, xrange=None, nbins=50, nolost=0, ref=0):
+        key = (col, _as_key(xrange), nbins, nolost, ref)
+
+        if not key in self.__histo1:
+            self.__compute_histograms([("histo1", col, xrange, nbins, nolost, ref)])
+
+        return copy.deepcopy(self.__histo1[key]) # tickets are modified by the callers
+
+    def histo2(self, col_h, col_v, nbins=25, ref=23, nbins_h=None, nbins_v=None, nolost=0, xrange=None, yrange=None):
+        if nbins_h is None: nbins_h = nbins
+        if nbins_v is None: nbins_v = nbins
+
+        key = (col_h, col_v, nbins_h, nbins_v, _as_key(xrange), _as_key(yrange), nolost, ref)
+
+        if not key in self.__histo2:
+            self.__compute_histograms([("histo2", col_h, col_v, nbins_h, nbins_v, xrange, yrange, nolost, ref)])
+
+        return copy.deepcopy(self.__histo2[key])
+
+    def compute_histograms(self, requests):
+        # tickets of several histograms in one pass over the rays (e.g. the plot tabs of an element), memoised as the ones
+        # of histo1/histo2 and returned in the order of the requests:
+        #   ("histo1", col, xrange, nbins, nolost, ref)
+        #   ("histo2", col_h, col_v, nbins_h, nbins_v, xrange, yrange, nolost, ref)
+        # In each chunk, selections, columns, weights and bin indices are computed once for all the requests
+        keys = self.__compute_histograms(requests)
+
+        return [copy.deepcopy(self.__histo1[key] if request[0] == "histo1" else self.__histo2[key]) for request, key in zip(requests, keys)]
+
+    @classmethod
+    def get_fwhm(cls, histogram, bin_center):
+        # FWHM of a histogram (e.g. accumulated from tickets), as in the tickets
+        return _fwhm(histogram, bin_center)[0]
+
+    @classmethod
+    def get_precision_report(cls, beam, single_precision_beam, columns=[1, 3, 4, 6], nbins=100):
+        statistics        = ShadowBeamStatistics.get(beam)
+        single_statistics = ShadowBeamStatistics.get(single_precision_beam)
+        column_names      = beam.column_short_names()
+
+        text  = "Single precision (float32) ray storage: %d MB instead of %d MB\n" % (single_precision_beam.rays.nbytes / 2**20, beam.rays.nbytes / 2**20)
+        text += "%-10s %16s %16s %12s %16s %16s %12s\n" % ("column", "centroid f64", "centroid f32", "shift/sigma", "FWHM f64", "FWHM f32", "rel. diff.")
+
+        for column in columns:
+            if statistics.get_number_of_rays(nolost=1) == 0: break
+
+            _, centroid, sigma    = statistics.get_moments(column, nolost=1, ref=23)
+            _, single_centroid, _ = single_statistics.get_moments(column, nolost=1, ref=23)
+
+            xrange      = statistics.get_column_range(column, nolost=1)
+            fwhm        = statistics.histo1(column, xrange=xrange, nbins=nbins, nolost=1, ref=23)["fwhm"]
+            single_fwhm = single_statistics.histo1(column, xrange=xrange, nbins=nbins, nolost=1, ref=23)["fwhm"]
+
+            shift     = numpy.nan if sigma == 0 else numpy.abs(single_centroid - centroid) / sigma
+            fwhm_diff = numpy.nan if (fwhm is None or single_fwhm is None or fwhm == 0) else numpy.abs(single_fwhm - fwhm) / fwhm
+
+            text += "%-10s %16.9g %16.9g %12.3g %16.9g %16.9g %12.3g\n" % (column_names[column - 1], centroid, single_centroid, shift,
+                                                                          numpy.nan if fwhm is None else fwhm,
+                                                                          numpy.nan if single_fwhm is None else single_fwhm,
+                                                                          fwhm_diff)
+
+        return text
+
+
+    #########################################################################################
+    #
+    # batched S4Beam.histo1/histo2: same tickets, histograms accumulated one chunk at a time
+    #
+    #########################################################################################
+
+    def __iterate_weighted_column(self, column, nolost, ref):
+        for chunk in self.iterate_chunks():
+            selection = _selection(chunk, nolost)
+            values    = _column(chunk, column)[selection]
+
+            yield values, (numpy.ones(values.size) if ref == 0 else _column(chunk, ref)[selection])
+
+    def __iterate_selections(self, nolosts):
+        # chunks with the selections of the nolost flags (the masks of a single ray buffer are memoised)
+        for chunk in self.iterate_chunks():
+            if self.__chunked: yield chunk, {nolost : _selection(chunk, nolost) for nolost in nolosts}
+            else:              yield chunk, {nolost : (slice(None) if nolost == 0 else self.get_mask(nolost)) for nolost in nolosts}
+
+    def __get_ticket_number_of_rays(self, nolost=0):
+        # as S4Beam.get_number_of_rays (good rays have flag >= 0)
+        if nolost == 0: return self.__size if self.__N_cleaned is None else self.__N_cleaned
+
+        key = ("ticket", nolost)
+        if not key in self.__counts:
+            if nolost == 1: self.__counts[key] = sum([int(numpy.count_nonzero(chunk[:, 9] >= 0)) for chunk in self.iterate_chunks()])
+            else:           self.__counts[key] = sum([int(numpy.count_nonzero(chunk[:, 9] < 0)) for chunk in self.iterate_chunks()])
+
+        return self.__counts[key]
+
+    def __compute_ranges(self, columns, nolosts):
+        # missing numbers of rays and ranges of the (column, nolost) in columns, in one pass
+        counts  = [nolost for nolost in nolosts if nolost != 0 and not nolost in self.__counts] if self.__chunked else []
+        tickets = [("ticket", nolost) for nolost in (1, 2) if not ("ticket", nolost) in self.__counts]
+        columns = [key for key in dict.fromkeys(columns) if not key in self.__ranges]
+
+        if len(counts) + len(tickets) + len(columns) == 0: return
+
+        number_of_rays = {key : 0 for key in counts + tickets}
+        minima, maxima = {key : [] for key in columns}, {key : [] for key in columns}
+
+        for chunk, selections in self.__iterate_selections(set(nolosts) | set([nolost for _, nolost in columns])):
+            for nolost in counts: number_of_rays[nolost] += int(numpy.count_nonzero(selections[nolost]))
+            for key in tickets:   number_of_rays[key]    += int(numpy.count_nonzero(chunk[:, 9] >= 0 if key[1] == 1 else chunk[:, 9] < 0))
+
+            for column, nolost in columns:
+                values = _column(chunk, column)[selections[nolost]]
+                if values.size > 0:
+                    minima[(column, nolost)].append(values.min())
+                    maxima[(column, nolost)].append(values.max())
+
+        self.__counts.update(number_of_rays)
+        for key in columns:
+            if len(minima[key]) > 0: self.__ranges[key] = (numpy.min(minima[key]), numpy.max(maxima[key]))
+
+    def __compute_histograms(self, requests):
+        # memoises the tickets of the requests (see compute_histograms), returns their keys
+        keys, histo1_requests, histo2_requests = [], {}, {}
+        for request in requests:
+            if request[0] == "histo1":
+                _, col, xrange, nbins, nolost, ref = request
+                key = (col, _as_key(xrange), nbins, nolost, ref)
+
+                if not key in self.__histo1: histo1_requests[key] = [col, xrange, nbins, nolost, _ref(ref)]
+            elif request[0] == "histo2":
+                _, col_h, col_v, nbins_h, nbins_v, xrange, yrange, nolost, ref = request
+                key = (col_h, col_v, nbins_h, nbins_v, _as_key(xrange), _as_key(yrange), nolost, ref)
+
+                if not key in self.__histo2: histo2_requests[key] = [col_h, col_v, nbins_h, nbins_v, xrange, yrange, nolost, _ref(ref)]
+            else:
+                raise ValueError("Histogram request not valid: " + str(request[0]))
+
+            keys.append(key)
+
+        if len(histo1_requests) + len(histo2_requests) == 0: return keys
+
+        nolosts = set([request[3] for request in histo1_requests.values()] + [request[6] for request in histo2_requests.values()])
+        for nolost in nolosts: _selection(numpy.zeros((0, 18)), nolost) # nolost flag check
+
+        # ranges of the rays, if not given (as S4Beam: min-max for histo1, good range for histo2)
+        self.__compute_ranges([(request[0], request[3]) for request in histo1_requests.values() if request[1] is None] +
+                              [(request[0], request[6]) for request in histo2_requests.values() if request[4] is None] +
+                              [(request[1], request[6]) for request in histo2_requests.values() if request[5] is None], nolosts)
+
+        for request in histo1_requests.values():
+            if request[1] is None and (request[0], request[3]) in self.__ranges: request[1] = list(self.__ranges[(request[0], request[3])])
+        for request in histo2_requests.values():
+            if request[4] is None and (request[0], request[6]) in self.__ranges: request[4] = _good_range(*self.__ranges[(request[0], request[6])])
+            if request[5] is None and (request[1], request[6]) in self.__ranges: request[5] = _good_range(*self.__ranges[(request[1], request[6])])
+
+        # binnings: (column, nolost, min, max, nbins), shared by the requests
+        binnings = {}
+        for key, (col, xrange, nbins, nolost, ref) in histo1_requests.items():
+            if self.get_number_of_rays(nolost) > 0: binnings[key] = [(col, nolost, xrange[0], xrange[1], nbins)]
+        for key, (col_h, col_v, nbins_h, nbins_v, xrange, yrange, nolost, ref) in histo2_requests.items():
+            if self.get_number_of_rays(nolost) > 0: binnings[key] = [(col_h, nolost, xrange[0], xrange[1], nbins_h), (col_v, nolost, yrange[0], yrange[1], nbins_v)]
+
+        edges   = {binning : _bin_edges(binning[2:4], binning[4]) for binning in sum(binnings.values(), [])}
+        weights = set([(request[4], request[3]) for key, request in histo1_requests.items() if key in binnings and request[4] != 0] +
+                      [(request[7], request[6]) for key, request in histo2_requests.items() if key in binnings and request[7] != 0])
+        columns = set([binning[:2] for binning in edges.keys()]) | weights
+
+        histograms, intensities = {}, {}
+        for chunk, selections in self.__iterate_selections(nolosts):
+            values  = {column : _column(chunk, column[0])[selections[column[1]]] for column in columns}
+            indices = {binning : _bin_indices(values[binning[:2]], bin_edges) for binning, bin_edges in edges.items()}
+
+            for key, (col, xrange, nbins, nolost, ref) in histo1_requests.items():
+                if not key in binnings: continue
+
+                index  = indices[binnings[key][0]]
+                good   = index >= 0
+                weight = numpy.ones(numpy.count_nonzero(good)) if ref == 0 else values[(ref, nolost)][good]
+
+                h, h2 = histograms.get(key, (0.0, 0.0))
+                histograms[key] = (h  + numpy.bincount(index[good], weights=weight, minlength=nbins),
+                                   h2 + numpy.bincount(index[good], weights=weight * weight, minlength=nbins))
+
+            for key, (col_h, col_v, nbins_h, nbins_v, xrange, yrange, nolost, ref) in histo2_requests.items():
+                if not key in binnings: continue
+
+                index_h = indices[binnings[key][0]]
+                index_v = indices[binnings[key][1]]
+                good    = (index_h >= 0) & (index_v >= 0)
+
+                histograms[key] = histograms.get(key, 0.0) + numpy.bincount(index_h[good] * nbins_v + index_v[good],
+                                                                            weights=(None if ref == 0 else values[(ref, nolost)][good]),
+                                                                            minlength=nbins_h * nbins_v).reshape(nbins_h, nbins_v)
+
+            for column in weights: intensities[column] = intensities.get(column, 0.0) + values[column].sum()
+
+        # as get_intensity
+        for (ref, nolost), intensity in intensities.items():
+            if not (ref, nolost, "intensity") in self.__moments: self.__moments[(ref, nolost, "intensity")] = intensity
+
+        for key, request in histo1_requests.items(): self.__histo1[key] = self.__get_histo1_ticket(*request, histograms.get(key, None))
+        for key, request in histo2_requests.items(): self.__histo2[key] = self.__get_histo2_ticket(*request, histograms.get(key, None))
+
+        return keys
+
+    def __get_histo1_ticket(self, col, xrange, nbins, nolost, ref, histograms):
+        ticket = {'error': 1, 'col': col, 'write': None, 'nolost': nolost, 'nbins': nbins, 'xrange': xrange, 'factor': 1.0, 'ref': ref}
+
+        if histograms is None: # no rays
+            ticket['error'] = 0
+            ticket['histogram'] = ticket['bins'] = ticket['bin_center'] = ticket['histogram_path'] = ticket['bin_path'] = numpy.empty(0)
+            ticket['histogram_sigma'] = 0.0
+            ticket['bin_left'] = ticket['bin_right'] = ticket['intensity'] = numpy.nan
+            ticket['nrays'] = self.__get_ticket_number_of_rays(0)
+            ticket['good_rays'] = 0
+            ticket['fwhm'] = None
+            ticket['fwhm_subpixel'] = None
+            ticket['fwhm_coordinates'] = ticket['fwhm_subpixel_coordinates'] = (numpy.nan, numpy.nan)
+        else:
+            h, h2      = histograms
+            bins       = _bin_edges(xrange, nbins)
+            bin_size   = bins[1] - bins[0]
+            bin_center = bins[:-1] + bin_size * 0.5
+
+            ticket['error'] = 0
+            ticket['histogram'] = h
+            ticket['bins'] = bins
+            ticket['histogram_sigma'] = numpy.sqrt(h2 - h * h / float(self.get_number_of_rays(nolost)))
+            ticket['bin_center'] = bin_center
+            ticket['bin_left'] = bins[:-1]
+            ticket['bin_right'] = bins[:-1] + bin_size
+            ticket['xrange'] = xrange
+            ticket['intensity'] = self.get_intensity(nolost)
+            ticket['fwhm'] = None
+            ticket['nrays'] = self.__get_ticket_number_of_rays(0)
+            ticket['good_rays'] = self.__get_ticket_number_of_rays(1)
+            ticket['lost_rays'] = self.__get_ticket_number_of_rays(2)
+            ticket['histogram_path'] = numpy.repeat(h, 2)
+            ticket['bin_path'] = numpy.column_stack((ticket['bin_left'], ticket['bin_right'])).ravel()
+
+            fwhm, fwhm_coordinates = _fwhm(h, bin_center)
+            if not fwhm is None:
+                ticket['fwhm'] = fwhm
+                ticket['fwhm_coordinates'] = fwhm_coordinates
+
+            # fwhm with subpixel resolution, as in S4Beam.histo1
+            ixl_e, ixr_e = numpy.where(h >= max(h) * 0.5)[0][[0, -1]]
+            try:
+                if fwhm is None: raise ValueError()
+                xl = ixl_e - (h[ixl_e] - max(h) * 0.5) / (h[ixl_e] - h[ixl_e - 1])
+                xr = ixr_e - (h[ixr_e] - max(h) * 0.5) / (h[ixr_e + 1] - h[ixr_e])
+                ticket['fwhm_subpixel'] = bin_size * numpy.abs(xr - xl)
+                ticket['fwhm_subpixel_coordinates'] = (numpy.interp(xl, range(bin_center.size), bin_center),
+                                                       numpy.interp(xr, range(bin_center.size), bin_center))
+            except:
+                ticket['fwhm_subpixel'] = None
+
+        return ticket
+
+    def __get_histo2_ticket(self, col_h, col_v, nbins_h, nbins_v, xrange, yrange, nolost, ref, histogram):
+        ticket = {'error': 1, 'col_h': col_h, 'col_v': col_v, 'nolost': nolost, 'nbins_h': nbins_h, 'nbins_v': nbins_v, 'ref': ref}
+
+        if histogram is None: # no rays
+            ticket['xrange'] = xrange
+            ticket['yrange'] = yrange
+            ticket['bin_h_edges'] = ticket['bin_v_edges'] = ticket['bin_h_left'] = \
+                ticket['bin_v_left'] = ticket['bin_h_right'] = ticket['bin_v_right'] = \
+                ticket['histogram'] = ticket['histogram_h'] = ticket['histogram_v'] = numpy.empty(0)
+            ticket['bin_h_center'] = ticket['bin_v_center'] = ticket['intensity'] = numpy.nan
+            ticket['nrays'] = self.__get_ticket_number_of_rays(0)
+            ticket['good_rays'] = 0
+            ticket['lost_rays'] = 0
+            ticket['fwhm_h'] = ticket['fwhm_v'] = None
+            ticket['fwhm_coordinates_h'] = ticket['fwhm_coordinates_v'] = (numpy.nan, numpy.nan)
+        else:
+            xx = _bin_edges(xrange, nbins_h)
+            yy = _bin_edges(yrange, nbins_v)
+
+            ticket['xrange'] = xrange
+            ticket['yrange'] = yrange
+            ticket['bin_h_edges'] = xx
+            ticket['bin_v_edges'] = yy
+            ticket['bin_h_left'] = numpy.delete(xx, -1)
+            ticket['bin_v_left'] = numpy.delete(yy, -1)
+            ticket['bin_h_right'] = numpy.delete(xx, 0)
+            ticket['bin_v_right'] = numpy.delete(yy, 0)
+            ticket['bin_h_center'] = 0.5 * (ticket['bin_h_left'] + ticket['bin_h_right'])
+            ticket['bin_v_center'] = 0.5 * (ticket['bin_v_left'] + ticket['bin_v_right'])
+            ticket['histogram'] = histogram
+            ticket['histogram_h'] = histogram.sum(axis=1)
+            ticket['histogram_v'] = histogram.sum(axis=0)
+            ticket['intensity'] = self.get_intensity(nolost)
+            ticket['nrays'] = self.__get_ticket_number_of_rays(0)
+            ticket['good_rays'] = self.__get_ticket_number_of_rays(1)
+            ticket['lost_rays'] = self.__get_ticket_number_of_rays(2)
+
+            ticket['fwhm_h'], fwhm_coordinates_h = _fwhm(ticket['histogram_h'], ticket['bin_h_center'])
+            if not fwhm_coordinates_h is None: ticket['fwhm_coordinates_h'] = fwhm_coordinates_h
+            ticket['fwhm_v'], fwhm_coordinates_v = _fwhm(ticket['histogram_v'], ticket['bin_v_center'])
+            if not fwhm_coordinates_v is None: ticket['fwhm_coordinates_v'] = fwhm_coordinates_v
+
+        return ticket
+
+def _ray_buffers(beam):
+    return beam.get_ray_buffers() if hasattr(beam, "get_ray_buffers") else [beam.rays]
+
+def _chunk_size(beam):
+    if hasattr(beam, "get_chunk_size"):   return beam.get_chunk_size() # memory-mapped
+    elif hasattr(beam, "get_block_size"): return beam.get_block_size() # blocks
+    else:                                 return None
+
+def _iterate_buffer_chunks(buffers, chunk_size):
+    for buffer in buffers:
+        if chunk_size is None or buffer.shape[0] <= chunk_size: yield buffer
+        else:
+            for start in range(0, buffer.shape[0], chunk_size): yield buffer[start : start + chunk_size]
+
+def _as_key(range):
+    return None if range is None else tuple(float(value) for value in range)
+
+def _ref(ref):
+    if ref is None or ref in ("No", "NO", "no"): return 0
+    elif ref in ("Yes", "YES", "yes"): return 23
+    else: return ref
+
+def _selection(rays, nolost):
+    if nolost == 0:   return slice(None)
+    elif nolost == 1: return rays[:, 9] > 0
+    elif nolost == 2: return rays[:, 9] < 0
+    else: raise ValueError("nolost flag value not valid")
+
+def _column(rays, column):
+    if 1 <= column <= 18: return rays[:, column - 1]
+    else:
+        chunk_beam = S4Beam(N=0)
+        chunk_beam.rays = rays
+
+        return chunk_beam.get_column(column, nolost=0)
+
+def _bin_edges(range, nbins): # as numpy.histogram/histogram2d
+    rmin, rmax = range
+    if rmin == rmax: rmin, rmax = rmin - 0.5, rmax + 0.5
+
+    return numpy.linspace(rmin, rmax, nbins + 1)
+
+def _bin_indices(values, edges): # as numpy.histogram/histogram2d: the last edge is in the last bin, -1 out of the edges
+    indices = numpy.searchsorted(edges, values, side="right") - 1
+    indices[values == edges[-1]] = edges.size - 2
+    indices[indices == edges.size - 1] = -1
+
+    return indices
+
+def _good_range(rmin, rmax): # as S4Beam.get_good_range
+    rmin = rmin * (0.95 if rmin > 0.0 else 1.05)
+    rmax = rmax * (0.95 if rmax < 0.0 else 1.05)
+    if rmin == rmax:
+        rmin = rmin * 0.95
+        rmax = rmax * 1.05
+    if rmin == 0.0 and rmax == 0: return [-1.0, 1.0]
+
+    return [rmin, rmax]
+
+def _fwhm(histogram, bin_center):
+    tt = numpy.where(histogram >= max(histogram) * 0.5)
+    if histogram[tt].size > 1: return (bin_center[1] - bin_center[0]) * (tt[0][-1] - tt[0][0]), (bin_center[tt[0][0]], bin_center[tt[0][-1]])
+    else:                      return None, None
@@ -45,14 +45,18 @@ except ImportError:
 
 from shadow4.beam.s4_beam import S4Beam
 
+from orangecontrib.shadow4.util.shadow4_statistics import ShadowBeamStatistics
+from orangecontrib.shadow4.util.shadow4_profiling import ShadowProfiler
+from orangecontrib.shadow4.util.shadow4_objects import ShadowData
+
 import scipy.constants as codata
 
 class ShadowCongruence():
     @classmethod
     def check_empty_beam(cls, input_beam):
         if input_beam is None: return False
-        elif not hasattr(input_beam, "rays"): return False
-        elif len(input_beam.rays) == 0: return False
+        elif not hasattr(input_beam, "get_number_of_rays"): return False
+        elif ShadowBeamStatistics.get(input_beam).get_number_of_rays(nolost=0) == 0: return False
         else: return True
 
     @classmethod
@@ -62,7 +66,7 @@ class ShadowCongruence():
 
     @classmethod
     def check_good_beam(cls, input_beam):
-        return len(input_beam.rays[numpy.where(input_beam.rays[:, 9] == 1)]) > 0
+        return ShadowBeamStatistics.get(input_beam).get_number_of_rays(nolost=1) > 0
 
     @classmethod
     def checkBraggFile(cls, file_name):
@@ -530,8 +534,10 @@ try:
                 self.setLayout(layout)
 
             def plot_histo(self, beam, col, nolost, xrange, ref, title, xtitle, ytitle, nbins = 100, xum="", ticket_to_add=None, flux=None):
-                ticket = beam.histo1(col, nbins=nbins, xrange=xrange, nolost=nolost, ref=ref)
-                if ref in [24, 25]: ticket['intensity'] = beam.get_column(ref, nolost=nolost).sum()
+                statistics = ShadowBeamStatistics.get(beam)
+
+                with ShadowProfiler.stage("histogramming"): ticket = statistics.histo1(col, nbins=nbins, xrange=xrange, nolost=nolost, ref=ref)
+                if ref in [24, 25]: ticket['intensity'] = statistics.get_intensity(nolost=nolost, column=ref)
 
                 # TODO: check congruence between tickets
                 if not ticket_to_add is None:
@@ -640,8 +646,10 @@ try:
                 if nbins_h is None: nbins_h = nbins
                 if nbins_v is None: nbins_v = nbins
 
-                ticket = beam.histo2(var_x, var_y, nbins=nbins, nbins_h=nbins_h, nbins_v=nbins_v, xrange=xrange, yrange=yrange, nolost=nolost, ref=ref)
-                if ref in [24, 25]: ticket['intensity'] = beam.get_column(ref, nolost=nolost).sum()
+                statistics = ShadowBeamStatistics.get(beam)
+
+                with ShadowProfiler.stage("histogramming"): ticket = statistics.histo2(var_x, var_y, nbins=nbins, nbins_h=nbins_h, nbins_v=nbins_v, xrange=xrange, yrange=yrange, nolost=nolost, ref=ref)
+                if ref in [24, 25]: ticket['intensity'] = statistics.get_intensity(nolost=nolost, column=ref)
 
                 # TODO: check congruence between tickets
                 if not ticket_to_add is None:
@@ -810,8 +818,10 @@ try:
 
             matplotlib.rcParams['axes.formatter.useoffset']='False'
 
-            col1 = beam.get_column(var_x, nolost=nolost)
-            col2 = beam.get_column(var_y, nolost=nolost)
+            statistics = ShadowBeamStatistics.get(beam)
+
+            col1 = statistics.get_column(var_x, nolost=nolost)
+            col2 = statistics.get_column(var_y, nolost=nolost)
 
             factor1 = 1.0 if is_footprint else ShadowPlot.get_factor(var_x)
             factor2 = 1.0 if is_footprint else ShadowPlot.get_factor(var_y)
@@ -833,7 +843,7 @@ try:
 
             factor = ShadowPlot.get_factor(col)
 
-            ticket = beam.histo1(col, nbins=100, xrange=None, nolost=nolost, ref=ref)
+            with ShadowProfiler.stage("histogramming"): ticket = ShadowBeamStatistics.get(beam).histo1(col, nbins=100, xrange=None, nolost=nolost, ref=ref)
 
             if ref != 0 and not ytitle is None:  ytitle = ytitle + ' weighted by ' + ShadowPlot.get_shadow_label(ref)
 
@@ -1464,6 +1474,10 @@ class TriggerToolsDecorator(object):
     def set_trigger_parameters_for_sources(self, trigger):
 
         if trigger and trigger.new_object == True:
+            if trigger.has_additional_parameter("variable_values"): # batched: all the values in one run
+                self.run_shadow4_for_values(*self._get_trigger_variable_values(trigger))
+                return
+
             if trigger.has_additional_parameter("variable_name"):
                 variable_name = trigger.get_additional_parameter("variable_name").strip()
                 variable_display_name = trigger.get_additional_parameter(
@@ -1475,20 +1489,17 @@ class TriggerToolsDecorator(object):
                 print(">>>>> name(s): ", variable_name, variable_display_name)
                 print(">>>>> values(s): ", variable_value, type(variable_value), variable_um)
 
-                try:
-                    if isinstance(variable_value, str):
-                        command = "self." + variable_name + " = '" + str(variable_value) + "'"
-                    else:
-                        command = "self."+variable_name+" = "+str(variable_value)
-                    exec(command)
-                except:
-                    raise Exception("Error executing: %s" % command)
+                self._set_trigger_variable(variable_name, variable_value)
 
         self.run_shadow4()
 
     def set_trigger_parameters_for_optics(self, trigger): # TODO: complete
 
         if trigger and trigger.new_object == True:
+            if trigger.has_additional_parameter("variable_values"): # batched: all the values in one run
+                if self.input_data is not None: self.run_shadow4_for_values(*self._get_trigger_variable_values(trigger))
+                return
+
             if trigger.has_additional_parameter("variable_name"):
                 variable_name = trigger.get_additional_parameter("variable_name").strip()
                 variable_display_name = trigger.get_additional_parameter(
@@ -1496,18 +1507,76 @@ class TriggerToolsDecorator(object):
                 variable_value = trigger.get_additional_parameter("variable_value")
                 variable_um = trigger.get_additional_parameter("variable_um")
 
-                try:
-                    if isinstance(variable_value, str):
-                        command = "self." + variable_name + " = '" + str(variable_value) + "'"
-                    else:
-                        command = "self."+variable_name+" = "+str(variable_value)
-                    exec(command)
-                except:
-                    raise Exception("Error executing: %s" % command)
+                self._set_trigger_variable(variable_name, variable_value)
 
         if self.input_data is not None:
             self.run_shadow4()
 
+    def _set_trigger_variable(self, variable_name, variable_value):
+        try:
+            if isinstance(variable_value, str):
+                command = "self." + variable_name + " = '" + str(variable_value) + "'"
+            else:
+                command = "self."+variable_name+" = "+str(variable_value)
+            exec(command)
+        except:
+            raise Exception("Error executing: %s" % command)
+
+    def _get_trigger_variable(self, variable_name):
+        # value to restore after a batched trigger (see run_shadow4_for_values)
+        try:
+            return eval("self." + variable_name)
+        except:
+            raise Exception("Error reading: self.%s" % variable_name)
+
+    def _restore_trigger_variable(self, variable_name, variable_value):
+        # the very object read by _get_trigger_variable, not its text
+        exec("self." + variable_name + " = variable_value", {"self" : self, "variable_value" : variable_value})
+
+    def _get_trigger_variable_values(self, trigger):
+        # batched trigger: "variable_values" holds all the values of the variable, in place of "variable_value"
+        variable_values = trigger.get_additional_parameter("variable_values")
+        if len(variable_values) == 0: raise ValueError("Batched trigger without values")
+
+        return trigger.get_additional_parameter("variable_name").strip(), \
+               list(variable_values), \
+               trigger.get_additional_parameter("variable_display_name").strip() if trigger.has_additional_parameter("variable_display_name") else "", \
+               trigger.get_additional_parameter("variable_um") if trigger.has_additional_parameter("variable_um") else ""
+
+    def run_shadow4_for_values(self, variable_name, variable_values, variable_display_name="", variable_um=""):
+        # widgets that cannot evaluate all the values in one run: one run per value, the Shadow Data of the runs being
+        # sent as one stack (see ShadowData.initialize_as_stack), as the widgets evaluating the values in one run do.
+        # The runs must send their Shadow Data before returning (not from a worker thread). The variable is restored
+        if not hasattr(self, "run_shadow4"): raise ValueError(type(self).__name__ + " does not support batched triggers")
+
+        outputs  = []
+        send     = self.send
+        original = self._get_trigger_variable(variable_name)
+
+        def collect(signal_name, value, *args, **kwargs): # the triggers of the runs are replaced by the one of the stack
+            if signal_name == "Shadow Data": outputs.append(value)
+            elif signal_name != "Trigger":   send(signal_name, value, *args, **kwargs)
+
+        self.send = collect
+        try:
+            for variable_value in variable_values:
+                self._set_trigger_variable(variable_name, variable_value)
+                self.run_shadow4()
+        finally:
+            del self.send
+            self._restore_trigger_variable(variable_name, original)
+
+        if len(outputs) != len(variable_values) or any([output is None for output in outputs]):
+            raise ValueError("Batched trigger: %d Shadow Data for %d values of %s (failed or asynchronous runs)" % (len(outputs), len(variable_values), variable_name))
+
+        output_data = ShadowData.initialize_as_stack([output.beam for output in outputs], variable_name, variable_values, variable_display_name, variable_um,
+                                                     footprints=[output.footprint for output in outputs],
+                                                     beamline=outputs[-1].beamline,
+                                                     generated_rays=[output.get_number_of_generated_rays() for output in outputs])
+
+        self.send("Shadow Data", output_data)
+        self.send("Trigger", TriggerIn(new_object=True))
+
 class Properties(object):
     def __init__(self, props=None):
         self._props = {}
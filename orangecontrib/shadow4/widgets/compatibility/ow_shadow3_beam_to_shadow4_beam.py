@@ -15,7 +15,7 @@ except:
 from orangecontrib.shadow4.util.shadow4_objects import ShadowData
 from shadow4.beam.s4_beam import S4Beam
 
-from shadow4.beamline.s4_beamline import S4Beamline
+from orangecontrib.shadow4.util.shadow4_beamline import ShadowBeamline
 
 class OW_beam_converter_3_to_4(AutomaticWidget):
     name = "shadow3->4 beam converter"
@@ -78,9 +78,9 @@ class OW_beam_converter_3_to_4(AutomaticWidget):
 
         try:
             beam3 = self.shadow_beam._beam
-            beam4 = ShadowData(beam=S4Beam(array=beam3.rays), beamline=S4Beamline())
-            beam4.beam.rays[:, 0:3] *= self.workspace_units_to_m
-            beam4.beam.rays[:, 12]  *= self.workspace_units_to_m
+            beam4 = ShadowData(beam=S4Beam(array=beam3.rays), beamline=ShadowBeamline())
+            beam4.mutable_beam().rays[:, 0:3] *= self.workspace_units_to_m
+            beam4.mutable_beam().rays[:, 12]  *= self.workspace_units_to_m
 
             self.send("Shadow Data", beam4)
         except Exception as exception:
@@ -0,0 +1,162 @@
+import os, sys, tempfile, threading, weakref
+
+from PyQt5.QtCore import QObject, QTimer, QUrl
+from PyQt5.QtGui import QTextCursor, QDesktopServices
+
+class LogSink(QObject):
+    # stdout of the runs of a widget: the text is buffered and appended to the output pane at most FLUSHES_PER_SECOND
+    # times per second, the pane keeping the last MAXIMUM_LINES lines (the buffer the last MAXIMUM_BUFFERED_CHARACTERS);
+    # the full log of the last run is written to a file (open_log_file).
+    # Capture is per thread: text printed by the other threads (other widgets, other workers) is not captured, and
+    # the stdout of a thread is restored as soon as its capture stops.
+
+    FLUSHES_PER_SECOND          = 4
+    MAXIMUM_LINES               = 5000
+    MAXIMUM_BUFFERED_CHARACTERS = 1000000
+
+    def __init__(self, text_area, parent=None):
+        super().__init__(parent)
+
+        self.__text_area = text_area
+        self.__text_area.document().setMaximumBlockCount(LogSink.MAXIMUM_LINES)
+
+        self.__lock         = threading.Lock()
+        self.__pending      = []
+        self.__pending_size = 0
+
+        file_descriptor, self.__log_file_name = tempfile.mkstemp(prefix="shadow4_log_", suffix=".txt")
+        self.__log_file = os.fdopen(file_descriptor, "w")
+
+        weakref.finalize(self, _remove_log_file, self.__log_file, self.__log_file_name)
+
+        self.__timer = QTimer(self)
+        self.__timer.setInterval(1000 // LogSink.FLUSHES_PER_SECOND)
+        self.__timer.timeout.connect(self.__flush_to_text_area)
+
+    def clear(self):
+        # new run: empty pane and log file
+        with self.__lock:
+            self.__pending      = []
+            self.__pending_size = 0
+
+            self.__log_file.seek(0)
+            self.__log_file.truncate()
+
+        self.__text_area.clear()
+
+    def start_capture(self):
+        # stdout of the calling thread is captured, until stop_capture() from the same thread
+        _get_dispatcher().attach(self)
+
+    def stop_capture(self, thread=None):
+        _get_dispatcher().detach(self, thread)
+
+    def capture_until_idle(self):
+        # GUI thread: captured until the control returns to the event loop (i.e. the end of the current slot)
+        self.start_capture()
+        self.__timer.start()
+
+        thread = threading.get_ident()
+        QTimer.singleShot(0, lambda: self.stop_capture(thread))
+
+    def write(self, text):
+        with self.__lock:
+            self.__log_file.write(text)
+
+            self.__pending.append(text)
+            self.__pending_size += len(text)
+
+            while self.__pending_size > LogSink.MAXIMUM_BUFFERED_CHARACTERS and len(self.__pending) > 1:
+                self.__pending_size -= len(self.__pending.pop(0))
+
+    def flush(self):
+        with self.__lock: self.__log_file.flush()
+
+    def get_log_file_name(self):
+        return self.__log_file_name
+
+    def open_log_file(self):
+        self.flush()
+        QDesktopServices.openUrl(QUrl.fromLocalFile(self.__log_file_name))
+
+    def __flush_to_text_area(self):
+        with self.__lock:
+            text, self.__pending, self.__pending_size = "".join(self.__pending), [], 0
+
+        if len(text) > 0:
+            cursor = self.__text_area.textCursor()
+            cursor.movePosition(QTextCursor.End)
+            cursor.insertText(text)
+            self.__text_area.setTextCursor(cursor)
+            self.__text_area.ensureCursorVisible()
+        elif _dispatcher is None or not _dispatcher.is_capturing(self):
+            self.__timer.stop()
+
+class _StdoutDispatcher:
+    # sys.stdout while captures are active: the text of each thread goes to its last attached sink, or to the original
+    # stdout. The original stdout is put back when the last capture stops; a stream set by other code during the
+    # captures is not adopted (it would replace the original one for good).
+
+    def __init__(self):
+        self.__stream = None
+        self.__sinks  = {} # thread -> [sinks]
+        self.__lock   = threading.RLock()
+
+    def attach(self, sink):
+        with self.__lock:
+            if not sys.stdout is self:
+                if not self.is_active(): self.__stream = sys.stdout # first capture: the current stdout is the original
+                sys.stdout = self
+
+            self.__sinks.setdefault(threading.get_ident(), []).append(sink)
+
+    def detach(self, sink, thread=None):
+        with self.__lock:
+            thread = threading.get_ident() if thread is None else thread
+            sinks  = self.__sinks.get(thread, [])
+
+            for index in reversed(range(len(sinks))):
+                if sinks[index] is sink:
+                    del sinks[index]
+                    break
+
+            if len(sinks) == 0: self.__sinks.pop(thread, None)
+
+            if not self.is_active() and sys.stdout is self: sys.stdout = self.__stream # last capture: original stdout back
+
+    def is_active(self):
+        return len(self.__sinks) > 0
+
+    def is_capturing(self, sink):
+        return any([sink in sinks for sinks in list(self.__sinks.values())])
+
+    def write(self, text):
+        sinks = self.__sinks.get(threading.get_ident(), None)
+
+        if sinks: sinks[-1].write(text)
+        elif not self.__stream is None: self.__stream.write(text)
+
+    def flush(self):
+        sinks = self.__sinks.get(threading.get_ident(), None)
+
+        if sinks: sinks[-1].flush()
+        elif not self.__stream is None: self.__stream.flush()
+
+    def __getattr__(self, name): # encoding, isatty, ...
+        return getattr(self.__stream, name)
+
+_dispatcher = None
+
+def _get_dispatcher():
+    global _dispatcher
+
+    if _dispatcher is None: _dispatcher = _StdoutDispatcher()
+
+    return _dispatcher
+
+def _remove_log_file(log_file, log_file_name):
+    try:
+        log_file.close()
+        os.remove(log_file_name)
+    except:
+        pass
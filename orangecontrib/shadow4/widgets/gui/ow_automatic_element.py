@@ -10,6 +10,8 @@ from PyQt5.QtCore import QRect
 
 from oasys.widgets.gui import ConfirmDialog, MessageDialog
 
+from orangecontrib.shadow4.widgets.gui.worker import CalculationWorker, CalculationCancelled
+
 class AutomaticElement(OWWidget):
     want_main_area = 1
     is_automatic_run = Setting(True)
@@ -19,6 +21,8 @@ class AutomaticElement(OWWidget):
     CONTROL_AREA_WIDTH = 405
     TABS_AREA_HEIGHT   = 560
 
+    background_worker = None
+
     def __init__(self, show_automatic_box=True):
         super().__init__()
 
@@ -44,6 +48,38 @@ class AutomaticElement(OWWidget):
         MessageDialog.message(self, str(exception), "Exception occured in OASYS", "critical")
         if self.IS_DEVELOP: raise exception
 
+    def _run_in_background(self, calculation, callback):
+        # long tool calculations (e.g. convergence runs): calculation(monitor) in a worker thread, callback(result) in the
+        # GUI thread. A new run cancels the running one, whose result is dropped (see GenericElement._run_calculation)
+        if not self.background_worker is None: self.background_worker.cancel()
+
+        worker = CalculationWorker(calculation, parent=self, log_sink=getattr(self, "log_sink", None))
+        worker.progress.connect(lambda fraction: self.progressBarSet(100 * fraction))
+        worker.succeeded.connect(lambda result: self.__on_background_finished(worker, callback, result))
+        worker.failed.connect(lambda exception: self.__on_background_finished(worker, None, exception))
+
+        self.background_worker = worker
+        self.progressBarInit()
+        worker.start()
+
+    def __on_background_finished(self, worker, callback, result):
+        worker.wait()
+        if not worker is self.background_worker: return # replaced by a new run
+
+        self.background_worker = None
+        self.progressBarFinished()
+
+        if hasattr(self, "log_sink"): self.log_sink.capture_until_idle()
+
+        try:
+            if callback is None: # failed
+                if isinstance(result, CalculationCancelled): self.setStatusMessage("Calculation cancelled")
+                else:                                        raise result
+            else:
+                callback(result)
+        except Exception as exception:
+            self.prompt_exception(exception)
+
 
 if __name__ == "__main__":
     a = QApplication(sys.argv)
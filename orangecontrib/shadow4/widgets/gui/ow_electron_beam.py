@@ -10,14 +10,14 @@ from oasys.widgets import gui as oasysgui
 from oasys.widgets import congruence
 from oasys.widgets.gui import ConfirmDialog
 
-from orangecontrib.shadow4.widgets.gui.ow_generic_element import GenericElement
+from orangecontrib.shadow4.widgets.gui.ow_source import OWSource
 
 from shadow4.sources.s4_electron_beam import S4ElectronBeam
 # from syned.storage_ring.light_source import ElectronBeam
 # from syned.beamline.beamline import Beamline
 # from syned.util.json_tools import load_from_json_file, load_from_json_url
 
-class OWElectronBeam(GenericElement):
+class OWElectronBeam(OWSource):
 
     syned_file_name = Setting("Select *.json file")
     # source_name = Setting("Undefined")
@@ -81,6 +81,7 @@ class OWElectronBeam(GenericElement):
         button.setFixedHeight(45)
         button.setFixedWidth(150)
 
+        self._add_cancel_button(button_box)
 
         self.tabs_control_area = oasysgui.tabWidget(self.controlArea)
         self.tabs_control_area.setFixedHeight(self.TABS_AREA_HEIGHT)
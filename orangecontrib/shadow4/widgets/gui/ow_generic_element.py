@@ -1,8 +1,8 @@
 import sys
 import numpy
 
-from PyQt5.QtGui import QTextCursor
 from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QFont
 from orangewidget import gui
 from orangewidget.settings import Setting
 from oasys.widgets import gui as oasysgui
@@ -11,8 +11,13 @@ from oasys.util.oasys_util import TriggerIn
 from shadow4.beam.s4_beam import S4Beam
 from orangecontrib.shadow4.widgets.gui.ow_automatic_element import AutomaticElement
 from orangecontrib.shadow4.util.shadow4_objects import ShadowData
+from orangecontrib.shadow4.util.shadow4_footprint import ShadowFootprint
 from orangecontrib.shadow4.util.shadow4_util import ShadowPlot, ShadowCongruence
+from orangecontrib.shadow4.util.shadow4_statistics import ShadowBeamStatistics
 from orangecontrib.shadow4.util.python_script import PythonScript
+from orangecontrib.shadow4.util.shadow4_profiling import ShadowProfiler
+from orangecontrib.shadow4.widgets.gui.worker import CalculationWorker, CalculationCancelled
+from orangecontrib.shadow4.widgets.gui.log_sink import LogSink
 
 class GenericElement(AutomaticElement):
     IMAGE_WIDTH  = 860
@@ -20,9 +25,16 @@ class GenericElement(AutomaticElement):
 
     view_type = Setting(0)
 
-    plotted_beam   = None
-    footprint_beam = None
-    has_footprint  = True
+    plotted_beam      = None
+    footprint_beam    = None
+    footprint_plotted = True
+    has_footprint     = True
+
+    worker               = None
+    calculation_callback = None
+    pending_calculation  = None
+    progress_range       = (10, 80)
+    cancel_button        = None
 
     def __init__(self, show_automatic_box=True, has_footprint=True):
         super().__init__(show_automatic_box)
@@ -54,12 +66,37 @@ class GenericElement(AutomaticElement):
 
         self._initialize_tabs()
 
+        self.tabs.currentChanged.connect(self._plot_footprint_on_request)
+
         self.shadow_output = oasysgui.textArea(height=580, width=800)
 
-        out_box = gui.widgetBox(out_tab, "System Output", addSpace=True, orientation="horizontal")
+        out_box = gui.widgetBox(out_tab, "System Output", addSpace=True, orientation="vertical")
         out_box.layout().addWidget(self.shadow_output)
 
+        self.log_sink = LogSink(self.shadow_output, parent=self)
+
+        gui.button(out_box, self, "Open Full Log", callback=self.log_sink.open_log_file)
+
+        # profiling tab
+        profiling_tab = oasysgui.createTabPage(self.main_tabs, "Profiling")
+        self.profiling_tab_index = self.main_tabs.count() - 1
+
+        self.profiling_output = oasysgui.textArea(height=540, width=800, readOnly=True)
+        self.profiling_output.setFont(QFont("Courier"))
+
+        profiling_box = gui.widgetBox(profiling_tab, "Stages of the runs (wall and CPU times)", addSpace=True, orientation="vertical")
+        profiling_box.layout().addWidget(self.profiling_output)
+
+        profiling_button_box = gui.widgetBox(profiling_box, "", addSpace=False, orientation="horizontal")
+        gui.button(profiling_button_box, self, "Reset", callback=self.reset_profiling)
+        gui.button(profiling_button_box, self, "Workflow Report", callback=self.show_workflow_report)
+        gui.button(profiling_button_box, self, "Export Workflow Trace...", callback=self.export_profiling_trace)
+
+        self.main_tabs.currentChanged.connect(self._refresh_profiling_table)
+
     def _initialize_tabs(self):
+        self.footprint_plotted = True # canvases are rebuilt empty: nothing to plot on request
+
         current_tab = self.tabs.currentIndex()
 
         size = len(self.tab)
@@ -80,6 +117,88 @@ class GenericElement(AutomaticElement):
 
         self.tabs.setCurrentIndex(current_tab)
 
+    #########################################################
+    # Calculations in a worker thread
+    #########################################################
+
+    def _add_cancel_button(self, button_box):
+        self.cancel_button = gui.button(button_box, self, "Cancel", callback=self.cancel_calculation)
+        self.cancel_button.setFixedHeight(45)
+        self.cancel_button.setFixedWidth(100)
+        self.cancel_button.setEnabled(False)
+
+    def is_calculation_running(self):
+        return not self.worker is None
+
+    def _run_calculation(self, calculation, callback, progress_range=(10, 80)):
+        # calculation(monitor) runs in a worker thread (no GUI access!), callback(result) in the GUI thread (plots, send).
+        # A new run while another one is running cancels it, and starts as soon as it stops
+        if self.is_calculation_running():
+            self.pending_calculation = (calculation, callback, progress_range)
+            self.worker.cancel()
+        else:
+            self.calculation_callback = callback
+            self.progress_range       = progress_range
+
+            self.worker = CalculationWorker(calculation, parent=self, log_sink=self.log_sink)
+            self.worker.progress.connect(self._on_calculation_progress)
+            self.worker.succeeded.connect(self._on_calculation_succeeded)
+            self.worker.failed.connect(self._on_calculation_failed)
+
+            if not self.cancel_button is None: self.cancel_button.setEnabled(True)
+
+            self.worker.start()
+
+    def cancel_calculation(self):
+        if self.is_calculation_running():
+            self.pending_calculation = None
+            self.worker.cancel()
+            self.setStatusMessage("Cancelling calculation...")
+
+    def _on_calculation_progress(self, fraction):
+        start, stop = self.progress_range
+        self.progressBarSet(start + fraction * (stop - start))
+
+    def _on_calculation_succeeded(self, result):
+        callback = self._end_calculation()
+
+        if not callback is None:
+            self._redirect_stdout(clear=False)
+
+            try:
+                callback(result)
+            except Exception as exception:
+                try:    self._initialize_tabs()
+                except: pass
+                self.prompt_exception(exception)
+
+    def _on_calculation_failed(self, exception):
+        if not self._end_calculation() is None:
+            self._redirect_stdout(clear=False)
+            self.progressBarFinished()
+
+            if isinstance(exception, CalculationCancelled):
+                self.setStatusMessage("Calculation cancelled")
+            else:
+                try:    self._initialize_tabs()
+                except: pass
+                self.prompt_exception(exception)
+
+    def _end_calculation(self):
+        # the callback of the finished calculation, or None if a pending calculation replaces it
+        self.worker.wait()
+        self.worker = None
+
+        if not self.cancel_button is None: self.cancel_button.setEnabled(False)
+
+        pending_calculation, self.pending_calculation = self.pending_calculation, None
+
+        if pending_calculation is None:
+            return self.calculation_callback
+        else:
+            self._run_calculation(*pending_calculation)
+            return None
+
     def _check_not_interactive_conditions(self, input_data : ShadowData):
         not_interactive = False
 
@@ -150,6 +269,9 @@ class GenericElement(AutomaticElement):
         self.progressBarSet(progressBarValue)
 
     def _plot_results(self, output_beam, footprint, progressBarValue=80):
+        with self._profile("rendering"): self.__plot_results(output_beam, footprint, progressBarValue)
+
+    def __plot_results(self, output_beam, footprint, progressBarValue):
         if not self.view_type == 2:
             if ShadowCongruence.check_empty_beam(output_beam):
                 self.view_type_combo.setEnabled(False)
@@ -164,23 +286,24 @@ class GenericElement(AutomaticElement):
                 yums      = self._get_y_um()
 
                 try:
+                    self._compute_histograms(output_beam, variables)
+
                     if self.view_type == 1:
                         self._plot_xy_preview(output_beam, progressBarValue + 4, variables[0][0], variables[0][1], plot_canvas_index=0, title=titles[0], xtitle=xtitles[0], ytitle=ytitles[0])
                         self._plot_xy_preview(output_beam, progressBarValue + 8, variables[1][0], variables[1][1], plot_canvas_index=1, title=titles[1], xtitle=xtitles[1], ytitle=ytitles[1])
                         self._plot_xy_preview(output_beam, progressBarValue + 12, variables[2][0], variables[2][1], plot_canvas_index=2, title=titles[2], xtitle=xtitles[2], ytitle=ytitles[2])
                         self._plot_xy_preview(output_beam, progressBarValue + 16, variables[3][0], variables[3][1], plot_canvas_index=3, title=titles[3], xtitle=xtitles[3], ytitle=ytitles[3])
                         self._plot_histo_preview(output_beam, progressBarValue + 20, variables[4], plot_canvas_index=4, title=titles[4], xtitle=xtitles[4], ytitle=ytitles[4])
-                        if self.has_footprint: self._plot_xy_preview(footprint, progressBarValue + 20, 2, 1, plot_canvas_index=5, title="Footprint", xtitle="Y [m]", ytitle="X [m]", is_footprint=True)
-
-
                     elif self.view_type == 0:
                         self._plot_xy_detailed(output_beam, progressBarValue + 4, variables[0][0], variables[0][1], plot_canvas_index=0, title=titles[0], xtitle=xtitles[0], ytitle=ytitles[0], xum=xums[0], yum=yums[0])
                         self._plot_xy_detailed(output_beam, progressBarValue + 8, variables[1][0], variables[1][1], plot_canvas_index=1, title=titles[1], xtitle=xtitles[1], ytitle=ytitles[1], xum=xums[1], yum=yums[1])
                         self._plot_xy_detailed(output_beam, progressBarValue + 12, variables[2][0], variables[2][1], plot_canvas_index=2, title=titles[2], xtitle=xtitles[2], ytitle=ytitles[2], xum=xums[2], yum=yums[2])
                         self._plot_xy_detailed(output_beam, progressBarValue + 16, variables[3][0], variables[3][1], plot_canvas_index=3, title=titles[3], xtitle=xtitles[3], ytitle=ytitles[3], xum=xums[3], yum=yums[3])
                         self._plot_histo_detailed(output_beam, progressBarValue + 20, variables[4], plot_canvas_index=4, title=titles[4], xtitle=xtitles[4], ytitle=ytitles[4], xum=xums[4])
-                        if self.has_footprint: self._plot_xy_detailed(footprint, progressBarValue + 20, 2, 1, plot_canvas_index=5, title="Footprint", xtitle="Y [m]", ytitle="X [m]", xum=("Y [m]"), yum=("X [m]"), is_footprint=True)
 
+                    # the footprint is built and plotted only when its tab is shown
+                    self.footprint_plotted = not self.has_footprint or footprint is None
+                    if self._is_footprint_tab_current(): self._plot_footprint(footprint, progressBarValue + 20)
                 except Exception as e:
                     self.view_type_combo.setEnabled(True)
 
@@ -193,12 +316,83 @@ class GenericElement(AutomaticElement):
         self.plotted_beam   = output_beam
         self.footprint_beam = footprint
 
-    def _write_stdout(self, text):
-        cursor = self.shadow_output.textCursor()
-        cursor.movePosition(QTextCursor.End)
-        cursor.insertText(text)
-        self.shadow_output.setTextCursor(cursor)
-        self.shadow_output.ensureCursorVisible()
+    def _compute_histograms(self, beam, variables):
+        # histograms of the plot tabs in one pass over the rays: the plots find them memoised in the statistics of the beam
+        requests = [("histo2", var_x, var_y, 100, 100, None, None, 1, 23) for var_x, var_y in variables[:4]] if self.view_type == 0 else []
+        requests.append(("histo1", variables[4], None, 100, 1, 23))
+
+        with ShadowProfiler.stage("histogramming"): ShadowBeamStatistics.get(beam).compute_histograms(requests)
+
+    def _is_footprint_tab_current(self):
+        return self.has_footprint and self.tabs.currentIndex() == len(self.tab) - 1
+
+    def _plot_footprint(self, footprint, progressBarValue):
+        if not self.footprint_plotted:
+            if isinstance(footprint, ShadowFootprint): footprint = footprint.get_beam()
+
+            if self.view_type == 1:   self._plot_xy_preview(footprint, progressBarValue, 2, 1, plot_canvas_index=5, title="Footprint", xtitle="Y [m]", ytitle="X [m]", is_footprint=True)
+            elif self.view_type == 0: self._plot_xy_detailed(footprint, progressBarValue, 2, 1, plot_canvas_index=5, title="Footprint", xtitle="Y [m]", ytitle="X [m]", xum=("Y [m]"), yum=("X [m]"), is_footprint=True)
+
+            self.footprint_plotted = True
+
+    def _plot_footprint_on_request(self, index):
+        if not self.footprint_plotted and self._is_footprint_tab_current():
+            self.progressBarInit()
+
+            try:
+                self._plot_footprint(self.footprint_beam, progressBarValue=100)
+            except Exception as exception:
+                self.prompt_exception(exception)
+
+            self.progressBarFinished()
+
+    def _redirect_stdout(self, clear=True):
+        # the stdout of the GUI thread goes to the output pane until the end of the current slot (see LogSink)
+        if clear: # new run
+            self.log_sink.clear()
+            ShadowProfiler.start_run(self._get_profiling_name())
+        self.log_sink.capture_until_idle()
+
+    #########################################################
+    # Profiling (see ShadowProfiler)
+    #########################################################
+
+    def _get_profiling_name(self):
+        return getattr(self, "captionTitle", None) or type(self).__name__
+
+    def _profile(self, stage):
+        # with self._profile("stage"): ... records the wall and CPU times of the block, from any thread
+        return ShadowProfiler.stage(stage, self._get_profiling_name())
+
+    def _profiled(self, stage, function):
+        return ShadowProfiler.profiled(stage, function, self._get_profiling_name())
+
+    def send(self, signal_name, value, *args, **kwargs):
+        with self._profile("send"): super().send(signal_name, value, *args, **kwargs)
+
+        self._refresh_profiling_table()
+
+    def reset_profiling(self):
+        ShadowProfiler.clear(self._get_profiling_name())
+        self._refresh_profiling_table()
+
+    def show_workflow_report(self):
+        # last run of all the widgets, the ones raising the memory peak most first
+        self.profiling_output.setText(ShadowProfiler.get_workflow_report())
+
+    def export_profiling_trace(self):
+        try:
+            file_name = oasysgui.selectSaveFileFromDialog(self, message="Export Workflow Trace", default_file_name="shadow4_trace.json", file_extension_filter="Chrome Trace Files (*.json)")
+
+            if not file_name is None and file_name.strip() != "":
+                ShadowProfiler.write_chrome_trace(file_name) # all the widgets
+                self.setStatusMessage("Trace written to " + file_name)
+        except Exception as exception:
+            self.prompt_exception(exception)
+
+    def _refresh_profiling_table(self, index=None):
+        if self.main_tabs.currentIndex() == self.profiling_tab_index:
+            self.profiling_output.setText(ShadowProfiler.get_table_text(self._get_profiling_name()))
 
     def _on_receiving_input(self):
         self._initialize_tabs()
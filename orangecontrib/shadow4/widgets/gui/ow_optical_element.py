@@ -11,7 +11,7 @@ from orangewidget import gui
 from orangewidget.settings import Setting
 
 from oasys.widgets import gui as oasysgui
-from oasys.util.oasys_util import EmittingStream
+from oasys.widgets import congruence
 
 from syned.widget.widget_decorator import WidgetDecorator
 from syned.beamline.element_coordinates import ElementCoordinates
@@ -20,6 +20,9 @@ from shadow4.tools.logger import set_verbose
 
 from orangecontrib.shadow4.widgets.gui.ow_generic_element import GenericElement
 from orangecontrib.shadow4.util.shadow4_objects import ShadowData
+from orangecontrib.shadow4.util.shadow4_footprint import ShadowFootprint
+from orangecontrib.shadow4.util.shadow4_cache import ShadowTraceCache
+from orangecontrib.shadow4.util.shadow4_engine import ShadowParallelTracer
 
 from orangecontrib.shadow4.util.shadow4_util import ShadowCongruence, TriggerToolsDecorator
 from oasys.util.oasys_util import TriggerIn, TriggerOut
@@ -50,6 +53,22 @@ class OWOpticalElement(GenericElement, WidgetDecorator, TriggerToolsDecorator):
     oe_orientation_angle            = Setting(0)
     oe_orientation_angle_user_value = Setting(0.0)
 
+    #########################################################
+    # Execution
+    #########################################################
+    trace_cache_active        = Setting(0) # opt-in: each element has its own budgets
+    trace_cache_memory_budget = Setting(ShadowTraceCache.DEFAULT_MEMORY_BUDGET)
+    trace_cache_spill         = Setting(0)
+    trace_cache_disk_budget   = Setting(ShadowTraceCache.DEFAULT_DISK_BUDGET)
+    trace_cache_directory     = Setting("")
+    number_of_workers         = Setting(1)
+    lost_rays_compaction      = Setting(0)
+    lost_rays_threshold       = Setting(0.5)
+
+    NOT_TRACED_SETTINGS = ["is_automatic_run", "view_type",
+                           "trace_cache_active", "trace_cache_memory_budget", "trace_cache_spill", "trace_cache_disk_budget", "trace_cache_directory",
+                           "number_of_workers"]
+
     def __init__(self, show_automatic_box=True, has_footprint=False, show_tab_advanced_settings=True, show_tab_help=False):
         super().__init__(show_automatic_box=show_automatic_box,
                          has_footprint=has_footprint,
@@ -83,6 +102,8 @@ class OWOpticalElement(GenericElement, WidgetDecorator, TriggerToolsDecorator):
         button.setFixedHeight(45)
         button.setFixedWidth(150)
 
+        self._add_cancel_button(button_box)
+
         #
         # tabs
         #
@@ -94,6 +115,7 @@ class OWOpticalElement(GenericElement, WidgetDecorator, TriggerToolsDecorator):
         self.tab_basic_settings    = oasysgui.createTabPage(self.tabs_control_area, "Basic Settings")
         if show_tab_advanced_settings:
             self.tab_advanced_settings = oasysgui.createTabPage(self.tabs_control_area, "Advanced Settings")
+        self.tab_execution         = oasysgui.createTabPage(self.tabs_control_area, "Execution")
         if show_tab_help:
             self.tab_help = oasysgui.createTabPage(self.tabs_control_area, "Help")
 
@@ -122,6 +144,12 @@ class OWOpticalElement(GenericElement, WidgetDecorator, TriggerToolsDecorator):
             self.populate_advanced_setting_subtabs(advanced_setting_subtabs)
 
 
+        #########################################################
+        # Execution
+        #########################################################
+        self.trace_cache = None
+        self.populate_tab_execution(self.tab_execution)
+
         #########################################################
         # Help
         #########################################################
@@ -199,6 +227,94 @@ class OWOpticalElement(GenericElement, WidgetDecorator, TriggerToolsDecorator):
         self.oe_orientation_angle_user()
 
 
+    def populate_tab_execution(self, tab_execution):
+        parallel_box = oasysgui.widgetBox(tab_execution, "Parallel Tracing", addSpace=True, orientation="vertical")
+
+        oasysgui.lineEdit(parallel_box, self, "number_of_workers", "Number of processes (1=serial)", labelWidth=260,
+                          valueType=int, orientation="horizontal", tooltip="number_of_workers")
+        gui.label(parallel_box, self, "Available cores: " + str(ShadowParallelTracer.DEFAULT_NUMBER_OF_WORKERS))
+
+        lost_rays_box = oasysgui.widgetBox(tab_execution, "Lost Rays", addSpace=True, orientation="vertical")
+
+        gui.comboBox(lost_rays_box, self, "lost_rays_compaction", label="Drop lost rays from the output", labelWidth=290,
+                     items=["No", "Yes"], sendSelectedValue=False, orientation="horizontal", callback=self.set_lost_rays_compaction,
+                     tooltip="lost_rays_compaction")
+
+        self.lost_rays_box_1 = oasysgui.widgetBox(lost_rays_box, "", addSpace=False, orientation="vertical")
+
+        oasysgui.lineEdit(self.lost_rays_box_1, self, "lost_rays_threshold", "When the lost fraction exceeds", labelWidth=260,
+                          valueType=float, orientation="horizontal", tooltip="lost_rays_threshold")
+
+        self.set_lost_rays_compaction()
+
+        cache_box = oasysgui.widgetBox(tab_execution, "Trace Cache", addSpace=True, orientation="vertical")
+
+        gui.comboBox(cache_box, self, "trace_cache_active", label="Reuse results of unchanged input/parameters", labelWidth=290,
+                     items=["No", "Yes"], sendSelectedValue=False, orientation="horizontal", callback=self.set_trace_cache,
+                     tooltip="trace_cache_active")
+
+        self.trace_cache_box = oasysgui.widgetBox(cache_box, "", addSpace=False, orientation="vertical")
+
+        oasysgui.lineEdit(self.trace_cache_box, self, "trace_cache_memory_budget", "Memory budget [MB]", labelWidth=260,
+                          valueType=int, orientation="horizontal", callback=self.set_trace_cache, tooltip="trace_cache_memory_budget")
+        gui.comboBox(self.trace_cache_box, self, "trace_cache_spill", label="Spill to disk", labelWidth=290,
+                     items=["No", "Yes"], sendSelectedValue=False, orientation="horizontal", callback=self.set_trace_cache,
+                     tooltip="trace_cache_spill")
+
+        self.trace_cache_spill_box = oasysgui.widgetBox(self.trace_cache_box, "", addSpace=False, orientation="vertical")
+
+        oasysgui.lineEdit(self.trace_cache_spill_box, self, "trace_cache_disk_budget", "Disk budget [MB]", labelWidth=260,
+                          valueType=int, orientation="horizontal", callback=self.set_trace_cache, tooltip="trace_cache_disk_budget")
+
+        file_box = oasysgui.widgetBox(self.trace_cache_spill_box, "", addSpace=False, orientation="horizontal")
+        self.le_trace_cache_directory = oasysgui.lineEdit(file_box, self, "trace_cache_directory", "Spill directory", labelWidth=120,
+                                                          valueType=str, orientation="horizontal", callback=self.set_trace_cache,
+                                                          tooltip="trace_cache_directory (empty=system temp)")
+        gui.button(file_box, self, "...", callback=self.select_trace_cache_directory)
+
+        gui.button(self.trace_cache_box, self, "Clear Cache", callback=self.clear_trace_cache)
+
+        self.set_trace_cache()
+
+    #########################################################
+    # Execution Methods
+    #########################################################
+    def set_trace_cache(self):
+        self.trace_cache_box.setVisible(self.trace_cache_active == 1)
+        self.trace_cache_spill_box.setVisible(self.trace_cache_spill == 1)
+
+        if self.trace_cache_active == 0:
+            if not self.trace_cache is None: self.trace_cache.clear()
+            self.trace_cache = None
+        else:
+            try:
+                congruence.checkStrictlyPositiveNumber(self.trace_cache_memory_budget, "Memory budget")
+                congruence.checkStrictlyPositiveNumber(self.trace_cache_disk_budget, "Disk budget")
+                if self.trace_cache_directory: congruence.checkDir(self.trace_cache_directory)
+
+                if self.trace_cache is None: self.trace_cache = ShadowTraceCache()
+                self.trace_cache.set_configuration(memory_budget=self.trace_cache_memory_budget,
+                                                   spill=self.trace_cache_spill == 1,
+                                                   disk_budget=self.trace_cache_disk_budget,
+                                                   spill_directory=self.trace_cache_directory)
+            except Exception as exception:
+                self.prompt_exception(exception)
+
+    def select_trace_cache_directory(self):
+        self.le_trace_cache_directory.setText(oasysgui.selectDirectoryFromDialog(self, self.trace_cache_directory, "Select Spill Directory"))
+        self.set_trace_cache()
+
+    def clear_trace_cache(self):
+        if not self.trace_cache is None:
+            self.trace_cache.clear()
+            self.setStatusMessage("Trace cache cleared")
+
+    def set_lost_rays_compaction(self):
+        self.lost_rays_box_1.setVisible(self.lost_rays_compaction == 1)
+
+    def _get_trace_cache_key(self, input_data):
+        return None if self.trace_cache is None else ShadowTraceCache.get_key(input_data, self, excluded_settings=self.NOT_TRACED_SETTINGS)
+
     #########################################################
     # Position Methods
     #########################################################
@@ -279,7 +395,7 @@ class OWOpticalElement(GenericElement, WidgetDecorator, TriggerToolsDecorator):
         self._on_receiving_input()
 
         if ShadowCongruence.check_empty_data(input_data):
-            self.input_data = input_data.duplicate()
+            with self._profile("input duplicate"): self.input_data = input_data.duplicate()
             if self.is_automatic_run: self.run_shadow4()
 
 
@@ -291,53 +407,162 @@ class OWOpticalElement(GenericElement, WidgetDecorator, TriggerToolsDecorator):
         try:
             self.progressBarInit()
             set_verbose()
-            self.shadow_output.setText("")
-
-            sys.stdout = EmittingStream(textWritten=self._write_stdout)
+            self._redirect_stdout()
 
             beamline = self.input_data.beamline.duplicate()
-            element = self.get_beamline_element_instance()
-            element.set_optical_element(self.get_optical_element_instance())
-            element.set_coordinates(self.get_coordinates_instance())
-            element.set_movements(self.get_movements_instance())
-            element.set_input_beam(self.input_data.beam)
+
+            cache_key = self._get_trace_cache_key(self.input_data)
+            cached    = None if cache_key is None else self.trace_cache.get(cache_key)
+
+            if cached is None:
+                element = self.get_beamline_element(self.input_data)
+            else: # unchanged input and parameters: the cached results are reused
+                output_beam, footprint, element = cached
+                element.set_input_beam(self.input_data.beam)
 
             print(element.info())
 
             beamline.append_beamline_element(element)
 
             #
-            # script
+            # script: generated when the script tab is used (same input and parameters, same script)
             #
-            script = beamline.to_python_code()
-            script += "\n\n\n# test plot"
-            script += "\nif True:"
-            script += "\n   from srxraylib.plot.gol import plot_scatter"
-            script += "\n   plot_scatter(beam.get_photon_energy_eV(nolost=1), beam.get_column(23, nolost=1), title='(Intensity,Photon Energy)', plot_histograms=0)"
-            script += "\n   plot_scatter(1e6 * beam.get_column(1, nolost=1), 1e6 * beam.get_column(3, nolost=1), title='(X,Z) in microns')"
-            self.shadow4_script.set_code(script)
+            def script():
+                script = beamline.to_python_code()
+                script += "\n\n\n# test plot"
+                script += "\nif True:"
+                script += "\n   from srxraylib.plot.gol import plot_scatter"
+                script += "\n   plot_scatter(beam.get_photon_energy_eV(nolost=1), beam.get_column(23, nolost=1), title='(Intensity,Photon Energy)', plot_histograms=0)"
+                script += "\n   plot_scatter(1e6 * beam.get_column(1, nolost=1), 1e6 * beam.get_column(3, nolost=1), title='(X,Z) in microns')"
+
+                return script
+
+            self.shadow4_script.set_code_provider(self._profiled("script generation", script), key=cache_key)
 
             #
-            # run
+            # run: traced in a worker thread, results completed in the GUI thread
             #
             self.progressBarInit()
-            output_beam, footprint = element.trace_beam()
 
-            self._post_trace_operations(output_beam, footprint, element, beamline)
+            input_data = self.input_data
 
-            self._set_plot_quality()
-            self._plot_results(output_beam, footprint, progressBarValue=80)
+            if cached is None:
+                congruence.checkStrictlyPositiveNumber(self.number_of_workers, "Number of processes")
+                if self.lost_rays_compaction == 1: congruence.checkPositiveNumber(self.lost_rays_threshold, "Lost fraction threshold")
 
-            self._plot_additional_results(output_beam, footprint, element, beamline)
+                self._run_calculation(lambda monitor: self.trace_beamline_element(element, input_data, monitor),
+                                      lambda result: self._complete_trace(input_data, element, beamline, *result, cached=False))
+            else:
+                self._complete_trace(input_data, element, beamline, output_beam, footprint, cached=True)
+        except Exception as exception:
+            try:    self._initialize_tabs()
+            except: pass
+            self.prompt_exception(exception)
+
+    def get_beamline_element(self, input_data):
+        with self._profile("element instantiation"):
+            element = self.get_beamline_element_instance()
+            element.set_optical_element(self.get_optical_element_instance())
+            element.set_coordinates(self.get_coordinates_instance())
+            element.set_movements(self.get_movements_instance())
+            element.set_input_beam(input_data.beam) # single precision: converted block by block when traced (see ShadowParallelTracer)
 
-            self.progressBarFinished()
+        return element
 
-            #
-            # send beam and trigger
-            #
-            self.send("Shadow Data", ShadowData(beam=output_beam, beamline=beamline, footprint=footprint))
-            self.send("Trigger", TriggerIn(new_object=True))
+    def trace_beamline_element(self, element, input_data, monitor=None):
+        # no GUI: called by the calculation worker and by the batch runner (see shadow4_batch)
+        with self._profile("trace_beam"): return self.__trace_beamline_element(element, input_data, monitor)
+
+    def __trace_beamline_element(self, element, input_data, monitor):
+        tracer = ShadowParallelTracer(self.number_of_workers) # rays split in blocks (across processes, with more than one worker)
+
+        if hasattr(input_data.beam, "iterate_chunks"): # memory-mapped or blocks: traced chunk by chunk
+            output_beam, footprint = input_data.beam.trace_beamline_element(element, monitor, tracer)
+        else:
+            output_beam, footprint = tracer.trace_beamline_element(element, monitor=monitor) # blocks traced in double precision, stored in the input precision
+
+        # lost rays are not traced, histogrammed, cached downstream; stacks keep the ray counts of their items
+        if self.lost_rays_compaction == 1 and not input_data.is_stack(): output_beam = ShadowData.compact_lost_rays(output_beam, self.lost_rays_threshold)
+
+        # only X, Y, flag and intensity of the footprint are kept: it is plotted on request (Footprint tab, Plot XY Footprint)
+        return output_beam, ShadowFootprint.initialize_from_beam(footprint, dtype=input_data.get_statistics().get_dtype())
+
+    def _complete_trace(self, input_data, element, beamline, output_beam, footprint, cached=False):
+        with self._profile("post-trace"): self._post_trace_operations(output_beam, footprint, element, beamline)
+
+        if not self.trace_cache is None:
+            # keyed after _post_trace_operations, that may update settings (e.g. crystal angles)
+            if not cached: self.trace_cache.put(self._get_trace_cache_key(input_data), output_beam, footprint, element)
+            self.setStatusMessage("Trace cache " + ("hit" if cached else "miss") + " - " + self.trace_cache.get_status())
+
+        self._set_plot_quality()
+        self._plot_results(output_beam, footprint, progressBarValue=80)
+
+        self._plot_additional_results(output_beam, footprint, element, beamline)
+
+        self.progressBarFinished()
+
+        #
+        # send beam and trigger
+        #
+        output_data = ShadowData(beam=output_beam, beamline=beamline, footprint=footprint)
+        output_data.scanning_data = input_data.scanning_data # e.g. stacks: ray counts are kept by the trace
+        output_data.number_of_generated_rays = input_data.get_number_of_generated_rays() # lost rays may be dropped
+        if output_data.is_ensemble(): print(output_data.get_ensemble_report())
+
+        self.send("Shadow Data", output_data)
+        self.send("Trigger", TriggerIn(new_object=True))
+
+    def run_shadow4_for_values(self, variable_name, variable_values, variable_display_name="", variable_um=""):
+        # batched trigger: the input is traced by the elements of all the values (each in the process pool, with more
+        # than one process) and the outputs are sent as one stack (see ShadowData.initialize_as_stack)
+        try:
+            if self.input_data.is_stack(): raise ValueError("Batched values cannot be applied to a stack of beams")
+            congruence.checkStrictlyPositiveNumber(self.number_of_workers, "Number of processes")
+
+            self.progressBarInit()
+            set_verbose()
+            self._redirect_stdout()
+
+            input_data = self.input_data
+
+            elements = []
+            original = self._get_trigger_variable(variable_name)
+            try:
+                for variable_value in variable_values:
+                    self._set_trigger_variable(variable_name, variable_value)
+                    elements.append(self.get_beamline_element(input_data))
+            finally:
+                self._restore_trigger_variable(variable_name, original) # the settings of the widget are not changed by the batch
+
+            def trace(monitor):
+                results = []
+                for index, element in enumerate(elements):
+                    results.append(self.trace_beamline_element(element, input_data, None if monitor is None else lambda fraction: monitor((index + fraction) / len(elements))))
+
+                return results
+
+            def completion(results):
+                for element, (output_beam, footprint) in zip(elements, results):
+                    beamline = input_data.beamline.duplicate()
+                    beamline.append_beamline_element(element)
+
+                    with self._profile("post-trace"): self._post_trace_operations(output_beam, footprint, element, beamline)
+
+                output_data = ShadowData.initialize_as_stack([output_beam for output_beam, _ in results], variable_name, variable_values, variable_display_name, variable_um,
+                                                             footprints=[footprint for _, footprint in results], beamline=beamline,
+                                                             generated_rays=[input_data.get_number_of_generated_rays()] * len(results)) # lost rays may be dropped
+                output_data.initial_flux = input_data.initial_flux
+
+                self._set_plot_quality()
+                self._plot_results(output_data.beam, output_data.footprint, progressBarValue=80)
+
+                self.progressBarFinished()
+
+                self.send("Shadow Data", output_data)
+                self.send("Trigger", TriggerIn(new_object=True))
 
+            self._run_calculation(trace, completion)
         except Exception as exception:
             try:    self._initialize_tabs()
             except: pass
@@ -0,0 +1,179 @@
+from orangewidget import gui
+from orangewidget.settings import Setting
+
+from oasys.widgets import gui as oasysgui
+from oasys.widgets import congruence
+from oasys.util.oasys_util import TriggerIn
+
+from orangecontrib.shadow4.widgets.gui.ow_generic_element import GenericElement
+from orangecontrib.shadow4.util.shadow4_objects import ShadowData
+from orangecontrib.shadow4.util.shadow4_statistics import ShadowBeamStatistics
+from orangecontrib.shadow4.util.shadow4_out_of_core import ShadowMemoryMappedBeam
+from orangecontrib.shadow4.util.shadow4_blocks import ShadowBlockBeam
+from orangecontrib.shadow4.util.shadow4_beamline import ShadowBeamline
+from orangecontrib.shadow4.util.shadow4_engine import ShadowParallelTracer
+from orangecontrib.shadow4.util.shadow4_fingerprint import ShadowFingerprint
+
+class OWSource(GenericElement):
+    ray_precision        = Setting(0)
+    ray_precision_report = Setting(0)
+    ray_storage          = Setting(0)
+    memory_budget        = Setting(ShadowMemoryMappedBeam.DEFAULT_MEMORY_BUDGET)
+    scratch_directory    = Setting("")
+    block_size           = Setting(ShadowBlockBeam.DEFAULT_BLOCK_SIZE)
+    ensemble_size        = Setting(1)
+
+    CHUNKED_GENERATION   = True # False: the light source cannot be generated in chunks (e.g. grids)
+    ENSEMBLE_SEED_STRIDE = 1000003 # seeds of an ensemble: seed, seed + stride, ... (chunks use seed, seed+1, ...)
+
+    def __init__(self, show_automatic_box=False, has_footprint=False):
+        super().__init__(show_automatic_box=show_automatic_box, has_footprint=has_footprint)
+
+    def _add_ray_storage_box(self, container, labelWidth=250):
+        gui.checkBox(container, self, "ray_precision_report", "Single precision report (Output tab)", tooltip="ray_precision_report")
+
+        gui.comboBox(container, self, "ray_storage", label="Ray storage", tooltip="ray_storage", labelWidth=labelWidth,
+                     items=["In memory", "Memory-mapped file (out-of-core)", "In memory, ray blocks"], sendSelectedValue=False, orientation="horizontal",
+                     callback=self.set_ray_storage)
+
+        self.out_of_core_box = oasysgui.widgetBox(container, "", addSpace=False, orientation="vertical")
+
+        oasysgui.lineEdit(self.out_of_core_box, self, "memory_budget", "Memory budget [MB]", tooltip="memory_budget", labelWidth=labelWidth,
+                          valueType=int, orientation="horizontal")
+
+        file_box = oasysgui.widgetBox(self.out_of_core_box, "", addSpace=False, orientation="horizontal")
+        self.le_scratch_directory = oasysgui.lineEdit(file_box, self, "scratch_directory", "Scratch directory", tooltip="scratch_directory (empty=system temp)",
+                                                      labelWidth=120, valueType=str, orientation="horizontal")
+        gui.button(file_box, self, "...", callback=self.select_scratch_directory)
+
+        self.ray_blocks_box = oasysgui.widgetBox(container, "", addSpace=False, orientation="vertical")
+
+        oasysgui.lineEdit(self.ray_blocks_box, self, "block_size", "Rays per block", tooltip="block_size", labelWidth=labelWidth,
+                          valueType=int, orientation="horizontal")
+
+        self.set_ray_storage()
+
+        if hasattr(self, "seed"):
+            oasysgui.lineEdit(container, self, "ensemble_size", "Ensemble size (seeds)", tooltip="ensemble_size (1=single run)", labelWidth=labelWidth,
+                              valueType=int, orientation="horizontal")
+
+    def set_ray_storage(self):
+        self.out_of_core_box.setVisible(self.ray_storage == 1)
+        self.ray_blocks_box.setVisible(self.ray_storage == 2)
+
+    def select_scratch_directory(self):
+        self.le_scratch_directory.setText(oasysgui.selectDirectoryFromDialog(self, self.scratch_directory, "Select Scratch Directory"))
+
+    def _generate_beam(self, light_source, monitor=None):
+        # out-of-core or blocks: rays are generated in chunks (seed, seed+1, ...), written to a memory-mapped file or kept as blocks.
+        # Sources that cannot be generated in chunks (e.g. grids) are split/copied once generated.
+        # monitor(fraction) is called after each chunk (see CalculationWorker)
+        with self._profile("beam generation"): return self.__generate_beam(light_source, monitor)
+
+    def __generate_beam(self, light_source, monitor):
+        dtype   = ShadowData.SINGLE_PRECISION if self.ray_precision == 1 else ShadowData.DOUBLE_PRECISION
+        chunked = self.CHUNKED_GENERATION
+
+        if self.ray_storage == 1:
+            congruence.checkStrictlyPositiveNumber(self.memory_budget, "Memory budget")
+            if self.scratch_directory: congruence.checkDir(self.scratch_directory)
+
+            if chunked:
+                return ShadowMemoryMappedBeam.initialize_from_light_source(light_source, dtype=dtype,
+                                                                           memory_budget=self.memory_budget,
+                                                                           scratch_directory=self.scratch_directory,
+                                                                           monitor=monitor)
+            else:
+                return ShadowMemoryMappedBeam.initialize_from_beam(light_source.get_beam(), dtype=dtype,
+                                                                   memory_budget=self.memory_budget,
+                                                                   scratch_directory=self.scratch_directory)
+        elif self.ray_storage == 2:
+            congruence.checkStrictlyPositiveNumber(self.block_size, "Rays per block")
+
+            if chunked: return ShadowBlockBeam.initialize_from_light_source(light_source, dtype=dtype, block_size=self.block_size, monitor=monitor)
+            else:       return ShadowBlockBeam.initialize_from_beam(light_source.get_beam(), dtype=dtype, block_size=self.block_size)
+        else:
+            return light_source.get_beam()
+
+    def _set_python_script(self, light_source):
+        # generated when the script tab is used; the light source is built from the settings, which key the script
+        def script():
+            script = light_source.to_python_code()
+            script += "\n\n# test plot\nfrom srxraylib.plot.gol import plot_scatter"
+            script += "\nrays = beam.get_rays()"
+            script += "\nplot_scatter(1e6 * rays[:, 0], 1e6 * rays[:, 2], title='(X,Z) in microns')"
+
+            return script
+
+        self.shadow4_script.set_code_provider(self._profiled("script generation", script), key=ShadowFingerprint.get_settings_fingerprint(self))
+
+    def _apply_ray_precision(self, output_beam):
+        if self.ray_precision == 1 and not hasattr(output_beam, "iterate_chunks"): # chunked beams are generated with their precision
+            single_precision_beam = ShadowData.beam_with_precision(output_beam, ShadowData.SINGLE_PRECISION)
+
+            if self.ray_precision_report == 1: print(ShadowBeamStatistics.get_precision_report(output_beam, single_precision_beam)) # histograms both beams
+
+            return single_precision_beam
+        else:
+            return output_beam
+
+    def is_ensemble_run(self):
+        return hasattr(self, "seed") and self.ensemble_size > 1
+
+    def run_shadow4_ensemble(self):
+        # the source with ensemble_size independent seeds, generated in a process pool and sent as one stack: downstream
+        # elements trace all the seeds in one pass, their statistics are the mean and standard error over the seeds
+        # (see ShadowData.get_ensemble_statistics)
+        self._redirect_stdout()
+
+        try:
+            congruence.checkStrictlyPositiveNumber(self.ensemble_size, "Ensemble size")
+            congruence.checkStrictlyPositiveNumber(self.seed, "Seed (ensemble runs cannot use the clock)")
+        except Exception as exception:
+            self.prompt_exception(exception)
+            return
+
+        seed = self.seed
+        try:
+            self.run_shadow4_for_values("seed", [seed + index * OWSource.ENSEMBLE_SEED_STRIDE for index in range(self.ensemble_size)], "Seed", ensemble=True)
+        finally:
+            self.seed = seed # the light sources are built
+
+    def run_shadow4_for_values(self, variable_name, variable_values, variable_display_name="", variable_um="", ensemble=False):
+        # batched trigger: the light sources of all the values are generated in a process pool and sent as one stack
+        # (see ShadowData.initialize_as_stack), held in memory: the ray storage must be "In memory"
+        try:
+            if self.ray_storage != 0: raise ValueError("Batched and ensemble runs generate all the values in memory, as one stack of " +
+                                                       "beams: they cannot use memory-mapped files or ray blocks (Ray storage must be In memory)")
+
+            self.progressBarInit()
+
+            light_sources = []
+            original      = self._get_trigger_variable(variable_name)
+            try:
+                for variable_value in variable_values:
+                    self._set_trigger_variable(variable_name, variable_value)
+                    light_sources.append(self.get_lightsource())
+            finally:
+                self._restore_trigger_variable(variable_name, original) # the settings of the widget are not changed by the batch
+
+            def calculation(monitor): # in a worker thread
+                return [self._apply_ray_precision(beam) for beam in ShadowParallelTracer().generate_beams(light_sources, monitor)]
+
+            def completion(beams):
+                output_data = ShadowData.initialize_as_stack(beams, variable_name, variable_values, variable_display_name, variable_um,
+                                                             beamline=ShadowBeamline(light_source=light_sources[-1]), ensemble=ensemble)
+                if ensemble: print(output_data.get_ensemble_report())
+
+                self._plot_results(output_data.beam, None, progressBarValue=80)
+
+                self.progressBarFinished()
+
+                self.send("Shadow Data", output_data)
+                self.send("Trigger", TriggerIn(new_object=True))
+
+            self._run_calculation(calculation, completion)
+        except Exception as exception:
+            try:    self._initialize_tabs()
+            except: pass
+            self.prompt_exception(exception)
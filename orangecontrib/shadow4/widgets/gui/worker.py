@@ -0,0 +1,47 @@
+from PyQt5.QtCore import QThread, pyqtSignal
+
+class CalculationCancelled(Exception):
+    def __init__(self):
+        super().__init__("Calculation cancelled")
+
+class CalculationWorker(QThread):
+    # runs calculation(monitor) out of the GUI thread. The calculation calls monitor(fraction) between chunks of rays:
+    # it reports the progress and, after cancel(), raises CalculationCancelled.
+    # Results and exceptions are delivered through signals, i.e. in the GUI thread.
+    # The output of the calculation goes to log_sink (see LogSink), if given.
+
+    progress  = pyqtSignal(float)
+    succeeded = pyqtSignal(object)
+    failed    = pyqtSignal(object)
+
+    def __init__(self, calculation, parent=None, log_sink=None):
+        super().__init__(parent)
+
+        self.__calculation = calculation
+        self.__log_sink    = log_sink
+        self.__cancelled   = False
+
+    def cancel(self):
+        self.__cancelled = True
+
+    def is_cancelled(self):
+        return self.__cancelled
+
+    def monitor(self, fraction):
+        if self.__cancelled: raise CalculationCancelled()
+
+        self.progress.emit(fraction)
+
+    def run(self):
+        if not self.__log_sink is None: self.__log_sink.start_capture()
+
+        try:
+            self.monitor(0.0)
+            result = self.__calculation(self.monitor)
+            if self.__cancelled: raise CalculationCancelled()
+        except Exception as exception:
+            self.failed.emit(exception)
+        else:
+            self.succeeded.emit(result)
+        finally:
+            if not self.__log_sink is None: self.__log_sink.stop_capture()
@@ -9,7 +9,6 @@ from orangewidget import gui
 from orangewidget.settings import Setting
 
 from oasys.widgets import gui as oasysgui
-from oasys.util.oasys_util import EmittingStream
 
 from orangecontrib.shadow4.widgets.gui.ow_generic_element import GenericElement
 
@@ -20,6 +19,7 @@ from shadow4.tools.logger import set_verbose
 
 from orangecontrib.shadow4.util.shadow4_objects import ShadowData
 from orangecontrib.shadow4.util.shadow4_util import ShadowCongruence
+from orangecontrib.shadow4.util.shadow4_engine import ShadowParallelTracer
 
 
 class OWBeamMovement(GenericElement, WidgetDecorator):
@@ -169,7 +169,7 @@ class OWBeamMovement(GenericElement, WidgetDecorator):
         optical_element = S4BeamMovementElement()
         optical_element.set_optical_element(self.get_oe_instance())
         # optical_element.set_coordinates()
-        optical_element.set_input_beam(self.input_data.beam)
+        optical_element.set_input_beam(self.input_data.beam) # single precision: converted block by block when traced
         return optical_element
 
     def set_shadow_data(self, input_data):
@@ -190,14 +190,13 @@ class OWBeamMovement(GenericElement, WidgetDecorator):
         try:
             self.progressBarInit()
             set_verbose()
-            self.shadow_output.setText("")
-
-            sys.stdout = EmittingStream(textWritten=self._write_stdout)
+            self._redirect_stdout()
 
             element = self.get_element_instance()
             print(element.info())
 
-            output_beam, _ = element.trace_beam()
+            # blocks (chunks of memory-mapped or block beams) traced in double precision, stored in the input precision
+            output_beam, _ = ShadowParallelTracer(1).trace_beamline_element(element)
 
             beamline = self.input_data.beamline.duplicate()
             beamline.append_beamline_element(element)
@@ -211,13 +210,17 @@ class OWBeamMovement(GenericElement, WidgetDecorator):
             #
             # script
             #
-            script = beamline.to_python_code()
-            script += "\n\n\n# test plot"
-            script += "\nif True:"
-            script += "\n   from srxraylib.plot.gol import plot_scatter"
-            script += "\n   # plot_scatter(beam.get_photon_energy_eV(nolost=1), beam.get_column(23, nolost=1), title='(Intensity,Photon Energy)', plot_histograms=0)"
-            script += "\n   plot_scatter(1e6 * beam.get_column(1, nolost=1), 1e6 * beam.get_column(3, nolost=1), title='(X,Z) in microns')"
-            self.shadow4_script.set_code(script)
+            def script():
+                script = beamline.to_python_code()
+                script += "\n\n\n# test plot"
+                script += "\nif True:"
+                script += "\n   from srxraylib.plot.gol import plot_scatter"
+                script += "\n   # plot_scatter(beam.get_photon_energy_eV(nolost=1), beam.get_column(23, nolost=1), title='(Intensity,Photon Energy)', plot_histograms=0)"
+                script += "\n   plot_scatter(1e6 * beam.get_column(1, nolost=1), 1e6 * beam.get_column(3, nolost=1), title='(X,Z) in microns')"
+
+                return script
+
+            self.shadow4_script.set_code_provider(self._profiled("script generation", script))
 
             #
             # send beam
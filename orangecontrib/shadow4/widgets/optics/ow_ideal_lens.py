@@ -72,28 +72,6 @@ class OWIdealLens(OWOpticalElement):
 
         self.set_ideal_lens_type()
 
-    def get_element_instance(self):
-        if self.ideal_lens_type == 0:
-            optical_element = S4IdealLensElement()
-
-        else:
-            optical_element = S4SuperIdealLensElement()
-        optical_element.set_optical_element(self.get_oe_instance())
-        # optical_element.set_coordinates()
-        optical_element.set_input_beam(self.input_data.beam)
-        return optical_element
-
-    def get_oe_instance(self):
-        try:    name = self.getNode().title
-        except: name = "Ideal Lens"
-
-        if self.ideal_lens_type == 0:
-            return S4IdealLens(
-                name=name, focal_x=self.focal_x, focal_y=self.focal_z)
-        else:
-            return S4SuperIdealLens(
-                name=name, focal_x=self.focal_x, focal_y=self.focal_z)
-
     def set_ideal_lens_type(self):
         self.box_focal_distances.setVisible(self.ideal_lens_type == 0)
         self.box_p_q_distances.setVisible(self.ideal_lens_type == 1)
@@ -172,8 +172,7 @@ class OWTransfocator(OWOpticalElement):
 
         beamline_element = S4TransfocatorElement(optical_element=self.get_optical_element_instance(),
                                                  coordinates=self.get_coordinates_instance(),
-                                                 movements=self.get_movements_instance(),
-                                                 input_beam=self.input_data.beam)
+                                                 movements=self.get_movements_instance()) # the input beam is set by get_beamline_element(input_data)
         return beamline_element
 
     def get_movements_instance(self): return None
@@ -1,5 +1,4 @@
 import sys
-import time
 import numpy
 
 from PyQt5.QtGui import QPalette, QColor, QFont
@@ -11,12 +10,11 @@ from orangewidget.settings import Setting
 
 from oasys.widgets import gui as oasysgui
 from oasys.widgets import congruence
-from oasys.util.oasys_util import EmittingStream
 
 from orangecontrib.shadow4.util.shadow4_objects import ShadowData
-from orangecontrib.shadow4.widgets.gui.ow_generic_element import GenericElement
+from orangecontrib.shadow4.widgets.gui.ow_source import OWSource
 
-from shadow4.beamline.s4_beamline import S4Beamline
+from orangecontrib.shadow4.util.shadow4_beamline import ShadowBeamline
 from shadow4.sources.source_geometrical.source_geometrical import SourceGeometrical
 from shadow4.tools.logger import set_verbose
 
@@ -26,7 +24,7 @@ from orangecontrib.shadow4.util.shadow4_util import TriggerToolsDecorator
 from oasys.util.oasys_util import TriggerIn
 
 
-class OWGeometrical(GenericElement, WidgetDecorator, TriggerToolsDecorator):
+class OWGeometrical(OWSource, WidgetDecorator, TriggerToolsDecorator):
 
     name = "Geometrical Source"
     description = "Shadow Source: Geometrical Source"
@@ -162,6 +160,8 @@ class OWGeometrical(GenericElement, WidgetDecorator, TriggerToolsDecorator):
         button.setFixedHeight(45)
         button.setFixedWidth(150)
 
+        self._add_cancel_button(button_box)
+
         ################################################################################################################
         self.controlArea.setFixedWidth(self.CONTROL_AREA_WIDTH)
 
@@ -176,7 +176,7 @@ class OWGeometrical(GenericElement, WidgetDecorator, TriggerToolsDecorator):
         ##############################
         # MONTECARLO
 
-        left_box_1 = oasysgui.widgetBox(tab_basic, "Montecarlo", addSpace=True, orientation="vertical", height=100)
+        left_box_1 = oasysgui.widgetBox(tab_basic, "Montecarlo", addSpace=True, orientation="vertical", height=210)
 
         gui.separator(left_box_1)
 
@@ -186,6 +186,9 @@ class OWGeometrical(GenericElement, WidgetDecorator, TriggerToolsDecorator):
                           valueType=int, orientation="horizontal", tooltip="number_of_rays")
         oasysgui.lineEdit(self.sample_box_1, self, "seed", "Seed (0=clock)", labelWidth=260, valueType=int,
                           orientation="horizontal", tooltip="seed")
+        gui.comboBox(self.sample_box_1, self, "ray_precision", label="Ray storage precision", tooltip="ray_precision", labelWidth=260,
+                     items=["Double (float64)", "Single (float32)"], sendSelectedValue=False, orientation="horizontal")
+        self._add_ray_storage_box(self.sample_box_1, labelWidth=260)
 
         ##############################
         # GEOMETRY
@@ -723,23 +726,20 @@ class OWGeometrical(GenericElement, WidgetDecorator, TriggerToolsDecorator):
         return gs
 
     def run_shadow4(self):
+        if self.is_ensemble_run(): return self.run_shadow4_ensemble()
+
         try:
             set_verbose()
-            self.shadow_output.setText("")
-            sys.stdout = EmittingStream(textWritten=self._write_stdout)
+            self._redirect_stdout()
 
             self._set_plot_quality()
 
             self.progressBarInit()
 
-            light_source = self.get_lightsource()
+            with self._profile("element instantiation"): light_source = self.get_lightsource()
 
             # script
-            script = light_source.to_python_code()
-            script += "\n\n# test plot\nfrom srxraylib.plot.gol import plot_scatter"
-            script += "\nrays = beam.get_rays()"
-            script += "\nplot_scatter(1e6 * rays[:, 0], 1e6 * rays[:, 2], title='(X,Z) in microns')"
-            self.shadow4_script.set_code(script)
+            self._set_python_script(light_source)
 
 
             print(light_source.info())
@@ -749,28 +749,29 @@ class OWGeometrical(GenericElement, WidgetDecorator, TriggerToolsDecorator):
             self.progressBarSet(5)
 
             # run shadow4
-            t00 = time.time()
-            # beam = light_source.get_beam(NRAYS=self.number_of_rays, SEED=self.seed)
-            output_beam = light_source.get_beam()
-            t11 = time.time() - t00
-            print("***** time for %d rays: %f s, %f min, " % (self.number_of_rays, t11, t11 / 60))
+            def calculation(monitor): # in a worker thread
+                # beam = light_source.get_beam(NRAYS=self.number_of_rays, SEED=self.seed)
+                output_beam = self._generate_beam(light_source, monitor=monitor)
 
-            #
-            # beam plots
-            #
-            self._plot_results(output_beam, None, progressBarValue=80)
+                return self._apply_ray_precision(output_beam)
 
+            def completion(output_beam):
+                #
+                # beam plots
+                #
+                self._plot_results(output_beam, None, progressBarValue=80)
 
+                self.progressBarFinished()
 
-            self.progressBarFinished()
+                #
+                # send beam and trigger
+                #
+                self.send("Shadow Data", ShadowData(beam=output_beam,
+                                                   number_of_rays=self.number_of_rays,
+                                                   beamline=ShadowBeamline(light_source=light_source)))
+                self.send("Trigger", TriggerIn(new_object=True))
 
-            #
-            # send beam and trigger
-            #
-            self.send("Shadow Data", ShadowData(beam=output_beam,
-                                               number_of_rays=self.number_of_rays,
-                                               beamline=S4Beamline(light_source=light_source)))
-            self.send("Trigger", TriggerIn(new_object=True))
+            self._run_calculation(calculation, completion)
         except Exception as exception:
             try:    self._initialize_tabs()
             except: pass
@@ -7,14 +7,13 @@ from orangewidget.settings import Setting
 
 from oasys.widgets import gui as oasysgui
 from oasys.widgets import congruence
-from oasys.util.oasys_util import EmittingStream
 
 from orangecontrib.shadow4.util.shadow4_objects import ShadowData
-from orangecontrib.shadow4.widgets.gui.ow_generic_element import GenericElement
+from orangecontrib.shadow4.widgets.gui.ow_source import OWSource
 
 from syned.widget.widget_decorator import WidgetDecorator
 
-from shadow4.beamline.s4_beamline import S4Beamline
+from orangecontrib.shadow4.util.shadow4_beamline import ShadowBeamline
 from shadow4.sources.source_geometrical.source_grid_polar import SourceGridPolar
 from shadow4.sources.source_geometrical.source_grid_cartesian import SourceGridCartesian
 from shadow4.tools.logger import set_verbose
@@ -23,7 +22,7 @@ from orangecontrib.shadow4.util.shadow4_util import TriggerToolsDecorator
 from oasys.util.oasys_util import TriggerIn
 
 
-class OWGrid(GenericElement, WidgetDecorator, TriggerToolsDecorator):
+class OWGrid(OWSource, WidgetDecorator, TriggerToolsDecorator):
 
     name = "Grid Source"
     description = "Shadow Source: Grid Source"
@@ -108,6 +107,8 @@ class OWGrid(GenericElement, WidgetDecorator, TriggerToolsDecorator):
         button.setFixedHeight(45)
         button.setFixedWidth(150)
 
+        self._add_cancel_button(button_box)
+
         ################################################################################################################
         self.controlArea.setFixedWidth(self.CONTROL_AREA_WIDTH)
 
@@ -127,6 +128,11 @@ class OWGrid(GenericElement, WidgetDecorator, TriggerToolsDecorator):
                      items=["Cartesian", "Polar"], orientation="horizontal",
                      callback=self.set_coordinates_visibility)
 
+        left_box_2 = oasysgui.widgetBox(tab_basic, "Rays storage", addSpace=True, orientation="vertical")
+        gui.comboBox(left_box_2, self, "ray_precision", label="Ray storage precision", tooltip="ray_precision", labelWidth=355,
+                     items=["Double (float64)", "Single (float32)"], sendSelectedValue=False, orientation="horizontal")
+        self._add_ray_storage_box(left_box_2, labelWidth=355)
+
         #### points
         points_box = oasysgui.widgetBox(tab_basic, "Number of points", addSpace=True,
                                                    orientation="vertical")
@@ -291,46 +297,42 @@ class OWGrid(GenericElement, WidgetDecorator, TriggerToolsDecorator):
     def run_shadow4(self):
         try:
             set_verbose()
-            self.shadow_output.setText("")
-            sys.stdout = EmittingStream(textWritten=self._write_stdout)
+            self._redirect_stdout()
 
             self._set_plot_quality()
 
             self.progressBarInit()
 
-            light_source = self.get_lightsource()
+            with self._profile("element instantiation"): light_source = self.get_lightsource()
 
             self.progressBarSet(5)
 
-            # run shadow4
-
-            output_beam = light_source.get_beam()
+            # run shadow4 (in a worker thread)
 
-            #
-            # beam plots
-            #
-            self._plot_results(output_beam, None, progressBarValue=80)
+            def calculation(monitor): return self._apply_ray_precision(self._generate_beam(light_source, monitor=monitor))
 
-            #
-            # script
-            #
-            script = light_source.to_python_code()
+            def completion(output_beam):
+                #
+                # beam plots
+                #
+                self._plot_results(output_beam, None, progressBarValue=80)
 
-            script += "\n\n# test plot\nfrom srxraylib.plot.gol import plot_scatter"
-            script += "\nrays = beam.get_rays()"
-            script += "\nplot_scatter(1e6 * rays[:, 0], 1e6 * rays[:, 2], title='(X,Z) in microns')"
+                #
+                # script
+                #
+                self._set_python_script(light_source)
 
-            self.shadow4_script.set_code(script)
+                self.progressBarFinished()
 
-            self.progressBarFinished()
+                #
+                # send beam and trigger
+                #
+                self.send("Shadow Data", ShadowData(beam=output_beam,
+                                                   number_of_rays=output_beam.get_number_of_rays(),
+                                                   beamline=ShadowBeamline(light_source=light_source)))
+                self.send("Trigger", TriggerIn(new_object=True))
 
-            #
-            # send beam and trigger
-            #
-            self.send("Shadow Data", ShadowData(beam=output_beam,
-                                               number_of_rays=output_beam.get_number_of_rays(),
-                                               beamline=S4Beamline(light_source=light_source)))
-            self.send("Trigger", TriggerIn(new_object=True))
+            self._run_calculation(calculation, completion)
         except Exception as exception:
             try:    self._initialize_tabs()
             except: pass
@@ -1,5 +1,4 @@
 import sys
-import time
 import numpy
 
 from orangecontrib.shadow4.widgets.gui.ow_electron_beam import OWElectronBeam
@@ -9,7 +8,6 @@ from orangecontrib.shadow4.util.shadow4_util import TriggerToolsDecorator
 from oasys.util.oasys_util import TriggerIn
 from oasys.widgets import gui as oasysgui
 
-from oasys.util.oasys_util import EmittingStream
 
 from syned.beamline.beamline import Beamline
 from syned.storage_ring.magnetic_structures.insertion_device import InsertionDevice
@@ -22,7 +20,7 @@ from orangewidget.settings import Setting
 from shadow4.sources.undulator.s4_undulator import S4Undulator
 from shadow4.sources.undulator.s4_undulator_light_source import S4UndulatorLightSource
 
-from shadow4.beamline.s4_beamline import S4Beamline
+from orangecontrib.shadow4.util.shadow4_beamline import ShadowBeamline
 from shadow4.tools.logger import set_verbose
 
 
@@ -136,6 +134,9 @@ class OWUndulator(OWElectronBeam, WidgetDecorator, TriggerToolsDecorator):
         left_box_12 = oasysgui.widgetBox(tab_undulator, "Sampling rays", addSpace=False, orientation="vertical")
         oasysgui.lineEdit(left_box_12, self, "number_of_rays", "Number of rays", labelWidth=260, valueType=int, orientation="horizontal")
         oasysgui.lineEdit(left_box_12, self, "seed", "Seed", tooltip="Seed (0=clock)", labelWidth=250, valueType=int, orientation="horizontal")
+        gui.comboBox(left_box_12, self, "ray_precision", label="Ray storage precision", tooltip="ray_precision", labelWidth=250,
+                     items=["Double (float64)", "Single (float32)"], sendSelectedValue=False, orientation="horizontal")
+        self._add_ray_storage_box(left_box_12, labelWidth=250)
 
         #
         # advanced settings
@@ -317,60 +318,55 @@ class OWUndulator(OWElectronBeam, WidgetDecorator, TriggerToolsDecorator):
         return lightsource
 
     def run_shadow4(self):
+        if self.is_ensemble_run(): return self.run_shadow4_ensemble()
+
         try:
             set_verbose()
-            self.shadow_output.setText("")
             self.lightsource = None # clean
 
-            sys.stdout = EmittingStream(textWritten=self._write_stdout)
+            self._redirect_stdout()
 
             self._set_plot_quality()
 
             self.progressBarInit()
 
-            light_source = self.get_lightsource()
+            with self._profile("element instantiation"): light_source = self.get_lightsource()
 
             #
             # script
             #
-            script = light_source.to_python_code()
-            script += "\n\n# test plot\nfrom srxraylib.plot.gol import plot_scatter"
-            script += "\nrays = beam.get_rays()"
-            script += "\nplot_scatter(1e6 * rays[:, 0], 1e6 * rays[:, 2], title='(X,Z) in microns')"
-
-
-            self.shadow4_script.set_code(script)
+            self._set_python_script(light_source)
 
             self.progressBarSet(5)
             #
             # run shadow4
             #
-            t00 = time.time()
-            print("***** starting calculation...")
-            output_beam = light_source.get_beam()
-            t11 = time.time() - t00
-            print("***** time for %d rays: %f s, %f min, " % (self.number_of_rays, t11, t11 / 60))
+            def calculation(monitor): # in a worker thread
+                output_beam = self._generate_beam(light_source, monitor=monitor)
 
-            self.lightsource = light_source
+                return self._apply_ray_precision(output_beam)
 
+            def completion(output_beam):
+                self.lightsource = light_source
 
-            #
-            # plots
-            #
-            self._plot_results(output_beam, None, progressBarValue=80)
-            self.refresh_specific_undulator_plots()
+                #
+                # plots
+                #
+                self._plot_results(output_beam, None, progressBarValue=80)
+                self.refresh_specific_undulator_plots()
 
+                self.progressBarFinished()
 
-            self.progressBarFinished()
+                #
+                # send beam and trigger
+                #
+                self.send("Shadow Data", ShadowData(beam=output_beam,
+                                                   number_of_rays=self.number_of_rays,
+                                                   beamline=ShadowBeamline(light_source=light_source)))
 
-            #
-            # send beam and trigger
-            #
-            self.send("Shadow Data", ShadowData(beam=output_beam,
-                                               number_of_rays=self.number_of_rays,
-                                               beamline=S4Beamline(light_source=light_source)))
+                self.send("Trigger", TriggerIn(new_object=True))
 
-            self.send("Trigger", TriggerIn(new_object=True))
+            self._run_calculation(calculation, completion)
         except Exception as exception:
             try:    self._initialize_tabs()
             except: pass
@@ -519,7 +515,7 @@ class OWUndulator(OWElectronBeam, WidgetDecorator, TriggerToolsDecorator):
         self.undulator_tab[undulator_plot_slot_index].layout().addWidget(plot_widget_id)
 
     def receive_syned_data(self, data):
-        sys.stdout = EmittingStream(textWritten=self._write_stdout)
+        self._redirect_stdout(clear=False)
         if data is not None:
             if isinstance(data, Beamline):
                 if data.get_light_source() is not None:
@@ -1,5 +1,4 @@
 import sys
-import time
 import numpy
 
 
@@ -8,7 +7,6 @@ from orangewidget.settings import Setting
 
 from oasys.widgets import gui as oasysgui
 from oasys.widgets import congruence
-from oasys.util.oasys_util import EmittingStream
 
 from orangecontrib.shadow4.widgets.gui.ow_electron_beam import OWElectronBeam
 from orangecontrib.shadow4.util.shadow4_objects import ShadowData
@@ -17,7 +15,7 @@ from orangecontrib.shadow4.widgets.gui.plots import plot_data1D, plot_data2D, pl
 from orangewidget import gui as orangegui
 
 from syned.beamline.beamline import Beamline
-from shadow4.beamline.s4_beamline import S4Beamline
+from orangecontrib.shadow4.util.shadow4_beamline import ShadowBeamline
 
 from syned.storage_ring.magnetic_structures.undulator import Undulator
 from syned.widget.widget_decorator import WidgetDecorator
@@ -86,6 +84,9 @@ class OWUndulatorGaussian(OWElectronBeam, WidgetDecorator, TriggerToolsDecorator
         oasysgui.lineEdit(box_2, self, "delta_e", "Delta Energy [eV]", tooltip="delta_e", labelWidth=250, valueType=float, orientation="horizontal")
         oasysgui.lineEdit(box_2, self, "number_of_rays", "Number of Rays", tooltip="number_of_rays", labelWidth=250, valueType=int, orientation="horizontal")
         oasysgui.lineEdit(box_2, self, "seed", "Seed", tooltip="seed", labelWidth=250, valueType=int, orientation="horizontal")
+        gui.comboBox(box_2, self, "ray_precision", label="Ray storage precision", tooltip="ray_precision", labelWidth=250,
+                     items=["Double (float64)", "Single (float32)"], sendSelectedValue=False, orientation="horizontal")
+        self._add_ray_storage_box(box_2, labelWidth=250)
 
         #
         # advanced settings
@@ -271,52 +272,51 @@ class OWUndulatorGaussian(OWElectronBeam, WidgetDecorator, TriggerToolsDecorator
         return lightsource
 
     def run_shadow4(self):
+        if self.is_ensemble_run(): return self.run_shadow4_ensemble()
+
         try:
             set_verbose()
-            self.shadow_output.setText("")
-            sys.stdout = EmittingStream(textWritten=self._write_stdout)
+            self._redirect_stdout()
 
             self._set_plot_quality()
 
             self.progressBarInit()
 
-            light_source = self.get_lightsource()
+            with self._profile("element instantiation"): light_source = self.get_lightsource()
 
             #
             # script
             #
-            script = light_source.to_python_code()
-            script += "\n\n# test plot\nfrom srxraylib.plot.gol import plot_scatter"
-            script += "\nrays = beam.get_rays()"
-            script += "\nplot_scatter(1e6 * rays[:, 0], 1e6 * rays[:, 2], title='(X,Z) in microns')"
-            self.shadow4_script.set_code(script)
+            self._set_python_script(light_source)
             self.progressBarSet(5)
 
             # run shadow4
-            t00 = time.time()
-            print("***** starting calculation...")
-            output_beam = light_source.get_beam()
-            t11 = time.time() - t00
-            print("***** time for %d rays: %f s, %f min, " % (self.number_of_rays, t11, t11 / 60))
+            def calculation(monitor): # in a worker thread
+                output_beam = self._generate_beam(light_source, monitor=monitor)
 
-            self.lightsource = light_source
+                return self._apply_ray_precision(output_beam)
 
-            #
-            # beam plots
-            #
-            self._plot_results(output_beam, None, progressBarValue=80)
+            def completion(output_beam):
+                self.lightsource = light_source
 
-            self.refresh_specific_undulator_plots()
+                #
+                # beam plots
+                #
+                self._plot_results(output_beam, None, progressBarValue=80)
 
-            self.progressBarFinished()
+                self.refresh_specific_undulator_plots()
 
-            #
-            # send beam and trigger
-            #
-            self.send("Shadow Data", ShadowData(beam=output_beam,
-                                               number_of_rays=self.number_of_rays,
-                                               beamline=S4Beamline(light_source=light_source)))
-            self.send("Trigger", TriggerIn(new_object=True))
+                self.progressBarFinished()
+
+                #
+                # send beam and trigger
+                #
+                self.send("Shadow Data", ShadowData(beam=output_beam,
+                                                   number_of_rays=self.number_of_rays,
+                                                   beamline=ShadowBeamline(light_source=light_source)))
+                self.send("Trigger", TriggerIn(new_object=True))
+
+            self._run_calculation(calculation, completion)
         except Exception as exception:
             try:    self._initialize_tabs()
             except: pass
@@ -1,5 +1,4 @@
 import sys
-import time
 import numpy
 
 from PyQt5.QtWidgets import QMessageBox
@@ -10,7 +9,6 @@ from orangecontrib.shadow4.util.shadow4_objects import ShadowData
 
 from oasys.widgets import gui as oasysgui
 
-from oasys.util.oasys_util import EmittingStream
 
 from syned.beamline.beamline import Beamline
 from syned.storage_ring.magnetic_structures.insertion_device import InsertionDevice
@@ -24,7 +22,7 @@ from shadow4.sources.wiggler.s4_wiggler import S4Wiggler
 from shadow4.sources.wiggler.s4_wiggler_light_source import S4WigglerLightSource
 from shadow4.sources.wiggler.s4_wiggler_optimized_light_source import S4WigglerOptimizedLightSource
 
-from shadow4.beamline.s4_beamline import S4Beamline
+from orangecontrib.shadow4.util.shadow4_beamline import ShadowBeamline
 from shadow4.tools.logger import set_verbose
 
 from orangecontrib.shadow4.util.shadow4_util import TriggerToolsDecorator
@@ -141,6 +139,9 @@ class OWWiggler(OWElectronBeam, WidgetDecorator, TriggerToolsDecorator):
         oasysgui.lineEdit(left_box_11, self, "e_max", "Max photon energy [eV]", tooltip="e_max", labelWidth=260, valueType=float, orientation="horizontal")
         oasysgui.lineEdit(left_box_11, self, "number_of_rays", "Number of rays", tooltip="number_of_rays", labelWidth=260, valueType=int, orientation="horizontal")
         oasysgui.lineEdit(left_box_11, self, "seed", "Seed", tooltip="seed", labelWidth=250, valueType=int, orientation="horizontal")
+        gui.comboBox(left_box_11, self, "ray_precision", label="Ray storage precision", tooltip="ray_precision", labelWidth=250,
+                     items=["Double (float64)", "Single (float32)"], sendSelectedValue=False, orientation="horizontal")
+        self._add_ray_storage_box(left_box_11, labelWidth=250)
 
         self.set_shift_X_flag()
         self.set_shift_beta_X_flag()
@@ -343,26 +344,22 @@ class OWWiggler(OWElectronBeam, WidgetDecorator, TriggerToolsDecorator):
 
 
     def run_shadow4(self):
+        if self.is_ensemble_run(): return self.run_shadow4_ensemble()
+
         try:
             set_verbose()
-            self.shadow_output.setText("")
-            sys.stdout = EmittingStream(textWritten=self._write_stdout)
+            self._redirect_stdout()
 
             self._set_plot_quality()
 
             self.progressBarInit()
 
-            light_source = self.get_lightsource()
+            with self._profile("element instantiation"): light_source = self.get_lightsource()
 
             #
             # script
             #
-            script = light_source.to_python_code()
-            script += "\n\n# test plot\nfrom srxraylib.plot.gol import plot_scatter"
-            script += "\nrays = beam.get_rays()"
-            script += "\nplot_scatter(1e6 * rays[:, 0], 1e6 * rays[:, 2], title='(X,Z) in microns')"
-
-            self.shadow4_script.set_code(script)
+            self._set_python_script(light_source)
 
             #
             # run shadow4
@@ -371,28 +368,32 @@ class OWWiggler(OWElectronBeam, WidgetDecorator, TriggerToolsDecorator):
 
 
             self.progressBarSet(10)
-            t00 = time.time()
-            print("***** starting shadow calculation...")
-            output_beam = light_source.get_beam()
-            photon_energy, flux, spectral_power = light_source.calculate_spectrum()
-            t11 = time.time() - t00
-            print("***** time for %d rays: %f s, %f min, " % (self.number_of_rays, t11, t11 / 60))
+            def calculation(monitor): # in a worker thread
+                output_beam = self._generate_beam(light_source, monitor=monitor)
+                photon_energy, flux, spectral_power = light_source.calculate_spectrum()
 
-            #
-            # plots
-            #
-            self._plot_results(output_beam, None, progressBarValue=80)
-            self.refresh_specific_wiggler_plots(light_source, photon_energy, flux, spectral_power)
+                return self._apply_ray_precision(output_beam), photon_energy, flux, spectral_power
 
-            self.progressBarFinished()
+            def completion(result):
+                output_beam, photon_energy, flux, spectral_power = result
 
-            #
-            # send beam and trigger
-            #
-            self.send("Shadow Data", ShadowData(beam=output_beam,
-                                               number_of_rays=self.number_of_rays,
-                                               beamline=S4Beamline(light_source=light_source)))
-            self.send("Trigger", TriggerIn(new_object=True))
+                #
+                # plots
+                #
+                self._plot_results(output_beam, None, progressBarValue=80)
+                self.refresh_specific_wiggler_plots(light_source, photon_energy, flux, spectral_power)
+
+                self.progressBarFinished()
+
+                #
+                # send beam and trigger
+                #
+                self.send("Shadow Data", ShadowData(beam=output_beam,
+                                                   number_of_rays=self.number_of_rays,
+                                                   beamline=ShadowBeamline(light_source=light_source)))
+                self.send("Trigger", TriggerIn(new_object=True))
+
+            self._run_calculation(calculation, completion)
         except Exception as exception:
             try:    self._initialize_tabs()
             except: pass
@@ -438,7 +439,7 @@ class OWWiggler(OWElectronBeam, WidgetDecorator, TriggerToolsDecorator):
         self.wiggler_tab[wiggler_plot_slot_index].layout().addWidget(plot_widget_id)
 
     def receive_syned_data(self, data):
-        sys.stdout = EmittingStream(textWritten=self._write_stdout)
+        self._redirect_stdout(clear=False)
         if data is not None:
             if isinstance(data, Beamline):
                 if data.get_light_source() is not None:
@@ -59,11 +59,13 @@ class BeamCleaner(OWWidget, TriggerToolsDecorator):
          gui.rubber(self.controlArea)
 
     def set_shadow_data(self, shadow_data: ShadowData):
+        # same as "Drop lost rays from the output" of the optical elements (Execution tab), with threshold 0
         if ShadowCongruence.check_empty_data(shadow_data):
-            output_data = shadow_data.duplicate()
+            output_data = shadow_data.duplicate() # rays are shared, not copied
 
             if ShadowCongruence.check_good_beam(input_beam=output_data.beam):
-                output_data.beam.clean_lost_rays()
+                output_data.beam                     = ShadowData.compact_lost_rays(output_data.beam)
+                output_data.number_of_generated_rays = shadow_data.get_number_of_generated_rays()
 
                 self.send("Shadow Data", output_data)
                 self.send("Trigger", TriggerIn(new_object=True))
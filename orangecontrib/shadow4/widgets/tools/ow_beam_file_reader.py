@@ -11,14 +11,13 @@ from syned.widget.widget_decorator import WidgetDecorator
 from orangewidget import widget
 
 from oasys.widgets import gui as oasysgui
-from oasys.util.oasys_util import EmittingStream
 
 from oasys.util.oasys_util import TriggerIn
 
 from orangecontrib.shadow4.util.shadow4_objects import ShadowData
 from orangecontrib.shadow4.widgets.gui.ow_generic_element import GenericElement
 
-from shadow4.beamline.s4_beamline import S4Beamline
+from orangecontrib.shadow4.util.shadow4_beamline import ShadowBeamline
 from shadow4.tools.logger import set_verbose
 from shadow4.sources.s4_light_source_from_file import S4LightSourceFromFile
 
@@ -109,8 +108,7 @@ class BeamFileReader(GenericElement, TriggerToolsDecorator, WidgetDecorator):
 
         try:
             set_verbose()
-            self.shadow_output.setText("")
-            sys.stdout = EmittingStream(textWritten=self._write_stdout)
+            self._redirect_stdout()
 
             self._set_plot_quality()
 
@@ -119,11 +117,15 @@ class BeamFileReader(GenericElement, TriggerToolsDecorator, WidgetDecorator):
             light_source = self.get_lightsource()
 
             # script
-            script = light_source.to_python_code()
-            script += "\n\n# test plot\nfrom srxraylib.plot.gol import plot_scatter"
-            script += "\nrays = beam.get_rays()"
-            script += "\nplot_scatter(1e6 * rays[:, 0], 1e6 * rays[:, 2], title='(X,Z) in microns')"
-            self.shadow4_script.set_code(script)
+            def script():
+                script = light_source.to_python_code()
+                script += "\n\n# test plot\nfrom srxraylib.plot.gol import plot_scatter"
+                script += "\nrays = beam.get_rays()"
+                script += "\nplot_scatter(1e6 * rays[:, 0], 1e6 * rays[:, 2], title='(X,Z) in microns')"
+
+                return script
+
+            self.shadow4_script.set_code_provider(self._profiled("script generation", script))
 
             print(light_source.info())
             print(light_source.get_info())
@@ -140,7 +142,7 @@ class BeamFileReader(GenericElement, TriggerToolsDecorator, WidgetDecorator):
             # send beam and trigger
             output_data = ShadowData(beam=output_beam,
                                      number_of_rays=output_beam.N,
-                                     beamline=S4Beamline(light_source=light_source))
+                                     beamline=ShadowBeamline(light_source=light_source))
 
             self.send("Shadow Data", output_data)
             self.send("Trigger", TriggerIn(new_object=True))
@@ -149,6 +151,9 @@ class BeamFileReader(GenericElement, TriggerToolsDecorator, WidgetDecorator):
             except: pass
             self.prompt_exception(exception)
 
+    def run_shadow4(self): # triggers
+        self.read_file()
+
     def get_lightsource(self):
         return S4LightSourceFromFile(
             name=self.name,
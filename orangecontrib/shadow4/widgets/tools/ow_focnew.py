@@ -7,9 +7,9 @@ from PyQt5.QtWidgets import QApplication, QMessageBox
 from orangewidget import gui
 from orangewidget.settings import Setting
 from oasys.widgets import gui as oasysgui
-from oasys.util.oasys_util import EmittingStream
 
 from orangecontrib.shadow4.widgets.gui.ow_automatic_element import AutomaticElement
+from orangecontrib.shadow4.widgets.gui.log_sink import LogSink
 from orangecontrib.shadow4.util.shadow4_objects import ShadowData
 from orangecontrib.shadow4.util.shadow4_util import ShadowCongruence
 from orangecontrib.shadow4.widgets.gui.plots import plot_multi_data1D
@@ -120,6 +120,8 @@ class FocNew(AutomaticElement):
         out_box = oasysgui.widgetBox(tab_out, "System Output", addSpace=True, orientation="horizontal", width = self.IMAGE_WIDTH-20, ) # height = self.IMAGE_HEIGHT-20)
         out_box.layout().addWidget(self.shadow_output)
 
+        self.log_sink = LogSink(self.shadow_output, parent=self)
+
         self.set_visibility()
 
 
@@ -137,9 +139,9 @@ class FocNew(AutomaticElement):
 
         try:
             set_verbose(0)
-            sys.stdout = EmittingStream(textWritten=self.write_stdout)
+            self.log_sink.clear()
+            self.log_sink.capture_until_idle()
 
-            self.shadow_output.setText("")
             self.focnewInfo.setText("")
 
             if self.plot_canvas_x is not None:
@@ -211,13 +213,6 @@ class FocNew(AutomaticElement):
             self.input_data = input_data.duplicate()
             if self.is_automatic_run: self.calculate()
 
-    def write_stdout(self, text):
-        cursor = self.shadow_output.textCursor()
-        cursor.movePosition(QtGui.QTextCursor.End)
-        cursor.insertText(text)
-        self.shadow_output.setTextCursor(cursor)
-        self.shadow_output.ensureCursorVisible()
-
     def set_script(self):
 
         # script
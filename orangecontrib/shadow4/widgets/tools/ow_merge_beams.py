@@ -22,7 +22,6 @@ else:
 
     from oasys.widgets import gui as oasysgui, congruence
     from oasys.widgets.widget import OWWidget
-    from oasys.util.oasys_util import EmittingStream
 
     from orangewidget import widget
     from orangewidget import gui
@@ -466,19 +465,22 @@ class MergeBeams(GenericElement, TriggerToolsDecorator):
 
         self.setStatusMessage("")
         set_verbose()
-        self.shadow_output.setText("")
-        sys.stdout = EmittingStream(textWritten=self._write_stdout)
+        self._redirect_stdout()
 
         self.progressBarInit()
 
         light_source = self.get_lightsource()
 
         # script
-        script = light_source.to_python_code()
-        script += "\n\n# test plot\nfrom srxraylib.plot.gol import plot_scatter"
-        script += "\nrays = beam.get_rays()"
-        script += "\nplot_scatter(1e6 * rays[:, 0], 1e6 * rays[:, 2], title='(X,Z) in microns')"
-        self.shadow4_script.set_code(script)
+        def script():
+            script = light_source.to_python_code()
+            script += "\n\n# test plot\nfrom srxraylib.plot.gol import plot_scatter"
+            script += "\nrays = beam.get_rays()"
+            script += "\nplot_scatter(1e6 * rays[:, 0], 1e6 * rays[:, 2], title='(X,Z) in microns')"
+
+            return script
+
+        self.shadow4_script.set_code_provider(self._profiled("script generation", script))
 
         self.progressBarSet(5)
 
@@ -486,34 +488,28 @@ class MergeBeams(GenericElement, TriggerToolsDecorator):
         try:
             merged_beam = None
 
+            input_data = []
+            weights    = []
+
             for index in range(1, 11):
                 current_data: ShadowData = getattr(self, "input_data_" + str(index))
                 if not current_data is None:
-                    current_data_beam = current_data.beam.duplicate()
-
                     if self.use_weights == 1:
                         weight = getattr(self, "weight_input_data_" + str(index))
                         if weight < 0: raise ValueError(f"Weight #{index} is must be > 0]")
+                    else:
+                        weight = 1.0
 
-                        current_data_beam.apply_attenuation(numpy.sqrt(weight)) # weights are intensities!
+                    input_data.append(current_data)
+                    weights.append(weight)
 
-                    if merged_beam is None:
-                        merged_beam = current_data_beam
-                    else:
-                        merged_beam.append_beam(current_data_beam, update_column_index=True)
+            output_data = ShadowData.merge_beams(*input_data, weights=weights, light_source=light_source)
+            merged_beam = output_data.beam
 
             if O2:
-                self.Outputs.shadow_data.send(ShadowData(
-                    beamline=S4Beamline(light_source=light_source),
-                    beam=merged_beam,
-                    number_of_rays=merged_beam.N))
+                self.Outputs.shadow_data.send(output_data)
                 self.Outputs.trigger.send(TriggerIn(new_object=True))
             else:
-                output_data = ShadowData(
-                    beamline=S4Beamline(light_source=light_source),
-                    beam=merged_beam,
-                    number_of_rays=merged_beam.N)
-
                 self.send("Shadow Data", output_data)
                 self.send("Trigger", TriggerIn(new_object=True))
         except Exception as e:
@@ -2,7 +2,6 @@ import sys, os
 import time
 import numpy
 
-from PyQt5.QtGui import QTextCursor
 from PyQt5 import QtGui, QtWidgets
 from PyQt5.QtWidgets import QMessageBox
 
@@ -12,11 +11,10 @@ from oasys.widgets import gui as oasysgui
 from oasys.widgets import congruence
 from oasys.widgets.gui import ConfirmDialog, MessageDialog, selectSaveFileFromDialog
 
-from oasys.util.oasys_util import EmittingStream
-
 from orangecontrib.shadow4.util.shadow4_objects import ShadowData
 from orangecontrib.shadow4.util.shadow4_util import ShadowCongruence, ShadowPlot
 from orangecontrib.shadow4.widgets.gui.ow_automatic_element import AutomaticElement
+from orangecontrib.shadow4.widgets.gui.log_sink import LogSink
 from orangecontrib.shadow4.util.python_script import PythonScript
 
 from shadow4.beam.s4_beam import S4Beam
@@ -24,8 +22,6 @@ from shadow4.beam.s4_beam import S4Beam
 from silx.gui.plot.ScatterView import ScatterView
 from silx.gui.colors import Colormap
 
-from oasys.util.oasys_util import EmittingStream
-
 
 try:
     import OpenGL
@@ -200,6 +196,8 @@ class PlotScatter(AutomaticElement):
         out_box = gui.widgetBox(out_tab, "System Output", addSpace=True, orientation="horizontal")
         out_box.layout().addWidget(self.shadow_output)
 
+        self.log_sink = LogSink(self.shadow_output, parent=self)
+
         self.set_visibility()
 
     def set_shadow_data(self, shadow_data: ShadowData):
@@ -218,13 +216,6 @@ class PlotScatter(AutomaticElement):
             else:
                 MessageDialog.message(self, "Data not displayable: bad content", "Error", "critical")
 
-    def writeStdOut(self, text):
-        cursor = self.shadow_output.textCursor()
-        cursor.movePosition(QTextCursor.End)
-        cursor.insertText(text)
-        self.shadow_output.setTextCursor(cursor)
-        self.shadow_output.ensureCursorVisible()
-
     def retrace_beam(self, new_shadow_beam: S4Beam, dist):
         new_shadow_beam.retrace(dist)
 
@@ -380,7 +371,7 @@ plt.show()
         try:
             plotted = False
 
-            sys.stdout = EmittingStream(textWritten=self.writeStdOut)
+            self.log_sink.capture_until_idle()
 
             if ShadowCongruence.check_empty_data(self.input_data):
                 ShadowPlot.set_conversion_active(self.is_conversion_active())
@@ -402,7 +393,7 @@ plt.show()
                 grabber.stop()
 
                 for row in grabber.ttyData:
-                    self.writeStdOut(row)
+                    self.log_sink.write(row)
 
             time.sleep(0.5)  # prevents a misterious dead lock in the Orange cycle when refreshing the histogram
 
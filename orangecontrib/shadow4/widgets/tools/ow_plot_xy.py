@@ -3,18 +3,19 @@ import time
 import numpy
 import copy
 
-from PyQt5.QtGui import QTextCursor
 from orangewidget import gui
 from orangewidget.settings import Setting
 from oasys.widgets import gui as oasysgui
 from oasys.widgets import congruence
 from oasys.widgets.gui import ConfirmDialog, MessageDialog, selectSaveFileFromDialog
 
-from oasys.util.oasys_util import EmittingStream
 
 from orangecontrib.shadow4.util.shadow4_objects import ShadowData
 from orangecontrib.shadow4.util.shadow4_util import ShadowCongruence, ShadowPlot
+from orangecontrib.shadow4.util.shadow4_statistics import ShadowBeamStatistics
+from orangecontrib.shadow4.util.shadow4_adaptive import run_until_converged, run_until_good_rays
 from orangecontrib.shadow4.widgets.gui.ow_automatic_element import AutomaticElement
+from orangecontrib.shadow4.widgets.gui.log_sink import LogSink
 from orangecontrib.shadow4.util.python_script import PythonScript
 
 from shadow4.beam.s4_beam import S4Beam
@@ -62,14 +63,23 @@ class _PlotXY(AutomaticElement):
     keep_result              = Setting(0)
     autosave_partial_results = Setting(0)
 
+    convergence              = Setting(0)
+    convergence_tolerance    = Setting(0.01)
+    convergence_increment    = Setting(100000)
+    convergence_time_budget  = Setting(60.0)
+    convergence_maximum_rays = Setting(10000000)
+    convergence_good_rays    = Setting(100000)
+
     cumulated_ticket = None
     plotted_ticket   = None
     autosave_file    = None
     autosave_prog_id = 0
 
-    def __init__(self, allow_retrace=True):
+    def __init__(self, allow_retrace=True, allow_convergence=True):
         super().__init__()
 
+        self.allow_convergence = allow_convergence
+
         button_box = oasysgui.widgetBox(self.controlArea, "", addSpace=False, orientation="horizontal")
 
         gui.button(button_box, self, "Refresh", callback=self.plot_results, height=45)
@@ -187,6 +197,24 @@ class _PlotXY(AutomaticElement):
                                          items=["No", "Yes"],
                                          sendSelectedValue=False, orientation="horizontal")
 
+        if allow_convergence:
+            convergence_box = oasysgui.widgetBox(tab_gen, "Additional Rays", addSpace=True, orientation="vertical", height=150)
+
+            gui.comboBox(convergence_box, self, "convergence", label="Add rays", labelWidth=200,
+                         items=["No", "Until converged", "Until N good rays"], sendSelectedValue=False, orientation="horizontal", callback=self.set_convergence)
+
+            self.convergence_box_1 = oasysgui.widgetBox(convergence_box, "", addSpace=False, orientation="vertical")
+            self.convergence_box_2 = oasysgui.widgetBox(self.convergence_box_1, "", addSpace=False, orientation="vertical")
+            self.convergence_box_3 = oasysgui.widgetBox(self.convergence_box_1, "", addSpace=False, orientation="vertical")
+
+            oasysgui.lineEdit(self.convergence_box_2, self, "convergence_tolerance", "Tolerance (relative change)", labelWidth=250, valueType=float, orientation="horizontal")
+            oasysgui.lineEdit(self.convergence_box_3, self, "convergence_good_rays", "Good rays (lost rays are dropped)", labelWidth=250, valueType=int, orientation="horizontal")
+            oasysgui.lineEdit(self.convergence_box_1, self, "convergence_increment", "Rays per increment", labelWidth=250, valueType=int, orientation="horizontal")
+            oasysgui.lineEdit(self.convergence_box_1, self, "convergence_time_budget", "Time budget [s]", labelWidth=250, valueType=float, orientation="horizontal")
+            oasysgui.lineEdit(self.convergence_box_1, self, "convergence_maximum_rays", "Maximum number of rays", labelWidth=250, valueType=int, orientation="horizontal")
+
+            self.set_convergence()
+
         self.set_autosave()
 
         self.main_tabs = oasysgui.tabWidget(self.mainArea)
@@ -208,6 +236,8 @@ class _PlotXY(AutomaticElement):
         out_box = gui.widgetBox(out_tab, "System Output", addSpace=True, orientation="horizontal")
         out_box.layout().addWidget(self.shadow_output)
 
+        self.log_sink = LogSink(self.shadow_output, parent=self)
+
     def clear_results(self, interactive=True):
         if not interactive: proceed = True
         else: proceed = ConfirmDialog.confirmed(parent=self)
@@ -230,6 +260,11 @@ class _PlotXY(AutomaticElement):
 
         self.cb_autosave_partial_results.setEnabled(self.autosave==1 and self.keep_result==1)
 
+    def set_convergence(self):
+        self.convergence_box_1.setVisible(self.convergence > 0)
+        self.convergence_box_2.setVisible(self.convergence == 1)
+        self.convergence_box_3.setVisible(self.convergence == 2)
+
     def set_x_column_index(self):
         self.__change_labels(dir='x')
 
@@ -420,6 +455,10 @@ plot_image_with_histograms(ticket['histogram'], ticket['bin_h_center'], ticket['
 
         self.set_script(x_range, y_range)
 
+        if self.allow_convergence and self.convergence > 0:
+            self.plot_xy_with_more_rays(beam_to_plot, var_x, var_y, title, xtitle, ytitle, xum, yum, x_range, y_range)
+            return
+
         self.replace_plot(beam_to_plot, var_x, var_y, title, xtitle, ytitle,
                           x_range=x_range,
                           y_range=y_range,
@@ -430,6 +469,56 @@ plot_image_with_histograms(ticket['histogram'], ticket['bin_h_center'], ticket['
                           yum=yum,
                           flux=flux)
 
+        if self.input_data.is_ensemble(): # error bars of the plotted quantities, over the seeds: on the plotted (e.g. retraced) rays
+            ensemble_data      = self.input_data.duplicate(copy_rays=False)
+            ensemble_data.beam = beam_to_plot # same rays, in the same order
+
+            print(ensemble_data.get_ensemble_report(columns=[var_x, var_y], nolost=self.rays,
+                                                    nbins=int(self.number_of_bins_h), ranges={var_x : x_range, var_y : y_range}))
+
+    def plot_xy_with_more_rays(self, beam_to_plot, var_x, var_y, title, xtitle, ytitle, xum, yum, x_range, y_range):
+        # the beamline of the input generates and traces more rays, in increments, until FWHM, sigma and intensity
+        # of the plotted columns converge (see run_until_converged), or until N good rays are collected (see
+        # run_until_good_rays: lost rays are dropped, the flux is normalized on the generated rays)
+        tolerance              = congruence.checkStrictlyPositiveNumber(self.convergence_tolerance, "Tolerance") if self.convergence == 1 else None
+        good_rays              = congruence.checkStrictlyPositiveNumber(self.convergence_good_rays, "Good rays") if self.convergence == 2 else None
+        increment              = congruence.checkStrictlyPositiveNumber(self.convergence_increment, "Rays per increment")
+        time_budget            = congruence.checkStrictlyPositiveNumber(self.convergence_time_budget, "Time budget")
+        maximum_number_of_rays = congruence.checkStrictlyPositiveNumber(self.convergence_maximum_rays, "Maximum number of rays")
+
+        input_data       = self.input_data
+        nolost           = self.rays
+        nbins            = int(self.number_of_bins_h)
+        retrace_distance = self.image_plane_new_position if self.image_plane == 1 else None
+
+        def calculation(monitor): # in a worker thread
+            if good_rays is None:
+                return run_until_converged(input_data, beam_to_plot, [var_x, var_y], {var_x : x_range, var_y : y_range},
+                                           nbins=nbins, nolost=nolost, tolerance=tolerance, increment=increment, time_budget=time_budget,
+                                           maximum_number_of_rays=maximum_number_of_rays, retrace_distance=retrace_distance, monitor=monitor)
+            else:
+                output_data, stop_reason = run_until_good_rays(input_data, beam_to_plot, good_rays, increment=increment, time_budget=time_budget,
+                                                               maximum_number_of_rays=maximum_number_of_rays, retrace_distance=retrace_distance, monitor=monitor)
+                return output_data, None, stop_reason
+
+        def completion(result):
+            output_data, convergence, stop_reason = result
+
+            if convergence is None: print("Good rays: %d of %d generated rays (%s)" % (output_data.get_number_of_rays(1), output_data.get_number_of_generated_rays(), stop_reason))
+            else:                   print(convergence.get_report(stop_reason))
+
+            self.replace_plot(output_data.beam, var_x, var_y, title, xtitle, ytitle,
+                              x_range=x_range,
+                              y_range=y_range,
+                              nbins_h=int(self.number_of_bins_h),
+                              nbins_v=int(self.number_of_bins_v),
+                              nolost=nolost,
+                              xum=xum,
+                              yum=yum,
+                              flux=output_data.get_flux(nolost=nolost))
+
+        self._run_in_background(calculation, completion)
+
     def get_ranges(self, beam_to_plot, var_x, var_y):
         factor1 = ShadowPlot.get_factor(var_x)
         factor2 = ShadowPlot.get_factor(var_y)
@@ -438,9 +527,7 @@ plot_image_with_histograms(ticket['histogram'], ticket['bin_h_center'], ticket['
             congruence.checkLessThan(self.x_range_min, self.x_range_max, "X range min", "X range max")
             x_range = [self.x_range_min / factor1, self.x_range_max / factor1]
         else:
-            x, y = beam_to_plot.get_columns((var_x, var_y), nolost=self.rays)
-            x_max = x.max()
-            x_min = x.min()
+            x_min, x_max = ShadowBeamStatistics.get(beam_to_plot).get_column_range(var_x, nolost=self.rays)
             if numpy.abs(x_max - x_min) < 1e-10:
                 x_min -= 1e-10
                 x_max -= 1e-10
@@ -450,9 +537,7 @@ plot_image_with_histograms(ticket['histogram'], ticket['bin_h_center'], ticket['
             congruence.checkLessThan(self.y_range_min, self.y_range_max, "Y range min", "Y range max")
             y_range = [self.y_range_min / factor2, self.y_range_max / factor2]
         else:
-            x, y = beam_to_plot.get_columns((var_x, var_y), nolost=self.rays)
-            y_max = y.max()
-            y_min = y.min()
+            y_min, y_max = ShadowBeamStatistics.get(beam_to_plot).get_column_range(var_y, nolost=self.rays)
             if numpy.abs(y_max - y_min) < 1e-10:
                 y_min -= 1e-10
                 y_max -= 1e-10
@@ -486,7 +571,7 @@ plot_image_with_histograms(ticket['histogram'], ticket['bin_h_center'], ticket['
         try:
             plotted = False
 
-            sys.stdout = EmittingStream(textWritten=self.writeStdOut)
+            self.log_sink.capture_until_idle()
 
             if ShadowCongruence.check_empty_data(self.input_data):
                 ShadowPlot.set_conversion_active(self.is_conversion_active())
@@ -532,13 +617,6 @@ plot_image_with_histograms(ticket['histogram'], ticket['bin_h_center'], ticket['
 
         return x, y, auto_x_title, auto_y_title, xum, yum
 
-    def writeStdOut(self, text):
-        cursor = self.shadow_output.textCursor()
-        cursor.movePosition(QTextCursor.End)
-        cursor.insertText(text)
-        self.shadow_output.setTextCursor(cursor)
-        self.shadow_output.ensureCursorVisible()
-
     def retrace_beam(self, new_shadow_beam: S4Beam, dist):
         new_shadow_beam.retrace(dist)
 
@@ -6,6 +6,7 @@ from oasys.widgets.gui import MessageDialog
 
 from orangecontrib.shadow4.util.shadow4_objects import ShadowData
 from orangecontrib.shadow4.util.shadow4_util import ShadowCongruence
+from orangecontrib.shadow4.util.shadow4_footprint import ShadowFootprint
 
 from orangecontrib.shadow4.widgets.tools.ow_plot_xy import _PlotXY
 
@@ -24,11 +25,11 @@ class PlotXYFootprint(_PlotXY):
     image_plane_new_position = Setting(0.0)
 
     def __init__(self):
-        super().__init__(allow_retrace=False)
+        super().__init__(allow_retrace=False, allow_convergence=False)
 
     def set_shadow_data(self, shadow_data : ShadowData):
         if ShadowCongruence.check_empty_data(shadow_data):
-            if ShadowCongruence.check_empty_beam(shadow_data.footprint):
+            if shadow_data.has_footprint():
                 self.input_data = shadow_data
                 if self.is_automatic_run: self.plot_results()
             else:
@@ -38,6 +39,11 @@ class PlotXYFootprint(_PlotXY):
         if return_str:
             return "footprint"
         else:
+            # footprints keep X, Y, flag and intensity only
+            for column in [self.x_column_index + 1, self.y_column_index + 1]:
+                if not ShadowFootprint.has_column(column): raise ValueError("Column " + str(column) + " not available in footprints (X, Y, flag and intensity only)")
+            if not self.weight_column_index in [0, 23]: raise ValueError("Footprints can be weighted by intensity only")
+
             return self.input_data.footprint
 
 if __name__ == "__main__":
@@ -118,7 +118,9 @@ ENTRY_POINTS = {
             "SHADOW4 Tools = orangecontrib.shadow4.widgets.tools",
             "SHADOW3 \u21d4 SHADOW4 = orangecontrib.shadow4.widgets.compatibility",
     ),
-    'oasys.menus' : ("shadow4menu = orangecontrib.shadow4.menu",)
+    'oasys.menus' : ("shadow4menu = orangecontrib.shadow4.menu",),
+    'console_scripts' : ("shadow4-batch = orangecontrib.shadow4.util.shadow4_batch:main",
+                         "shadow4-benchmark = orangecontrib.shadow4.benchmarks.shadow4_benchmarks:main"),
     }
 
 if __name__ == '__main__':